@@ -0,0 +1,138 @@
+'''Delayed-coincidence tagging, e.g. for 214Bi-214Po decays and retriggers.
+
+A prompt event and a delayed event form a pair if the delayed event follows
+within a time window and, optionally, within a distance. Prompt and delayed
+candidates are each selected with a cut, e.g. for BiPo214 a high-energy
+prompt (the 214Bi beta) and an alpha-like delayed energy, or for retriggers
+``evIndex > 0`` as the delayed cut.
+
+Pairs are found across a whole dataset without loops over events: the
+delayed candidates are sorted by time once, the window of each prompt event
+is located with a binary search (``searchsorted``), and the candidate pairs
+in all the windows are expanded and checked for distance as arrays. Prompt
+events are processed in blocks, to bound the memory used by the pairs.
+
+The result is stored as an extra column (by default ``coincidence``, see
+COLUMN), with bit 1 set for prompt events and bit 2 for delayed events in a
+pair. It can be used in cuts like any branch, so ``coincidence == 0`` vetoes
+both (see ``rootutils.make_roi_cut``).
+
+Times are in the units of the ``time`` branch, and distances in mm.
+'''
+
+import numpy as np
+from chocula import cuts
+
+# Name of the column with the tags
+COLUMN = 'coincidence'
+
+# Tag bits
+PROMPT = 1
+DELAYED = 2
+
+
+def find_pairs(time, prompt, delayed, window, distance=None, position=None,
+               block_size=100000):
+    '''Find prompt-delayed pairs of events.
+
+    :param time: Array of event times
+    :param prompt: Array of indices of the prompt candidates
+    :param delayed: Array of indices of the delayed candidates
+    :param window: The (min, max) time from the prompt to the delayed event
+    :param distance: Maximum distance between the events, or None
+    :param position: A (x, y, z) tuple of position arrays, for distance
+    :param block_size: Number of prompt events to process at once
+    :returns: A (prompt indices, delayed indices) tuple of arrays, one entry
+              per pair
+    '''
+    time = np.asarray(time, dtype=np.float64)
+    prompt = np.asarray(prompt, dtype=np.intp)
+    delayed = np.asarray(delayed, dtype=np.intp)
+
+    delayed = delayed[np.argsort(time[delayed], kind='mergesort')]
+    delayed_time = time[delayed]
+
+    pairs_prompt, pairs_delayed = [], []
+    for start in range(0, len(prompt), block_size):
+        block = prompt[start:start + block_size]
+        t = time[block]
+        low = np.searchsorted(delayed_time, t + window[0], 'left')
+        high = np.searchsorted(delayed_time, t + window[1], 'right')
+        n = np.maximum(high - low, 0)
+        if not n.any():
+            continue
+
+        # Expand the windows into (prompt, position in sorted delayed) pairs
+        first = np.repeat(np.cumsum(n) - n, n)
+        p = np.repeat(block, n)
+        d = delayed[np.arange(n.sum()) - first + np.repeat(low, n)]
+
+        keep = p != d
+        if distance is not None:
+            d2 = np.zeros(len(p))
+            for x in position:
+                d2 += np.square(np.asarray(x[p], dtype=np.float64) - x[d])
+            keep &= d2 <= distance**2
+
+        pairs_prompt.append(p[keep])
+        pairs_delayed.append(d[keep])
+
+    if not pairs_prompt:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+    return np.concatenate(pairs_prompt), np.concatenate(pairs_delayed)
+
+
+def tag(events, n, window, distance=None, prompt='', delayed=''):
+    '''Tag the prompt and delayed events of coincident pairs.
+
+    :param events: Mapping from branch name to array, with ``time`` and,
+                   for a distance, ``posx``, ``posy`` and ``posz``
+    :param n: Number of events
+    :param window: The (min, max) time from the prompt to the delayed event
+    :param distance: Maximum distance between the events (mm), or None
+    :param prompt: A ROOT TCut string selecting prompt candidates
+    :param delayed: A ROOT TCut string selecting delayed candidates
+    :returns: An int8 array of tags (see PROMPT and DELAYED)
+    '''
+    position = None
+    if distance is not None:
+        position = (events['posx'], events['posy'], events['posz'])
+
+    p, d = find_pairs(events['time'], cuts.select(prompt, events, n),
+                      cuts.select(delayed, events, n), window, distance,
+                      position)
+
+    tags = np.zeros(n, dtype=np.int8)
+    tags[p] |= PROMPT
+    tags[d] |= DELAYED
+    return tags
+
+
+def tag_signals(signals, window, distance=None, prompt='', delayed='',
+                column=COLUMN):
+    '''Tag coincidences in loaded datasets, adding a column for cuts.
+
+    :param signals: List of loaded Signals and Chains
+    :param window: The (min, max) time from the prompt to the delayed event
+    :param distance: Maximum distance between the events (mm), or None
+    :param prompt: A ROOT TCut string selecting prompt candidates
+    :param delayed: A ROOT TCut string selecting delayed candidates
+    :param column: Name of the column to store the tags in
+    :returns: A list of (name, prompt events, delayed events) tuples with the
+              number of tagged events in each Signal
+    '''
+    tagged = []
+    for signal in signals:
+        for leaf in signal.leaves():
+            if 'time' not in leaf.events:
+                raise KeyError('Dataset %s has no time branch' % leaf.name)
+            tags = tag(leaf.events, leaf.nevents, window, distance, prompt,
+                       delayed)
+            leaf.events.add_column(column, tags)
+
+            # Cached selections may have used an earlier tagging
+            leaf.selections.clear()
+
+            tagged.append((leaf.name, np.count_nonzero(tags & PROMPT),
+                           np.count_nonzero(tags & DELAYED)))
+    return tagged
@@ -1,36 +1,152 @@
 '''Utilities to do the counting of events in a dataset.'''
 
-import itertools
 import multiprocessing
+import numpy as np
+from chocula import shared
+from chocula import partials
 
-def _count_signal((signal, cut)):
-    return signal.count(cut=cut)
+def _count_signal((signal, cut, live_time, out, index)):
+    out[index] = signal.count(live_time=live_time, cut=cut)[0][1]
+    return signal.selections.added
 
-def count(signals, cut, processes=None):
+def _summarize(name, nominal, counts):
+    std = np.std(counts, axis=0)
+    if np.ndim(nominal) == 0:
+        return name, float(nominal), float(std)
+    return name, np.array(nominal), std
+
+def _estimate_signal((signal, precision, cut, live_time, zero_bound,
+                      chunk_size, seed)):
+    random_state = np.random.RandomState(seed)
+    return signal.estimate(precision, live_time, cut, zero_bound,
+                           chunk_size, random_state)
+
+def count(signals, cut, processes=None, live_time=1):
     '''Count the number of events that pass a cut.
 
+    With multiple processes, each worker maps the signals' shared event arrays
+    and writes its result into a shared output buffer, so neither the data nor
+    the results are copied between processes. Signals whose events are not
+    loaded (see loader.load) are counted from per-file partial results, so
+    only their new or changed files are read.
+
+    :param signals: List of Signals and Chains
+    :param cut: A ROOT TCut string
+    :param processes: Number of parallel processes
+    :param live_time: Live time in years, or a list of live times which are
+                      all counted from one selection
+    :returns: A dict with the counts for each signal, each an array if
+              live_time is a list
+    '''
+    leaves = [leaf for signal in signals for leaf in signal.leaves()]
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    # The output buffer is unlinked once the results are copied out
+    with shared.zeros((len(leaves),) + np.shape(live_time)) as out:
+        # Cannot give multiple arguments to multiprocessing's map, so create
+        # a list of (signal, cut, live time, output, index) tuples for the
+        # mapping function
+        tasks = [(leaf, cut, live_time, out, i)
+                 for i, leaf in enumerate(leaves) if leaf.events is not None]
+
+        if processes > 1:
+            pool = multiprocessing.Pool(processes)
+            selections = pool.map(_count_signal, tasks, chunksize=1)
+            pool.close()
+
+            # Keep the workers' selections for later cuts on the same events
+            for task, added in zip(tasks, selections):
+                task[0].selections.update(added)
+        else:
+            map(_count_signal, tasks)
+
+        unloaded = [i for i, leaf in enumerate(leaves)
+                    if leaf.events is None]
+        if unloaded:
+            counts = partials.count([leaves[i] for i in unloaded], cut,
+                                    live_time, processes=processes)
+            for i, (name, c) in zip(unloaded, counts):
+                out[i] = c
+
+        if np.ndim(live_time) == 0:
+            return [(leaf.name, float(c)) for leaf, c in zip(leaves, out)]
+        return [(leaf.name, np.array(c)) for leaf, c in zip(leaves, out)]
+
+
+def bootstrap(signals, cut, replicas=100, live_time=1, seed=None,
+              processes=None):
+    '''Count events that pass a cut, with the MC statistical uncertainty.
+
+    The uncertainty from the finite number of simulated events is estimated
+    with a Poisson bootstrap (see Signal.bootstrap). Chains are summed
+    replica by replica from their leaves.
+
+    :param signals: List of Signals and Chains
+    :param cut: A ROOT TCut string
+    :param replicas: Number of bootstrap replicas
+    :param live_time: Live time in years, or a list of live times
+    :param seed: Random seed, for reproducible replicas
+    :param processes: Number of parallel processes for the selection
+    :returns: A list of (name, count, standard deviation) tuples for each
+              individual Signal, followed by each Chain after its Signals,
+              with the nominal count (as from count) and the standard
+              deviation of the replicas, and arrays if live_time is a list
+    '''
+    # Select the events in parallel; replicas only need the cached selections
+    nominal = dict(count(signals, cut, processes, live_time))
+
+    random_state = np.random.RandomState(seed)
+    results = []
+    for signal in signals:
+        total = total_nominal = 0
+        for leaf in signal.leaves():
+            counts = leaf.bootstrap(replicas, live_time, cut, random_state)
+            results.append(_summarize(leaf.name, nominal[leaf.name], counts))
+            total = total + counts
+            total_nominal = total_nominal + nominal[leaf.name]
+        if signal.leaves() != [signal]:
+            results.append(_summarize(signal.name, total_nominal, total))
+
+    return results
+
+
+def estimate(signals, cut, precision, live_time=1, zero_bound=None,
+             chunk_size=100000, seed=None, processes=None):
+    '''Quickly estimate the number of events that pass a cut.
+
+    Each Signal is sampled in random chunks until its count reaches the
+    target precision (see Signal.estimate), which is much faster than a full
+    count for a first look at a table.
+
     :param signals: List of Signals and Chains
     :param cut: A ROOT TCut string
+    :param precision: Target relative error
+    :param live_time: Live time in years, or a list of live times
+    :param zero_bound: Stop once the upper limit on a count is this small
+    :param chunk_size: Number of events per chunk
+    :param seed: Random seed for the chunk order
     :param processes: Number of parallel processes
-    :returns: A dict with the counts for each signal
+    :returns: A list of (name, estimate, error, fraction read) tuples for
+              each individual Signal, where the error is a 90% CL upper
+              limit if no events passed
     '''
-    counts = []
+    leaves = [leaf for signal in signals for leaf in signal.leaves()]
 
     if processes is None:
         processes = multiprocessing.cpu_count()
 
-    if processes > 1:
-        pool = multiprocessing.Pool(processes)
+    if seed is None:
+        seed = np.random.randint(2**31)
 
-        # Cannot give multiple arguments to multiprocessing's map, so create a
-        # list of (signal, cut) tuples and pass those to the mapping function
-        signal_cut = itertools.product(signals, [cut])
-        individual_counts = pool.map(_count_signal, signal_cut)
+    tasks = [(leaf, precision, cut, live_time, zero_bound, chunk_size,
+              [seed, i]) for i, leaf in enumerate(leaves)]
 
-        counts = [item for sublist in individual_counts for item in sublist]
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        results = pool.map(_estimate_signal, tasks, chunksize=1)
+        pool.close()
     else:
-        for signal in signals:
-            counts.extend(signal.count(cut=cut))
-
-    return counts
+        results = map(_estimate_signal, tasks)
 
+    return [(leaf.name,) + r for leaf, r in zip(leaves, results)]
@@ -0,0 +1,407 @@
+'''Evaluate ROOT TCut-style selection strings on arrays of event data.
+
+Supports the subset of the TTreeFormula language that chocula uses (see
+``rootutils.build_tcut``): branch names, numbers, ``&&``, ``||``, ``!``,
+comparisons, arithmetic, parentheses, and a few math functions such as
+``sqrt``. Operator precedence follows C.
+'''
+
+import re
+import collections
+import numpy as np
+from chocula import shared
+
+FUNCTIONS = {
+    'sqrt': np.sqrt,
+    'abs': np.abs,
+    'fabs': np.abs,
+    'exp': np.exp,
+    'log': np.log,
+    'pow': np.power,
+    'TMath::Sqrt': np.sqrt,
+    'TMath::Abs': np.abs,
+    'TMath::Exp': np.exp,
+    'TMath::Log': np.log,
+    'TMath::Power': np.power,
+}
+
+_BINARY = {
+    '+': np.add,
+    '-': np.subtract,
+    '*': np.multiply,
+    '/': np.true_divide,
+    '<': np.less,
+    '>': np.greater,
+    '<=': np.less_equal,
+    '>=': np.greater_equal,
+    '==': np.equal,
+    '!=': np.not_equal,
+}
+
+_token_re = re.compile(r'''\s*(?:
+    (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?) |
+    (?P<name>[A-Za-z_][A-Za-z0-9_]*(?:::[A-Za-z_][A-Za-z0-9_]*)*) |
+    (?P<op>&&|\|\||==|!=|<=|>=|[-+*/<>!(),])
+    )''', re.VERBOSE)
+
+
+def _tokenize(cut):
+    tokens = []
+    pos = 0
+    cut = cut.rstrip()
+    while pos < len(cut):
+        m = _token_re.match(cut, pos)
+        if m is None:
+            raise ValueError('Cannot parse cut at "%s"' % cut[pos:])
+        kind = m.lastgroup
+        tokens.append((kind, m.group(kind)))
+        pos = m.end()
+    return tokens
+
+
+class _Parser(object):
+    '''Recursive descent parser producing a tuple-based syntax tree.'''
+    def __init__(self, cut):
+        self.cut = cut
+        self.tokens = _tokenize(cut)
+        self.pos = 0
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos][1]
+
+    def take(self, expected=None):
+        if self.pos >= len(self.tokens):
+            raise ValueError('Unexpected end of cut "%s"' % self.cut)
+        kind, value = self.tokens[self.pos]
+        if expected is not None and value != expected:
+            raise ValueError('Expected "%s" in cut "%s"' % (expected, self.cut))
+        self.pos += 1
+        return kind, value
+
+    def parse(self):
+        node = self.logical('||', 'or', self.logical_and)
+        if self.pos != len(self.tokens):
+            raise ValueError('Trailing input in cut "%s"' % self.cut)
+        return node
+
+    def logical_and(self):
+        return self.logical('&&', 'and', self.comparison)
+
+    def logical(self, op, kind, operand):
+        terms = [operand()]
+        while self.peek() == op:
+            self.take()
+            terms.append(operand())
+        return terms[0] if len(terms) == 1 else (kind, terms)
+
+    def comparison(self):
+        node = self.arithmetic(('+', '-'), self.product)
+        while self.peek() in ('<', '>', '<=', '>=', '==', '!='):
+            op = self.take()[1]
+            node = ('binary', op, node, self.arithmetic(('+', '-'),
+                                                        self.product))
+        return node
+
+    def product(self):
+        return self.arithmetic(('*', '/'), self.unary)
+
+    def arithmetic(self, ops, operand):
+        node = operand()
+        while self.peek() in ops:
+            op = self.take()[1]
+            node = ('binary', op, node, operand())
+        return node
+
+    def unary(self):
+        if self.peek() == '!':
+            self.take()
+            return ('not', self.unary())
+        if self.peek() == '-':
+            self.take()
+            return ('negative', self.unary())
+        if self.peek() == '+':
+            self.take()
+            return self.unary()
+        return self.atom()
+
+    def atom(self):
+        kind, value = self.take()
+        if kind == 'number':
+            return ('number', float(value))
+        if kind == 'name':
+            if self.peek() == '(':
+                self.take()
+                args = [self.logical('||', 'or', self.logical_and)]
+                while self.peek() == ',':
+                    self.take()
+                    args.append(self.logical('||', 'or', self.logical_and))
+                self.take(')')
+                if value not in FUNCTIONS:
+                    raise ValueError('Unknown function "%s"' % value)
+                return ('call', value, args)
+            return ('column', value)
+        if value == '(':
+            node = self.logical('||', 'or', self.logical_and)
+            self.take(')')
+            return node
+        raise ValueError('Unexpected "%s" in cut "%s"' % (value, self.cut))
+
+
+def _radius_comparison(node, events):
+    '''Compare the squared radius, if available, rather than the radius.'''
+    if (node[1] in ('<', '>', '<=', '>=') and node[2] == _RADIUS and
+            node[3][0] == 'number' and node[3][1] >= 0):
+        try:
+            r2 = events['r2']
+        except KeyError:
+            return None
+        return _BINARY[node[1]](r2, np.square(node[3][1]))
+
+
+def _evaluate(node, events):
+    kind = node[0]
+    if kind == 'column':
+        return events[node[1]]
+    if kind == 'number':
+        return node[1]
+    if kind == 'binary':
+        result = _radius_comparison(node, events)
+        if result is not None:
+            return result
+        return _BINARY[node[1]](_evaluate(node[2], events),
+                                _evaluate(node[3], events))
+    if kind == 'and':
+        result = _evaluate(node[1][0], events)
+        for term in node[1][1:]:
+            result = np.logical_and(result, _evaluate(term, events))
+        return result
+    if kind == 'or':
+        result = _evaluate(node[1][0], events)
+        for term in node[1][1:]:
+            result = np.logical_or(result, _evaluate(term, events))
+        return result
+    if kind == 'not':
+        return np.logical_not(_evaluate(node[1], events))
+    if kind == 'negative':
+        return np.negative(_evaluate(node[1], events))
+    if kind == 'call':
+        return FUNCTIONS[node[1]](*[_evaluate(a, events) for a in node[2]])
+
+
+def _format(node):
+    kind = node[0]
+    if kind == 'column':
+        return node[1]
+    if kind == 'number':
+        return repr(node[1])
+    if kind == 'binary':
+        return '(%s %s %s)' % (_format(node[2]), node[1], _format(node[3]))
+    if kind in ('and', 'or'):
+        op = ' && ' if kind == 'and' else ' || '
+        return '(%s)' % op.join(_format(term) for term in node[1])
+    if kind == 'not':
+        return '!' + _format(node[1])
+    if kind == 'negative':
+        return '-' + _format(node[1])
+    if kind == 'call':
+        return '%s(%s)' % (node[1], ', '.join(_format(a) for a in node[2]))
+
+
+_parsed = {}
+
+def parse(cut):
+    '''Parse a cut string into a syntax tree (memoized).
+
+    :param cut: A ROOT TCut string
+    :returns: A nested tuple syntax tree, or None for an empty cut
+    '''
+    cut = cut.strip()
+    if cut not in _parsed:
+        _parsed[cut] = _Parser(cut).parse() if cut else None
+    return _parsed[cut]
+
+
+# The radius, as written by rootutils.build_tcut
+_RADIUS = parse('sqrt(posx*posx + posy*posy + posz*posz)')
+
+
+def mask(cut, events, n):
+    '''Evaluate a cut on event data.
+
+    :param cut: A ROOT TCut string
+    :param events: Mapping from branch name to array
+    :param n: Number of events
+    :returns: A boolean array of length n, True for passing events
+    '''
+    node = parse(cut)
+    if node is None:
+        return np.ones(n, dtype=bool)
+    result = np.asarray(_evaluate(node, events))
+    return np.broadcast_to(result != 0, (n,))
+
+
+def select(cut, events, n):
+    '''Find the events that pass a cut.
+
+    :param cut: A ROOT TCut string
+    :param events: Mapping from branch name to array
+    :param n: Number of events
+    :returns: Array of indices of passing events
+    '''
+    return np.flatnonzero(mask(cut, events, n))
+
+
+def columns(cut):
+    '''Find the branches that a cut uses.
+
+    :param cut: A ROOT TCut string
+    :returns: A set of branch names
+    '''
+    def walk(node):
+        if node[0] == 'column':
+            return set([node[1]])
+        children = []
+        if node[0] in ('and', 'or'):
+            children = node[1]
+        elif node[0] == 'call':
+            children = node[2]
+        elif node[0] == 'binary':
+            children = node[2:]
+        elif node[0] in ('not', 'negative'):
+            children = node[1:]
+        return set().union(*[walk(c) for c in children])
+
+    node = parse(cut)
+    return set() if node is None else walk(node)
+
+
+def terms(cut):
+    '''Split a cut into its top-level "&&" terms.
+
+    Terms are normalized, so that equivalent cuts written with different
+    spacing, parentheses or number formatting give the same strings.
+
+    :param cut: A ROOT TCut string
+    :returns: A list of normalized term strings, in order
+    '''
+    node = parse(cut)
+    if node is None:
+        return []
+    nodes = node[1] if node[0] == 'and' else [node]
+    return [_format(n) for n in nodes]
+
+
+class _Subset(object):
+    '''A view of event data restricted to some events.'''
+    def __init__(self, events, indices):
+        self.events = events
+        self.indices = indices
+        self.columns = {}
+
+    def __getitem__(self, name):
+        if name not in self.columns:
+            self.columns[name] = self.events[name][self.indices]
+        return self.columns[name]
+
+
+class SelectionCache(object):
+    '''Cache of the events passing cuts, for refining nested selections.
+
+    Selected event indices are stored for every prefix of the "&&" terms of
+    each cut evaluated. A new cut starts from the smallest cached selection
+    whose terms are a subset of its own and only evaluates the remaining
+    terms on those events, so e.g. an energy window on top of a fiducial
+    selection costs only a pass over the fiducial events.
+
+    Indices are kept in shared memory, so new entries can be sent back from
+    worker processes (see ``added`` and ``update``) without copying. The
+    cache that made (or received) an entry owns its backing file and unlinks
+    it when the entry is evicted or the cache is cleared; copies sent to
+    workers own nothing.
+
+    :param events: Mapping from branch name to array
+    :param n: Number of events
+    :param max_entries: Maximum number of selections to keep
+    '''
+    def __init__(self, events, n, max_entries=64):
+        self.events = events
+        self.n = n
+        self.max_entries = max_entries
+        self.selections = collections.OrderedDict()
+        self.added = {}
+        self.owned = set()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['added'] = {}
+        state['owned'] = set()
+        return state
+
+    def _release(self, key, indices):
+        if key in self.owned:
+            self.owned.discard(key)
+            if isinstance(indices, shared.SharedArray):
+                indices.unlink()
+
+    def _store(self, key, indices):
+        old = self.selections.get(key)
+        if old is not None and old is not indices:
+            self._release(key, old)
+        self.selections[key] = self.added[key] = indices
+        self.owned.add(key)
+        while len(self.selections) > self.max_entries:
+            old_key, old = self.selections.popitem(last=False)
+            self.added.pop(old_key, None)
+            self._release(old_key, old)
+
+    def clear(self):
+        '''Drop all selections, e.g. after the events changed.'''
+        for key, indices in self.selections.items():
+            self._release(key, indices)
+        self.selections.clear()
+        self.added = {}
+
+    def select(self, cut):
+        '''Find the events that pass a cut.
+
+        :param cut: A ROOT TCut string
+        :returns: Array of indices of passing events
+        '''
+        cut_terms = terms(cut)
+        key = frozenset(cut_terms)
+        if key in self.selections:
+            return self.selections[key]
+
+        parents = [k for k in self.selections if k <= key]
+        if parents:
+            done = min(parents, key=lambda k: len(self.selections[k]))
+            indices = self.selections[done]
+        else:
+            done, indices = frozenset(), None
+
+        for term in cut_terms:
+            if term in done:
+                continue
+            if indices is None:
+                indices = select(term, self.events, self.n)
+            else:
+                subset = _Subset(self.events, indices)
+                indices = indices[mask(term, subset, len(indices))]
+            done = done | set([term])
+            indices = shared.share(indices)
+            self._store(done, indices)
+
+        if indices is None:
+            return np.arange(self.n)
+
+        return indices
+
+    def update(self, selections):
+        '''Add selections made elsewhere, e.g. by a worker process.
+
+        :param selections: A dict of {frozenset of terms: indices}
+        '''
+        for key, indices in selections.items():
+            self._store(key, indices)
+        self.added = {}
@@ -0,0 +1,399 @@
+'''Counting and histogramming distributed over several machines.
+
+A coordinator splits the work into one task per data file and serves the
+tasks over TCP. Workers, on any host that can read the data files, pull
+tasks, read and select the events, and send back partial results: the
+number of selected and generated events and, optionally, the raw energy
+histogram. The coordinator sums the partials and normalizes them.
+
+Tasks are leased to workers. A worker renews its lease while it is busy; if
+the worker dies or loses its connection, the lease lapses and the task is
+given to another worker. A task that fails ``max_attempts`` times aborts the
+run.
+
+Start workers with ``chocula worker --authkey KEY host:port`` (or ``work``),
+and a run with ``chocula --coordinator port table.csv`` (or ``run``). For
+testing, ``run`` can also start worker processes on the local machine.
+
+Messages are pickled, so anyone who can connect to the coordinator could run
+code on it. The coordinator therefore listens on localhost unless another
+interface is given, requires a secret authkey (a random one is generated for
+each run unless one is given, see ``make_authkey``), and only answers calls
+to the TaskQueue methods in WORKER_METHODS.
+'''
+
+import os
+import time
+import socket
+import threading
+import collections
+import multiprocessing
+from multiprocessing.connection import Listener, Client
+import numpy as np
+from chocula import cuts
+from chocula import index
+from chocula import histogram
+from chocula import rootutils
+
+DEFAULT_PORT = 8766
+DEFAULT_HOST = 'localhost'
+
+# The TaskQueue methods that workers may call
+WORKER_METHODS = frozenset(['get', 'heartbeat', 'put', 'fail'])
+
+
+def make_authkey():
+    '''Generate a random secret for a coordinator and its workers.
+
+    :returns: A hex string
+    '''
+    return os.urandom(16).encode('hex')
+
+
+class TaskQueue(object):
+    '''A thread-safe queue of leased tasks.
+
+    :param tasks: List of task dicts, each with a unique 'id'
+    :param lease: Seconds a task stays assigned without a heartbeat
+    :param max_attempts: Number of tries before a task is a failure
+    '''
+    def __init__(self, tasks, lease=60.0, max_attempts=3):
+        self.lock = threading.Lock()
+        self.tasks = dict((t['id'], t) for t in tasks)
+        self.pending = collections.deque(t['id'] for t in tasks)
+        self.leases = {}
+        self.attempts = collections.defaultdict(int)
+        self.results = {}
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.error = None
+
+    def _requeue(self, task_id, message):
+        del self.leases[task_id]
+        if self.attempts[task_id] >= self.max_attempts:
+            self.error = 'Task %s failed: %s' % (task_id, message)
+        else:
+            self.pending.appendleft(task_id)
+
+    def _expire(self):
+        now = time.time()
+        for task_id, (worker, expiry) in self.leases.items():
+            if expiry < now:
+                self._requeue(task_id, 'lease expired (%s)' % worker)
+
+    def finished(self):
+        '''True when every task has a result, or a task has failed.'''
+        with self.lock:
+            self._expire()
+            return (self.error is not None or
+                    len(self.results) == len(self.tasks))
+
+    def get(self, worker):
+        '''Lease the next task.
+
+        :param worker: Worker identifier
+        :returns: A task dict, None if there is nothing to do right now, or
+                  'done' if the run is over
+        '''
+        with self.lock:
+            self._expire()
+            if self.error is not None or len(self.results) == len(self.tasks):
+                return 'done'
+            if not self.pending:
+                return None
+            task_id = self.pending.popleft()
+            self.attempts[task_id] += 1
+            self.leases[task_id] = (worker, time.time() + self.lease)
+            return self.tasks[task_id]
+
+    def heartbeat(self, worker, task_id):
+        '''Renew a lease.
+
+        :returns: False if the task is no longer leased to this worker
+        '''
+        with self.lock:
+            if self.leases.get(task_id, (None,))[0] != worker:
+                return False
+            self.leases[task_id] = (worker, time.time() + self.lease)
+            return True
+
+    def put(self, worker, task_id, result):
+        '''Store the result of a task.'''
+        with self.lock:
+            self.leases.pop(task_id, None)
+            if task_id in self.pending:
+                self.pending.remove(task_id)
+            self.results.setdefault(task_id, result)
+
+    def fail(self, worker, task_id, message):
+        '''Report an error processing a task, so it is retried.'''
+        with self.lock:
+            if self.leases.get(task_id, (None,))[0] == worker:
+                self._requeue(task_id, message)
+
+    def release(self, worker):
+        '''Requeue all tasks leased to a worker, e.g. on disconnection.'''
+        with self.lock:
+            for task_id, (owner, expiry) in self.leases.items():
+                if owner == worker:
+                    self._requeue(task_id, 'worker %s disconnected' % worker)
+
+
+class Coordinator(object):
+    '''Serve a TaskQueue over TCP.
+
+    :param queue: The TaskQueue
+    :param authkey: Shared secret that workers must present
+    :param address: (host, port) to listen on; port 0 picks a free port
+    '''
+    def __init__(self, queue, authkey, address=(DEFAULT_HOST, DEFAULT_PORT)):
+        if not authkey:
+            raise ValueError('An authkey is required')
+        self.queue = queue
+        self.authkey = authkey
+        self.listener = Listener(address, authkey=authkey)
+        self.port = self.listener.address[1]
+        self.running = True
+        self.thread = threading.Thread(target=self._accept)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _accept(self):
+        while self.running:
+            try:
+                conn = self.listener.accept()
+            except Exception:
+                continue
+            t = threading.Thread(target=self._handle, args=(conn,))
+            t.daemon = True
+            t.start()
+
+    def _handle(self, conn):
+        worker = None
+        try:
+            while True:
+                message = conn.recv()
+                if message[0] not in WORKER_METHODS:
+                    break
+                worker = message[1]
+                conn.send(getattr(self.queue, message[0])(*message[1:]))
+        except (EOFError, IOError, socket.error):
+            pass
+        finally:
+            conn.close()
+            if worker is not None:
+                self.queue.release(worker)
+
+    def wait(self, poll=0.5):
+        '''Wait for all tasks to finish.
+
+        :param poll: Polling interval in seconds
+        :returns: Dict of {task id: result}
+        '''
+        while not self.queue.finished():
+            time.sleep(poll)
+        if self.queue.error is not None:
+            raise RuntimeError(self.queue.error)
+        return self.queue.results
+
+    def close(self):
+        '''Stop serving.'''
+        self.running = False
+        try:
+            Client(('localhost', self.port), authkey=self.authkey).close()
+        except Exception:
+            pass
+        self.listener.close()
+
+
+def process_task(task):
+    '''Compute the partial result for a task.
+
+    :param task: A task dict with filename, tree, cut, plot_cut and binning
+    :returns: A dict with the number of selected and generated events and,
+              if binning is set, the raw histogram of plot_cut events
+    '''
+    branches = set(['energy', 'evIndex']) | cuts.columns(task['cut'])
+    if task['binning'] is not None:
+        branches |= cuts.columns(task['plot_cut'])
+
+    arrays = rootutils.read_tree(task['filename'], task['tree'],
+                                 sorted(branches))
+    n = len(arrays['energy'])
+    result = {
+        'selected': len(cuts.select(task['cut'], arrays, n)),
+        'mc_events': len(cuts.select(index.GENERATED_CUT, arrays, n)),
+    }
+
+    if task['binning'] is not None:
+        nbins, xmin, xmax = task['binning']
+        energy = arrays['energy'][cuts.select(task['plot_cut'], arrays, n)]
+        idx = histogram.bin_index(energy, nbins, xmin, xmax)
+        result['histogram'] = histogram.fill(idx, np.ones(len(idx)), nbins)
+
+    return result
+
+
+def _run_task(conn, worker, task, heartbeat):
+    out = {}
+    def target():
+        try:
+            out['result'] = process_task(task)
+        except Exception as e:
+            out['error'] = '%s: %s' % (type(e).__name__, e)
+
+    thread = threading.Thread(target=target)
+    thread.daemon = True
+    thread.start()
+    while thread.is_alive():
+        thread.join(heartbeat)
+        if thread.is_alive():
+            conn.send(('heartbeat', worker, task['id']))
+            conn.recv()
+
+    if 'error' in out:
+        conn.send(('fail', worker, task['id'], out['error']))
+    else:
+        conn.send(('put', worker, task['id'], out['result']))
+    conn.recv()
+
+
+def work(address, authkey, poll=1.0, heartbeat=10.0, once=False):
+    '''Process tasks from a coordinator.
+
+    A worker keeps going across runs, reconnecting whenever a coordinator
+    is available, unless once is set.
+
+    :param address: Coordinator (host, port)
+    :param authkey: Shared secret
+    :param poll: Seconds to wait when there is no work
+    :param heartbeat: Seconds between lease renewals while busy
+    :param once: Exit when the current run is over or unreachable
+    '''
+    worker = '%s:%i' % (socket.gethostname(), os.getpid())
+    while True:
+        try:
+            conn = Client(address, authkey=authkey)
+        except (EOFError, IOError, socket.error):
+            if once:
+                return
+            time.sleep(poll)
+            continue
+
+        try:
+            while True:
+                conn.send(('get', worker))
+                task = conn.recv()
+                if task == 'done':
+                    if once:
+                        return
+                    time.sleep(poll)
+                elif task is None:
+                    time.sleep(poll)
+                else:
+                    _run_task(conn, worker, task, heartbeat)
+        except (EOFError, IOError, socket.error):
+            if once:
+                return
+            time.sleep(poll)
+        finally:
+            conn.close()
+
+
+def run(signals, cut, live_time=1, plot_cut=None, binning=None,
+        plot_live_time=1, port=DEFAULT_PORT, authkey=None, tree_name='data',
+        lease=60.0, max_attempts=3, local_workers=0, host=DEFAULT_HOST):
+    '''Count (and histogram) events with distributed workers.
+
+    The signals need not be loaded; their data is only read by the workers.
+
+    :param signals: List of Signals and Chains
+    :param cut: A ROOT TCut string for the counts
+    :param live_time: Live time in years, or a list of live times
+    :param plot_cut: A ROOT TCut string for the histograms
+    :param binning: (nbins, xmin, xmax) of histograms, or None for counts only
+    :param plot_live_time: Live time used to scale the histograms
+    :param port: TCP port to serve tasks on, 0 for any free port
+    :param authkey: Shared secret for workers, default a random one (only
+                    useful with local_workers)
+    :param tree_name: Name of the tree in the data files
+    :param lease: Seconds before a silent worker's task is retried
+    :param max_attempts: Number of tries per task
+    :param local_workers: Number of worker processes to start on this host
+    :param host: Interface to listen on, e.g. '' for all, to let workers on
+                 other hosts connect
+    :returns: A (counts, spectra) tuple, with counts as from counting.count
+              and spectra a histogram.Spectra, or None without binning
+    '''
+    leaves = [leaf for signal in signals for leaf in signal.leaves()]
+    tasks = []
+    for i, leaf in enumerate(leaves):
+        if leaf.files is not None:
+            filenames = [f[0] for f in leaf.files]
+        else:
+            filenames = index.expand(leaf.filename)
+        for filename in filenames:
+            tasks.append({
+                'id': len(tasks),
+                'leaf': i,
+                'filename': filename,
+                'tree': tree_name,
+                'cut': cut,
+                'plot_cut': plot_cut if plot_cut is not None else cut,
+                'binning': binning,
+            })
+
+    if authkey is None:
+        authkey = make_authkey()
+
+    coordinator = Coordinator(TaskQueue(tasks, lease, max_attempts), authkey,
+                              (host, port))
+    print 'Coordinating %i tasks on port %i' % (len(tasks), coordinator.port)
+
+    workers = []
+    for i in range(local_workers):
+        p = multiprocessing.Process(target=work,
+                                    args=(('localhost', coordinator.port),
+                                          authkey, 0.1),
+                                    kwargs={'once': True})
+        p.daemon = True
+        p.start()
+        workers.append(p)
+
+    try:
+        results = coordinator.wait()
+    finally:
+        coordinator.close()
+        for p in workers:
+            p.join(1)
+
+    # Reduce the partial results for each signal
+    selected = np.zeros(len(leaves))
+    mc_events = np.zeros(len(leaves))
+    nbins = binning[0] if binning is not None else 0
+    raw = np.zeros((len(leaves), nbins))
+    for task in tasks:
+        result = results[task['id']]
+        selected[task['leaf']] += result['selected']
+        mc_events[task['leaf']] += result['mc_events']
+        if binning is not None:
+            raw[task['leaf']] += result['histogram']
+
+    counts = []
+    for i, leaf in enumerate(leaves):
+        c = leaf.exposure(live_time) * selected[i] / mc_events[i]
+        counts.append((leaf.name, float(c) if np.ndim(c) == 0 else c))
+
+    spectra = None
+    if binning is not None:
+        owner = [i for i, s in enumerate(signals) for leaf in s.leaves()]
+        weights = [leaf.exposure(plot_live_time) / mc_events[i]
+                   if raw[i].any()
+                   else 0 for i, leaf in enumerate(leaves)]
+        contents = np.zeros((len(signals), nbins))
+        np.add.at(contents, owner, raw * np.array(weights)[:, np.newaxis])
+        spectra = histogram.Spectra(signals, contents, binning[1],
+                                    binning[2], plot_live_time)
+
+    return counts, spectra
+
@@ -0,0 +1,191 @@
+'''Compact in-memory storage of event data.
+
+ROOT ntuples store everything as double precision, but most branches need
+much less. Events stores each branch with the type given by a precision
+policy, packs boolean branches (e.g. fitter-valid flags like ``scintFit``)
+into the bits of one integer array, and precomputes the squared radius
+``r2``, which ``cuts`` uses for radius cuts instead of taking square roots.
+
+A policy maps branch names to numpy type names, or to ``'flag'`` for a
+packed boolean, with the key ``'*'`` giving the default for other branches.
+The type ``'auto'`` packs a branch as a flag if its values are all 0 or 1
+and otherwise stores it as float32. Values that an integer or flag column
+cannot hold exactly (e.g. a "flag" equal to 2) promote that column to
+float32. Use FULL_PRECISION (``{'*': 'float64'}``) for full precision.
+'''
+
+import numpy as np
+from chocula import shared
+
+DEFAULT_POLICY = {
+    'energy': 'float32',
+    'posx': 'float32',
+    'posy': 'float32',
+    'posz': 'float32',
+    'evIndex': 'int8',
+    'time': 'float64',
+    '*': 'auto',
+}
+
+# Keep every branch as read from ROOT
+FULL_PRECISION = {'*': 'float64'}
+
+
+def _fits(values, dtype):
+    '''Check whether values are represented exactly by an integer type.'''
+    dtype = np.dtype(dtype)
+    if dtype.kind not in 'iub':
+        return True
+    return np.array_equal(values.astype(dtype), values)
+
+
+class Events(object):
+    '''Event data in compact columns, accessed like a dict of arrays.
+
+    :param n: Number of events
+    :param policy: Precision policy, default DEFAULT_POLICY
+    '''
+    __slots__ = ('n', 'policy', 'columns', 'flags', 'flag_bits')
+
+    def __init__(self, n, policy=None):
+        self.n = n
+        self.policy = policy if policy is not None else DEFAULT_POLICY
+        self.columns = {}
+        self.flags = None
+        self.flag_bits = {}
+
+    def __getstate__(self):
+        return dict((k, getattr(self, k)) for k in self.__slots__)
+
+    def __setstate__(self, state):
+        for k, v in state.items():
+            setattr(self, k, v)
+
+    def __len__(self):
+        return self.n
+
+    def __contains__(self, name):
+        return name in self.columns or name in self.flag_bits
+
+    def __getitem__(self, name):
+        if name in self.columns:
+            return self.columns[name]
+        if name in self.flag_bits:
+            return (self.flags & (1 << self.flag_bits[name])) != 0
+        raise KeyError(name)
+
+    def keys(self):
+        '''The names of all branches.'''
+        return self.columns.keys() + self.flag_bits.keys()
+
+    @property
+    def nbytes(self):
+        '''Memory used by the event data, in bytes.'''
+        nbytes = sum(c.nbytes for c in self.columns.values())
+        return nbytes + (self.flags.nbytes if self.flags is not None else 0)
+
+    def view(self, start, stop):
+        '''Get a range of events, without copying the data.
+
+        :param start: Index of the first event
+        :param stop: Index after the last event
+        :returns: Events for the range
+        '''
+        stop = min(stop, self.n)
+        view = Events(stop - start, self.policy)
+        view.columns = dict((k, v[start:stop])
+                            for k, v in self.columns.items())
+        if self.flags is not None:
+            view.flags = self.flags[start:stop]
+        view.flag_bits = self.flag_bits
+        return view
+
+    def add_column(self, name, values):
+        '''Store a derived column, e.g. a coincidence tag, in shared memory.
+
+        :param name: Column name, usable in cuts
+        :param values: Array with a value for each event
+        '''
+        if len(values) != self.n:
+            raise ValueError('Column %s has %i values for %i events' %
+                             (name, len(values), self.n))
+        self.flag_bits.pop(name, None)
+        self._replace(name, shared.share(values))
+
+    def _replace(self, name, column):
+        '''Store a column, unlinking the shared file of one it replaces.'''
+        old = self.columns.get(name)
+        self.columns[name] = column
+        if isinstance(old, shared.SharedArray):
+            old.unlink()
+
+    def unlink(self):
+        '''Remove the shared files of the columns, e.g. of temporary events.'''
+        for column in self.columns.values() + [self.flags]:
+            if isinstance(column, shared.SharedArray):
+                column.unlink()
+
+    def _type(self, name, values):
+        t = self.policy.get(name, self.policy.get('*', 'float64'))
+        if t == 'auto':
+            is_flag = len(values) > 0 and np.all((values == 0) | (values == 1))
+            t = 'flag' if is_flag else 'float32'
+        return t
+
+    def _promote(self, name):
+        '''Turn a packed flag or integer column into a float32 column.'''
+        values = self[name].astype(np.float32)
+        self.flag_bits.pop(name, None)
+        self._replace(name, shared.share(values))
+
+    def fill(self, offset, arrays):
+        '''Store the data for a range of events, e.g. one file.
+
+        Columns are allocated (in shared memory) the first time a branch is
+        seen.
+
+        :param offset: Index of the first event
+        :param arrays: Dict of {branch name: array} for consecutive events
+        '''
+        types = dict((name, self._type(name, v))
+                     for name, v in arrays.items() if name not in self)
+
+        new_flags = sorted(k for k, t in types.items() if t == 'flag')
+        if new_flags and self.flags is None:
+            bits = 8
+            while bits < len(new_flags):
+                bits *= 2
+            if bits > 64:
+                raise ValueError('Too many flag branches to pack')
+            self.flags = shared.zeros(self.n, dtype='uint%i' % bits)
+            self.flag_bits = dict((k, i) for i, k in enumerate(new_flags))
+        elif new_flags:
+            for k in new_flags:
+                types[k] = 'float32'
+
+        for name, t in types.items():
+            if t != 'flag':
+                self.columns[name] = shared.zeros(self.n, dtype=t)
+
+        for name, values in arrays.items():
+            values = np.asarray(values)
+            n = len(values)
+            if name in self.flag_bits:
+                if np.all((values == 0) | (values == 1)):
+                    bit = self.flags.dtype.type(1 << self.flag_bits[name])
+                    chunk = self.flags[offset:offset+n]
+                    chunk[values != 0] |= bit
+                    continue
+                self._promote(name)
+            elif not _fits(values, self.columns[name].dtype):
+                self._promote(name)
+            self.columns[name][offset:offset+n] = values
+
+    def finalize(self):
+        '''Compute derived columns once all events are filled.'''
+        if 'posx' in self and 'posy' in self and 'posz' in self:
+            r2 = np.zeros(self.n, dtype=np.float32)
+            for name in ('posx', 'posy', 'posz'):
+                r2 += np.square(self[name], dtype=np.float32)
+            self._replace('r2', shared.share(r2))
+
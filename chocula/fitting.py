@@ -0,0 +1,175 @@
+'''Binned likelihood fits of energy spectra over signal templates.
+
+The scaled energy spectra of the signals (a ``histogram.Spectra``, e.g. from
+``plot.histogram``) are used as templates, and a spectrum is fit as a sum of
+the templates with a free normalization for each. The normalizations are
+relative to the CSV rates, so 1 is the nominal rate. All the templates of
+the signal chain ('S') share one normalization, the signal strength.
+
+The binned Poisson negative log likelihood and its gradient are computed
+analytically from the precomputed template matrix, so each evaluation is a
+couple of array operations, and scanning the signal strength or fitting many
+Asimov datasets is cheap. Background normalizations may have Gaussian
+constraints around their nominal rates.
+'''
+
+import numpy as np
+import scipy.optimize
+import scipy.stats
+from chocula import sensitivity
+
+# Floor for expected counts, to keep the log finite
+TINY = 1e-300
+
+
+class TemplateFit(object):
+    '''A binned Poisson likelihood fit of template normalizations.
+
+    Bins where every template is empty are ignored. Signal templates are
+    summed into one, in place of the first, so ``names`` and the
+    normalizations have one entry for the signal and one per background.
+
+    :param spectra: A histogram.Spectra with one template per row
+    :param constraints: Dict of {name: relative uncertainty} for Gaussian
+                        constraints on normalizations
+    :param constraint: Relative uncertainty for backgrounds not given in
+                       constraints, or None to leave them free
+    '''
+    def __init__(self, spectra, constraints=None, constraint=None):
+        constraints = constraints or {}
+        is_signal = spectra.is_signal
+        self.signal = None
+        self.names, rows = [], []
+        for i, name in enumerate(spectra.names):
+            if not is_signal[i]:
+                self.names.append(name)
+                rows.append(spectra.contents[i])
+            elif self.signal is None:
+                self.signal = len(self.names)
+                self.names.append(name)
+                rows.append(np.dot(is_signal, spectra.contents))
+        is_signal = np.arange(len(self.names)) == self.signal
+
+        self.contents = np.array(rows).reshape(len(rows), spectra.nbins)
+        self.keep = spectra.total() > 0
+        self.templates = self.contents[:, self.keep]
+
+        # Inverse variance of each constraint, zero for free normalizations
+        self.precision = np.zeros(len(self.names))
+        for i, name in enumerate(self.names):
+            width = constraints.get(name, None if is_signal[i] else constraint)
+            if width is not None:
+                self.precision[i] = 1.0 / width**2
+
+    def expected(self, mu):
+        '''Get the expected counts in the fit bins.
+
+        :param mu: Array of normalizations
+        :returns: Array of expected counts
+        '''
+        return np.maximum(np.dot(mu, self.templates), TINY)
+
+    def nll(self, mu, data):
+        '''Get the negative log likelihood, up to a constant.
+
+        :param mu: Array of normalizations
+        :param data: Observed counts in the fit bins
+        :returns: The negative log likelihood
+        '''
+        lam = self.expected(mu)
+        constraint = 0.5 * np.sum(self.precision * np.square(mu - 1))
+        return np.sum(lam - data * np.log(lam)) + constraint
+
+    def gradient(self, mu, data):
+        '''Get the gradient of the negative log likelihood.
+
+        :param mu: Array of normalizations
+        :param data: Observed counts in the fit bins
+        :returns: Array of partial derivatives
+        '''
+        lam = self.expected(mu)
+        return np.dot(self.templates, 1 - data / lam) + \
+            self.precision * (mu - 1)
+
+    def _objective(self, mu, data):
+        return self.nll(mu, data), self.gradient(mu, data)
+
+    def asimov(self, signal=0.0, mu=None):
+        '''Build an Asimov dataset: the expected spectrum itself.
+
+        :param signal: Signal normalization, if mu is not given
+        :param mu: Array of normalizations, default nominal backgrounds
+        :returns: Expected counts in all bins of the spectra
+        '''
+        if mu is None:
+            mu = np.ones(len(self.names))
+            if self.signal is not None:
+                mu[self.signal] = signal
+        return np.dot(mu, self.contents)
+
+    def fit(self, data, fixed=None, start=None):
+        '''Fit the normalizations to data.
+
+        :param data: Observed counts in all bins of the spectra
+        :param fixed: Dict of {index: value} of normalizations to fix
+        :param start: Starting normalizations, default nominal
+        :returns: A (normalizations, negative log likelihood) tuple
+        '''
+        data = np.asarray(data, dtype=np.float64)[self.keep]
+        fixed = fixed or {}
+
+        bounds = [(0, None)] * len(self.names)
+        x0 = np.ones(len(self.names)) if start is None else np.array(start)
+        for i, value in fixed.items():
+            bounds[i] = (value, value)
+            x0[i] = value
+
+        result = scipy.optimize.minimize(self._objective, x0, args=(data,),
+                                         jac=True, method='L-BFGS-B',
+                                         bounds=bounds)
+        return result.x, result.fun
+
+    def profile(self, data, values):
+        '''Scan the profile likelihood of the signal normalization.
+
+        :param data: Observed counts in all bins of the spectra
+        :param values: Signal normalizations to scan
+        :returns: Array of -2 log likelihood ratios
+        '''
+        mu_hat, best = self.fit(data)
+        q, start = [], mu_hat
+        for value in values:
+            start, nll = self.fit(data, {self.signal: value}, start)
+            q.append(2 * (nll - best))
+        return np.array(q)
+
+    def upper_limit(self, data, cl=0.9):
+        '''Find a one-sided profile likelihood upper limit on the signal.
+
+        As for sensitivity.asimov_limit, the asymptotic limit is never less
+        than the zero-background Poisson limit (see sensitivity.poisson_floor).
+
+        :param data: Observed counts in all bins of the spectra
+        :param cl: Confidence level
+        :returns: The limit in signal counts
+        '''
+        if self.signal is None:
+            raise ValueError('No signal (chain S) template')
+        total = self.templates[self.signal].sum()
+        if total <= 0:
+            raise ValueError('Signal template is empty')
+
+        mu_hat, best = self.fit(data)
+        threshold = scipy.stats.chi2.ppf(2 * cl - 1, 1)
+
+        def q(value):
+            nll = self.fit(data, {self.signal: value}, mu_hat)[1]
+            return 2 * (nll - best) - threshold
+
+        low = mu_hat[self.signal]
+        high = max(2 * low, 1.0)
+        while q(high) < 0:
+            high *= 2
+
+        limit = scipy.optimize.brentq(q, low, high) * total
+        return max(limit, sensitivity.poisson_floor(cl))
@@ -0,0 +1,115 @@
+'''Fit, count and histogram in a single pass over each dataset.
+
+The standard analysis selects the fiducial events (the fiducial radius,
+``evIndex == 0`` and fitter cuts) three times: to fit the signal energy for
+the ROI, to count events in the ROI, and to histogram the spectra. Here the
+fiducial selection is applied once per Signal, the selected energies are
+gathered once, and the ROI fit, the ROI counts and the energy histogram all
+come from that one array.
+'''
+
+import multiprocessing
+import numpy as np
+from chocula import shared
+from chocula import histogram
+from chocula import rootutils
+
+def scan_signal(signal, cut, window, nbins, xmin, xmax, energy=None):
+    '''Count ROI events and histogram the energy of one Signal in one pass.
+
+    :param signal: A loaded Signal
+    :param cut: A ROOT TCut string for the fiducial selection
+    :param window: The (min, max) energy ROI
+    :param nbins: Number of energy bins
+    :param xmin: Minimum energy
+    :param xmax: Maximum energy
+    :param energy: The energies of the selected events, if already gathered
+    :returns: A (number of ROI events, raw histogram) tuple
+    '''
+    if energy is None:
+        energy = signal.events['energy'][signal.select(cut)]
+
+    # Compare as for the TCut from build_tcut, for identical counts
+    low, high = [float('%f' % x) for x in window]
+    in_roi = np.count_nonzero((energy > low) & (energy < high))
+
+    idx = histogram.bin_index(energy, nbins, xmin, xmax)
+    return in_roi, histogram.fill(idx, np.ones(len(idx)), nbins)
+
+
+def _scan_signal((signal, cut, window, nbins, xmin, xmax, roi, raw, index)):
+    roi[index], raw[index] = scan_signal(signal, cut, window, nbins,
+                                         xmin, xmax)
+    return signal.selections.added
+
+
+def analyze(signals, cut, energy, nbins, xmin, xmax, live_time=1,
+            plot_live_time=1, processes=None):
+    '''Fit the ROI, count events in it, and histogram all the signals.
+
+    :param signals: List of Signals and Chains
+    :param cut: A ROOT TCut string for the fiducial selection, e.g. from
+                rootutils.make_roi_cut without an energy
+    :param energy: Energy ROI as a (min, max) pair, a "min:max" string, or a
+                   key of rootutils.ROIS to fit the signal ('S' chain)
+    :param nbins: Number of energy bins
+    :param xmin: Minimum energy
+    :param xmax: Maximum energy
+    :param live_time: Live time in years for the counts, or a list
+    :param plot_live_time: Live time used to scale the spectra
+    :param processes: Number of parallel processes
+    :returns: A (window, counts, spectra) tuple, with the (min, max) energy
+              ROI, counts as from counting.count and a histogram.Spectra
+    '''
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    leaves, owner = [], []
+    for i, signal in enumerate(signals):
+        for leaf in signal.leaves():
+            leaves.append(leaf)
+            owner.append(i)
+
+    roi = shared.zeros(len(leaves))
+    raw = shared.zeros((len(leaves), nbins))
+
+    # The signal is scanned first, since the ROI comes from its fit
+    done = set()
+    for i, leaf in enumerate(leaves):
+        if leaf.chain == 'S':
+            signal_energy = leaf.events['energy'][leaf.select(cut)]
+            window = rootutils.energy_window(
+                energy, lambda c: rootutils.fit_energy(signal_energy))
+            roi[i], raw[i] = scan_signal(leaf, cut, window, nbins, xmin, xmax,
+                                         signal_energy)
+            done.add(i)
+            break
+    else:
+        window = rootutils.energy_window(energy)
+
+    tasks = [(leaf, cut, window, nbins, xmin, xmax, roi, raw, i)
+             for i, leaf in enumerate(leaves) if i not in done]
+
+    if processes > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(processes)
+        selections = pool.map(_scan_signal, tasks, chunksize=1)
+        pool.close()
+        for task, added in zip(tasks, selections):
+            task[0].selections.update(added)
+    else:
+        map(_scan_signal, tasks)
+    roi.unlink()
+    raw.unlink()
+
+    counts = []
+    for i, leaf in enumerate(leaves):
+        c = leaf.exposure(live_time) * roi[i] / leaf.mc_events
+        counts.append((leaf.name, float(c) if np.ndim(c) == 0 else c))
+
+    weights = np.array([leaf.exposure(plot_live_time) / leaf.mc_events
+                        for leaf in leaves])
+    contents = np.zeros((len(signals), nbins))
+    np.add.at(contents, owner, raw * weights[:, np.newaxis])
+    spectra = histogram.Spectra(signals, contents, xmin, xmax, plot_live_time)
+
+    return window, counts, spectra
@@ -0,0 +1,211 @@
+'''Render spectra and background pie charts without ROOT.
+
+The plots of ``plot.render`` and ``bin/pie_chart`` are drawn with matplotlib
+(the non-interactive Agg backend) from the numpy arrays of a
+``histogram.Spectra`` and the counts, straight to PDF, PNG or any other
+format matplotlib writes, chosen by the file extension. Nothing here needs
+ROOT or a display, so many plots (e.g. one per configuration of a parameter
+sweep) can be rendered in parallel worker processes with ``render_many``.
+
+Titles in ROOT LaTeX (e.g. ``^{214}Bi``, ``#alpha``) are converted to
+matplotlib mathtext.
+'''
+
+import re
+import multiprocessing
+import numpy as np
+from chocula.histogram import Spectra
+
+try:
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.gridspec
+    import matplotlib.pyplot as plt
+except ImportError:
+    matplotlib = None
+
+# Approximately the ROOT colors of rootutils.COLORS, in order
+COLORS = ['#000000', '#ff0000', '#00ff00', '#0000ff', '#cc6633', '#00ffff',
+          '#006600', '#9933ff', '#cccccc', '#ff00ff', '#4c4c4c', '#b3d9cc',
+          '#ffff00', '#b3b3cc', '#669966', '#6666cc', '#8c99b3', '#cc6666',
+          '#cccc99', '#cc9999', '#6666b3']
+
+# Pie slice colors, as in bin/pie_chart
+PIE_COLORS = ['#ff3333', '#3333ff', '#00cc00', '#ffa500', '#cc00cc',
+              '#00cccc', '#e69900', '#cc0000', '#9999ff', '#66cc33',
+              '#999999', '#ff6699', '#9966cc']
+
+_script_re = re.compile(r'([\^_])\{([^}]*)\}')
+_greek_re = re.compile(r'#([A-Za-z]+)')
+
+
+def _check():
+    if matplotlib is None:
+        raise ImportError('matplotlib is required for headless rendering')
+
+
+def mathtext(title):
+    '''Convert a ROOT LaTeX title to matplotlib mathtext.
+
+    :param title: A ROOT LaTeX string, e.g. "^{214}Bi + ^{214}Po"
+    :returns: The title with scripts and symbols in $...$
+    '''
+    title = _script_re.sub(r'$\1{\2}$', title)
+    title = _greek_re.sub(r'$\\\1$', title)
+    return title.replace('$$', '')
+
+
+def pie_shares(counts, slices=6):
+    '''Pick the largest contributions for a pie chart.
+
+    :param counts: A dict of {title: counts}
+    :param slices: Number of slices, including one for all the others
+    :returns: A list of (title, counts) tuples, largest first, where the last
+              has an empty title and the sum of the rest
+    '''
+    slices = min(slices, len(counts))
+    by_value = sorted(counts.items(), key=lambda x: x[1], reverse=True)
+    shown = by_value[:slices - 1]
+    return shown + [('', sum(x[1] for x in by_value[slices - 1:]))]
+
+
+def _draw_spectra(ax, spectra, ymin=None, ymax=None, sums=True,
+                  e_units='MeV', stack=False):
+    edges = spectra.edges
+    has_errors = spectra.errors is not None
+    centers = 0.5 * (edges[1:] + edges[:-1])
+    lines = []
+
+    def step(contents, errors, **kwargs):
+        line = ax.step(edges, np.append(contents, contents[-1]),
+                       where='post', **kwargs)[0]
+        if errors is not None:
+            ax.errorbar(centers, contents, yerr=errors, fmt='none',
+                        ecolor=line.get_color(), linewidth=1)
+        return line
+
+    if stack:
+        bottom = np.zeros(spectra.nbins)
+        for i, (title, h) in enumerate(zip(spectra.titles,
+                                           spectra.contents)):
+            lines.append(ax.bar(edges[:-1], h, np.diff(edges), bottom,
+                                align='edge', linewidth=0,
+                                color=COLORS[i % len(COLORS)],
+                                label=mathtext(title)))
+            bottom = bottom + h
+    else:
+        for i, (title, h) in enumerate(zip(spectra.titles,
+                                           spectra.contents)):
+            lines.append(step(h, spectra.errors[i] if has_errors else None,
+                              color=COLORS[i % len(COLORS)], linewidth=2,
+                              label=mathtext(title)))
+
+    if sums:
+        total = step(spectra.total(),
+                     spectra.total_errors() if has_errors else None,
+                     color='black', linewidth=3, label='Sum')
+        background = step(spectra.background(),
+                          spectra.background_errors() if has_errors
+                          else None, color='black', linewidth=3,
+                          linestyle='--', label='Sum, background')
+        lines = [total, background] + lines
+
+    ax.set_yscale('log', nonposy='clip')
+    ax.set_xlim(spectra.xmin, spectra.xmax)
+    if ymin is not None and ymax is not None:
+        ax.set_ylim(ymin, ymax)
+    ax.set_xlabel('Energy (%s)' % e_units)
+    ax.set_ylabel('Counts/%s y/%1.1f keV bin' % (
+        spectra.live_time, (edges[1] - edges[0]) * 1000))
+    return lines
+
+
+def _draw_pie(ax, counts, slices=6):
+    titles, values = zip(*pie_shares(counts, slices))
+    colors = PIE_COLORS[:len(values) - 1] + ['black']
+
+    # Percentages only on slices big enough to hold them
+    ax.pie(values, labels=[mathtext(t) for t in titles], colors=colors,
+           autopct=lambda p: '%1.1f%%' % p if p >= 5 else '',
+           startangle=90, counterclock=False, textprops={'fontsize': 8})
+    ax.set_aspect('equal')
+
+
+def render(spectra, filename, ymin=None, ymax=None, sums=True,
+           e_units='MeV', counts=None, slices=6, stack=False):
+    '''Draw spectra, with a legend and optionally a pie chart, to a file.
+
+    :param spectra: A histogram.Spectra, or its to_dict
+    :param filename: Output filename; the extension sets the format
+    :param ymin: Minimum y value
+    :param ymax: Maximum y value
+    :param sums: Show summed spectrum in plot
+    :param e_units: Energy units (if not MeV)
+    :param counts: A dict of {title: counts} for a pie chart of the
+                   background shares, or None for no pie chart
+    :param slices: Number of pie slices
+    :param stack: Stack the spectra rather than overlaying them
+    :returns: The output filename
+    '''
+    _check()
+    if isinstance(spectra, dict):
+        spectra = Spectra.from_dict(spectra)
+
+    ncols = 3 if counts else 2
+    widths = [3.3, 1] + ([1.6] if counts else [])
+    fig = plt.figure(figsize=(6 + (2.5 if counts else 0), 3.5))
+    grid = matplotlib.gridspec.GridSpec(1, ncols, width_ratios=widths)
+
+    ax = fig.add_subplot(grid[0])
+    lines = _draw_spectra(ax, spectra, ymin, ymax, sums, e_units, stack)
+
+    legend_ax = fig.add_subplot(grid[1])
+    legend_ax.axis('off')
+    legend_ax.legend(lines, [l.get_label() for l in lines], loc='center',
+                     frameon=False, fontsize=8)
+
+    if counts:
+        _draw_pie(fig.add_subplot(grid[2]), counts, slices)
+
+    fig.tight_layout()
+    fig.savefig(filename)
+    plt.close(fig)
+    return filename
+
+
+def render_pie(counts, filename, slices=6):
+    '''Draw a pie chart of background shares to a file.
+
+    :param counts: A dict of {title: counts}
+    :param filename: Output filename; the extension sets the format
+    :param slices: Number of slices, including one for all the others
+    :returns: The output filename
+    '''
+    _check()
+    fig = plt.figure(figsize=(5, 5))
+    _draw_pie(fig.add_subplot(111), counts, slices)
+    fig.savefig(filename)
+    plt.close(fig)
+    return filename
+
+
+def _render(kwargs):
+    return render(**kwargs)
+
+
+def render_many(jobs, processes=None):
+    '''Render many plots in parallel worker processes.
+
+    :param jobs: List of dicts of keyword arguments for render
+    :param processes: Number of parallel processes
+    :returns: List of the output filenames
+    '''
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    if processes > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(processes)
+        filenames = pool.map(_render, jobs, chunksize=1)
+        pool.close()
+        return filenames
+    return map(_render, jobs)
@@ -0,0 +1,173 @@
+'''Energy histograms as numpy arrays.
+
+Histograms are filled with a weighted ``bincount``, with the rate and live
+time normalization folded into the event weights, so that the spectra of many
+signals can be filled and summed in one vectorized operation. Conversion to
+ROOT objects is left to the caller (see ``plot.render``).
+'''
+
+import numpy as np
+
+def bin_index(x, nbins, xmin, xmax):
+    '''Find the histogram bin of each value.
+
+    :param x: Array of values
+    :param nbins: Number of bins
+    :param xmin: Minimum of domain
+    :param xmax: Maximum of domain
+    :returns: Array of bin indices, -1 where x is out of range
+    '''
+    x = np.asarray(x, dtype=np.float64)
+    idx = np.floor((x - xmin) * (nbins / float(xmax - xmin))).astype(np.intp)
+    idx[(idx < 0) | (idx >= nbins)] = -1
+    return idx
+
+
+def fill(idx, weights, nbins, rows=None, nrows=1):
+    '''Fill one or more histograms from bin indices and weights.
+
+    :param idx: Array of bin indices from bin_index (-1 is dropped)
+    :param weights: Array of weights, same length as idx
+    :param nbins: Number of bins
+    :param rows: Histogram (row) number for each entry, default all 0
+    :param nrows: Number of histograms
+    :returns: Bin contents, shape (nbins,) or (nrows, nbins) if rows given
+    '''
+    ok = idx >= 0
+    flat = idx[ok]
+    if rows is not None:
+        flat = flat + np.asarray(rows)[ok] * nbins
+    h = np.bincount(flat, weights=np.asarray(weights)[ok],
+                    minlength=nrows * nbins)
+    return h if rows is None else h.reshape(nrows, nbins)
+
+
+def fill_signals(signals, nbins, xmin, xmax, live_time=1, cut=''):
+    '''Histogram the energy of several signals with a single bincount.
+
+    :param signals: List of Signals
+    :param nbins: Number of energy bins
+    :param xmin: Minimum of domain
+    :param xmax: Maximum of domain
+    :param live_time: Scale factor for live time (years)
+    :param cut: A ROOT TCut string
+    :returns: Bin contents with shape (len(signals), nbins)
+    '''
+    idx, weights, rows = [], [], []
+    for i, signal in enumerate(signals):
+        signal_idx, signal_weights = signal.bin_events(nbins, xmin, xmax,
+                                                       live_time, cut)
+        idx.append(signal_idx)
+        weights.append(signal_weights)
+        rows.append(np.repeat(i, len(signal_idx)))
+
+    if not signals:
+        return np.zeros((0, nbins))
+
+    return fill(np.concatenate(idx), np.concatenate(weights), nbins,
+                rows=np.concatenate(rows), nrows=len(signals))
+
+
+def bootstrap_errors(contents, weights, rows, nrows, replicas=100,
+                     seed=None):
+    '''Estimate the MC statistical uncertainty of summed histograms.
+
+    Each histogram's raw (unweighted) bin counts are resampled with a Poisson
+    bootstrap, all replicas in one vectorized draw, and the replicas are
+    summed into rows like the contents.
+
+    :param contents: Scaled bin contents, shape (len(weights), nbins)
+    :param weights: The scale factor (weight per event) of each histogram
+    :param rows: Row number of each histogram in the sum
+    :param nrows: Number of rows
+    :param replicas: Number of bootstrap replicas
+    :param seed: Random seed, for reproducible replicas
+    :returns: Standard deviation of the summed contents, shape (nrows, nbins)
+    '''
+    contents = np.asarray(contents, dtype=np.float64)
+    w = np.asarray(weights, dtype=np.float64)[:, np.newaxis]
+    raw = np.zeros_like(contents)
+    np.divide(contents, w, out=raw, where=(w > 0))
+    raw = np.rint(raw)
+
+    draws = np.random.RandomState(seed).poisson(raw, (replicas,) + raw.shape)
+    summed = np.zeros((replicas, nrows, contents.shape[1]))
+    np.add.at(summed, (slice(None), rows), draws * w)
+    return summed.std(axis=0)
+
+
+class Spectra(object):
+    '''Scaled energy spectra of a list of Signals and Chains.
+
+    :param signals: The Signals and Chains, one per row of contents
+    :param contents: Bin contents, shape (len(signals), nbins)
+    :param xmin: Minimum of domain
+    :param xmax: Maximum of domain
+    :param live_time: Live time (years) the spectra are scaled to
+    :param errors: Uncertainty on the bin contents, same shape, or None
+    '''
+    def __init__(self, signals, contents, xmin, xmax, live_time=1,
+                 errors=None):
+        self.names = [s.name for s in signals]
+        self.titles = [s.title for s in signals]
+        self.chains = [s.chain for s in signals]
+        self.contents = np.asarray(contents)
+        self.errors = np.asarray(errors) if errors is not None else None
+        self.xmin = xmin
+        self.xmax = xmax
+        self.live_time = live_time
+
+    @property
+    def nbins(self):
+        return self.contents.shape[1]
+
+    @property
+    def edges(self):
+        '''The bin edges.'''
+        return np.linspace(self.xmin, self.xmax, self.nbins + 1)
+
+    @property
+    def is_signal(self):
+        '''A boolean array, True for rows in the signal ('S') chain.'''
+        return np.array([c == 'S' for c in self.chains], dtype=bool)
+
+    def total(self):
+        '''The summed spectrum of all signals and backgrounds.'''
+        return self.contents.sum(axis=0)
+
+    def background(self):
+        '''The summed spectrum of all backgrounds.'''
+        return np.dot((~self.is_signal).astype(np.float64), self.contents)
+
+    def total_errors(self):
+        '''The uncertainty on the total, from independent rows.'''
+        return np.sqrt(np.square(self.errors).sum(axis=0))
+
+    def background_errors(self):
+        '''The uncertainty on the background sum, from independent rows.'''
+        return np.sqrt(np.dot((~self.is_signal).astype(np.float64),
+                              np.square(self.errors)))
+
+    def to_dict(self):
+        '''Convert to a dict of plain (e.g. JSON-serializable) types.'''
+        return {
+            'names': self.names,
+            'titles': self.titles,
+            'chains': self.chains,
+            'contents': self.contents.tolist(),
+            'xmin': self.xmin,
+            'xmax': self.xmax,
+            'live_time': self.live_time,
+            'errors': (self.errors.tolist()
+                       if self.errors is not None else None),
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        '''Create Spectra from the output of to_dict.'''
+        spectra = cls([], d['contents'], d['xmin'], d['xmax'], d['live_time'],
+                      d.get('errors'))
+        spectra.names = d['names']
+        spectra.titles = d['titles']
+        spectra.chains = d['chains']
+        return spectra
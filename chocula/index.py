@@ -0,0 +1,219 @@
+'''An index of dataset file metadata, built once and reused.
+
+For each data file, the index stores the number of entries, the number of
+generated MC events (entries with ``evIndex == 0 || evIndex == -1``), the
+energy range, and the file size. Entries are keyed by absolute path and are
+rebuilt only when a file's size or modification time changes, so normalizing
+a background table does not require scanning the data.
+
+The index is kept in ``index.json`` in the chocula cache directory,
+``~/.chocula`` unless the ``CHOCULA_CACHE_DIR`` environment variable is set.
+Several processes (e.g. the workers loading datasets) may add files at once,
+so new entries are merged into the stored index under a file lock (see
+``update``).
+'''
+
+import os
+import glob
+import json
+import fcntl
+import tempfile
+import contextlib
+import multiprocessing
+from chocula import cuts
+from chocula import prefetch
+from chocula import rootutils
+
+cache_dir = os.environ.get('CHOCULA_CACHE_DIR',
+                           os.path.join(os.path.expanduser('~'), '.chocula'))
+index_path = os.path.join(cache_dir, 'index.json')
+lock_path = os.path.join(cache_dir, 'index.lock')
+
+# Cut selecting one entry per generated event
+GENERATED_CUT = 'evIndex == 0 || evIndex == -1'
+
+# The index as last read or written, with the index file's mtime
+_index = {}
+_index_mtime = None
+
+
+def expand(pattern):
+    '''Find the files matching a filename glob.
+
+    :param pattern: Filename or glob
+    :returns: Sorted list of absolute paths
+    '''
+    return sorted(os.path.abspath(f) for f in glob.glob(pattern))
+
+
+def _stat(filename):
+    st = os.stat(filename)
+    return st.st_size, st.st_mtime
+
+
+def scan(filename, tree_name='data'):
+    '''Read the metadata for a single file.
+
+    :param filename: Path to a ROOT file
+    :param tree_name: Name of the tree in the file
+    :returns: A dict of file metadata
+    '''
+    arrays = rootutils.read_tree(filename, tree_name, ['evIndex', 'energy'])
+    return describe(filename, tree_name, arrays)
+
+
+def describe(filename, tree_name, arrays):
+    '''Get the metadata for a file from branches already read.
+
+    :param filename: Path to the ROOT file
+    :param tree_name: Name of the tree the arrays were read from
+    :param arrays: Dict of {branch name: array}, with at least the evIndex
+                   and energy branches
+    :returns: A dict of file metadata, as scan
+    '''
+    n = len(arrays['energy'])
+    size, mtime = _stat(filename)
+    return {
+        'tree': tree_name,
+        'size': size,
+        'mtime': mtime,
+        'entries': n,
+        'mc_events': len(cuts.select(GENERATED_CUT, arrays, n)),
+        'energy_min': float(arrays['energy'].min()) if n else None,
+        'energy_max': float(arrays['energy'].max()) if n else None,
+    }
+
+
+def _scan((filename, tree_name)):
+    return scan(filename, tree_name)
+
+
+def load_index(force=False):
+    '''Read the index from disk, if it has changed since the last read.
+
+    :param force: Read the index even if its mtime is unchanged
+    :returns: A dict of {path: metadata}
+    '''
+    global _index, _index_mtime
+    try:
+        mtime = os.stat(index_path).st_mtime
+        if force or mtime != _index_mtime:
+            with open(index_path, 'r') as f:
+                _index = json.load(f)
+            _index_mtime = mtime
+    except (IOError, OSError, ValueError):
+        pass
+    return _index
+
+
+def save_index(index):
+    '''Write the index to disk atomically.
+
+    :param index: A dict of {path: metadata}
+    '''
+    global _index, _index_mtime
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    fd, path = tempfile.mkstemp(prefix='index-', dir=cache_dir)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(index, f)
+    os.rename(path, index_path)
+    _index, _index_mtime = index, os.stat(index_path).st_mtime
+
+
+@contextlib.contextmanager
+def locked():
+    '''Hold the index lock, e.g. to read, merge and write the index.'''
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    with open(lock_path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def update(infos):
+    '''Merge metadata for some files into the stored index.
+
+    The index is read, updated and written under the lock, so entries added
+    at the same time by other processes are kept.
+
+    :param infos: A dict of {path: metadata}
+    :returns: The updated index
+    '''
+    with locked():
+        index = dict(load_index(force=True))
+        index.update(infos)
+        save_index(index)
+    return index
+
+
+def is_current(info, filename, tree_name='data'):
+    '''Check whether index metadata is up to date with a file.
+
+    :param info: Metadata dict from the index, or None
+    :param filename: Path to the file
+    :param tree_name: Name of the tree in the file
+    :returns: True if the metadata can be used
+    '''
+    if info is None or info['tree'] != tree_name:
+        return False
+    return (info['size'], info['mtime']) == _stat(filename)
+
+
+def build(patterns, tree_name='data', processes=None):
+    '''Make sure the index covers all files matching some globs.
+
+    Files that are missing from the index or have changed are scanned, in
+    parallel processes.
+
+    :param patterns: List of filenames or globs
+    :param tree_name: Name of the tree in the files
+    :param processes: Number of parallel processes
+    :returns: A dict of {path: metadata} for the matching files
+    '''
+    files = sorted(set(f for p in patterns for f in expand(p)))
+    index = load_index()
+    stale = [f for f in files if not is_current(index.get(f), f, tree_name)]
+
+    if stale:
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+
+        tasks = [(f, tree_name) for f in stale]
+        if processes > 1 and len(stale) > 1:
+            pool = multiprocessing.Pool(processes)
+            infos = pool.map(_scan, tasks)
+            pool.close()
+        else:
+            infos = [scan(f, tree_name) for f in prefetch.prefetch(stale)]
+
+        # Other processes may have added files since we read the index
+        index = update(dict(zip(stale, infos)))
+
+    return dict((f, index[f]) for f in files)
+
+
+def summary(pattern, tree_name='data', processes=1):
+    '''Get the combined metadata for the files matching a glob.
+
+    :param pattern: Filename or glob
+    :param tree_name: Name of the tree in the files
+    :param processes: Number of parallel processes for any scanning
+    :returns: A dict with the number of files, entries, generated events,
+              total size, and energy range
+    '''
+    infos = build([pattern], tree_name, processes).values()
+    emin = [i['energy_min'] for i in infos if i['energy_min'] is not None]
+    emax = [i['energy_max'] for i in infos if i['energy_max'] is not None]
+    return {
+        'files': len(infos),
+        'entries': sum(i['entries'] for i in infos),
+        'mc_events': sum(i['mc_events'] for i in infos),
+        'size': sum(i['size'] for i in infos),
+        'energy_min': min(emin) if emin else None,
+        'energy_max': max(emax) if emax else None,
+    }
+
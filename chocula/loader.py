@@ -1,7 +1,9 @@
 '''Load datasets for analysis.'''
 
-import csv
 import multiprocessing
+from chocula import index
+from chocula import manifest
+from chocula import partials
 from chocula.signals import Signal, Chain
 
 # Names of background chains
@@ -19,63 +21,131 @@ def import_csv(csv_file):
     :param csv_file: Filename or file object
     :returns: List of Signals
     '''
-    if not isinstance(csv_file, file):
-        csv_file = open(csv_file, 'r')
+    return [Signal(row['name'], row['chain'], row['title'], row['filename'],
+                   row['rates'], scale=row['scale'])
+            for row in manifest.read_table(csv_file)]
 
-    reader = csv.reader(filter(lambda row: row[0] != '#', csv_file))
-    signals = []
 
-    for row in reader:
-        row = map(lambda x: x.strip(), row)
-        chain, name, title, filename, scale, rate_y1, rate_y2, rate_y3, rate_y4, rate_y5 = row
-        rates = map(float, [rate_y1, rate_y2, rate_y3, rate_y4, rate_y5])
-        scale = float(scale)
-        signal = Signal(name, chain, title, filename, rates, scale=scale)
-        signals.append(signal)
+def import_table(table, processes=None):
+    '''Load a list of datasets from a CSV file, with their data files.
 
-    csv_file.close()
-    return signals
+    The table's manifest (see ``manifest``) provides the files for each
+    Signal, so they are neither searched for nor indexed again.
+
+    :param table: Filename of the CSV background table
+    :param processes: Number of parallel processes for any indexing
+    :returns: List of Signals
+    '''
+    m = manifest.load(table, processes=processes)
+    return [Signal(row['name'], row['chain'], row['title'], row['filename'],
+                   row['rates'], scale=row['scale'],
+                   files=m['files'][row['filename']])
+            for row in m['rows']]
 
 
-def _load_signal_dataset(signal):
-    signal.load_dataset()
+def _load_signal_dataset((signal, precision)):
+    signal.load_dataset(precision=precision)
     return signal
 
 
-def load(signals, processes=None):
+def _update_partials(patterns, cut, processes):
+    '''Read new files for the partials of a cut, indexing them as well.'''
+    files = [f for p in patterns for f in index.expand(p)]
+    partials.update_files(files, partials.split_energy(cut)[0],
+                          processes=processes)
+
+
+def load(signals, processes=None, incremental=False, precision=None,
+         cut=None):
     '''Load signal parameters and ROOT datasets.
 
     :param signals: A list of Signals, or a file with signals
     :param processes: Load datasets in parallel processes
+    :param incremental: Only find the data files, without reading them. The
+                        counts and spectra then come from stored per-file
+                        results, reading only new or changed files (see
+                        ``partials``).
+    :param precision: Precision policy for the loaded events, default
+                      events.DEFAULT_POLICY
+    :param cut: With incremental, the cut the counts and spectra will use.
+                The partials for its fiducial part are updated while the
+                files are indexed, so new files are read only once.
     :returns: The list of Signals and Chains
     '''
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
     # If we have a file or filename, load from CSV
-    if isinstance(signals, str) or isinstance(signals, file):
+    if isinstance(signals, basestring):
+        if incremental and cut is not None:
+            _update_partials([row['filename']
+                              for row in manifest.read_table(signals)],
+                             cut, processes)
+        signals = import_table(signals, processes)
+    elif hasattr(signals, 'read'):
         signals = import_csv(signals)
+    else:
+        signals = list(signals)
+
+    # Find and index the data files once, in parallel, for the normalizations
+    # and to schedule the biggest datasets first
+    unresolved = [s for s in signals if s.files is None]
+    if unresolved:
+        if incremental and cut is not None:
+            _update_partials([s.filename for s in unresolved], cut,
+                             processes)
+        infos = index.build([s.filename for s in unresolved],
+                            processes=processes)
+        for signal in unresolved:
+            signal.files = [[f, infos[f]['size'], infos[f]['entries'],
+                             infos[f]['mc_events']]
+                            for f in index.expand(signal.filename)]
+
+    if incremental:
+        for signal in signals:
+            signal.nevents = sum(f[2] for f in signal.files)
+            signal.mc_events = sum(f[3] for f in signal.files)
+        return group_chains(signals)
 
-    if processes is None:
-        processes = multiprocessing.cpu_count()
+    entries = [sum(f[2] for f in signal.files) for signal in signals]
+    order = sorted(range(len(signals)), key=lambda i: entries[i], reverse=True)
 
+    # Loaded signals come back holding references to shared memory, so only
+    # the metadata is pickled, not the event arrays
     if processes > 1:
         pool = multiprocessing.Pool(processes)
-        signals = pool.map(_load_signal_dataset, signals)
+        loaded = pool.map(_load_signal_dataset,
+                          [(signals[i], precision) for i in order],
+                          chunksize=1)
+        pool.close()
+        for i, signal in zip(order, loaded):
+            signals[i] = signal
     else:
         for signal in signals:
-            signal.load_dataset()
+            signal.load_dataset(precision=precision)
+
+    return group_chains(signals)
+
 
-    # Build a list of signals with the chains merged into Chains
+def group_chains(signals):
+    '''Group Signals that belong to a chain into Chains.
+
+    :param signals: A list of Signals
+    :returns: The list of Signals and Chains
+    '''
+    # Build a list of signals with the chains merged into Chains, in order of
+    # first appearance
     chained = []
+    by_name = {}
     for signal in signals:
         if signal.chain is None or signal.chain == '' or signal.chain == 'S':
             chained.append(signal)
+        elif signal.chain in by_name:
+            by_name[signal.chain].add_signal(signal)
         else:
-            try:
-                c = filter(lambda x: x.name == signal.chain, chained)[0]
-                c.add_signal(signal)
-            except IndexError:
-                c = Chain(signal.chain, chains[signal.chain])
-                c.add_signal(signal)
-                chained.append(c)
+            c = Chain(signal.chain, chains[signal.chain])
+            c.add_signal(signal)
+            by_name[signal.chain] = c
+            chained.append(c)
 
     return chained
-
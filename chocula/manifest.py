@@ -0,0 +1,160 @@
+'''Compiled manifests of background tables.
+
+A manifest holds everything needed to set up the signals of a background
+table without touching the data: the parsed rows (with rates and scale
+factors) and, for each filename glob, the matching files with their sizes,
+entries and generated event counts.
+
+The manifest is stored in a sidecar file next to the table (``table.csv``
+gets ``table.csv.manifest``). It saves parsing the table and reading the file
+index, but it is always checked against the disk: every glob is expanded
+again, and every file's size and modification time are compared with the
+stored metadata (see ``index.is_current``). Globs whose matches or files have
+changed are rebuilt, with the metadata for the changed files coming from the
+file index (see ``index``).
+'''
+
+import os
+import csv
+import json
+import tempfile
+from chocula import index
+
+SUFFIX = '.manifest'
+VERSION = 2
+
+
+def read_table(csv_file):
+    '''Parse the rows of a CSV background table.
+
+    :param csv_file: Filename or file object
+    :returns: A list of dicts with the chain, name, title, filename, scale
+              and rates of each row
+    '''
+    if not hasattr(csv_file, 'read'):
+        csv_file = open(csv_file, 'r')
+
+    reader = csv.reader(filter(lambda row: row[0] != '#', csv_file))
+    rows = []
+
+    for row in reader:
+        row = map(lambda x: x.strip(), row)
+        chain, name, title, filename, scale, rate_y1, rate_y2, rate_y3, rate_y4, rate_y5 = row
+        rows.append({
+            'chain': chain,
+            'name': name,
+            'title': title,
+            'filename': filename,
+            'scale': float(scale),
+            'rates': map(float, [rate_y1, rate_y2, rate_y3, rate_y4, rate_y5]),
+        })
+
+    csv_file.close()
+    return rows
+
+
+def sidecar(table):
+    '''Get the path of the manifest for a table.'''
+    return table + SUFFIX
+
+
+def _stat(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime]
+
+
+def _is_current(entry, files, tree_name):
+    '''Check a glob's stored metadata against the files it matches now.'''
+    if sorted(entry['infos']) != files:
+        return False
+    try:
+        return all(index.is_current(entry['infos'][f], f, tree_name)
+                   for f in files)
+    except OSError:
+        return False
+
+
+def _encode(value):
+    '''Convert the unicode strings from JSON into str, as in the table.'''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, list):
+        return [_encode(v) for v in value]
+    if isinstance(value, dict):
+        return dict((_encode(k), _encode(v)) for k, v in value.items())
+    return value
+
+
+def _save(manifest, path):
+    '''Write a manifest atomically, if the directory is writable.'''
+    try:
+        fd, tmp = tempfile.mkstemp(prefix='.manifest-',
+                                   dir=os.path.dirname(os.path.abspath(path)))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(manifest, f)
+        os.rename(tmp, path)
+    except (IOError, OSError):
+        pass
+
+
+def load(table, tree_name='data', processes=None):
+    '''Get the manifest for a background table, rebuilding stale parts.
+
+    :param table: Filename of the CSV background table
+    :param tree_name: Name of the tree in the data files
+    :param processes: Number of parallel processes for indexing new files
+    :returns: A manifest dict with 'rows' (see read_table) and 'files', a
+              dict of {filename glob: list of [path, size, entries,
+              generated events]}
+    '''
+    path = sidecar(table)
+    try:
+        with open(path, 'r') as f:
+            manifest = _encode(json.load(f))
+        if manifest['version'] != VERSION or manifest['tree'] != tree_name:
+            manifest = None
+    except (IOError, OSError, ValueError, KeyError):
+        manifest = None
+
+    stat = _stat(table)
+    changed = False
+    if manifest is None or manifest['table'] != stat:
+        patterns = manifest['patterns'] if manifest is not None else {}
+        manifest = {
+            'version': VERSION,
+            'tree': tree_name,
+            'table': stat,
+            'rows': read_table(table),
+            'patterns': patterns,
+        }
+        changed = True
+
+    # Drop globs no longer in the table, and find the ones to expand again.
+    # Globs are stored as absolute paths, since the table may use relative.
+    patterns = manifest['patterns']
+    wanted = set(os.path.abspath(row['filename']) for row in manifest['rows'])
+    for pattern in set(patterns) - wanted:
+        del patterns[pattern]
+        changed = True
+    matches = dict((p, index.expand(p)) for p in wanted)
+    stale = sorted(p for p in wanted if p not in patterns or
+                   not _is_current(patterns[p], matches[p], tree_name))
+
+    if stale:
+        infos = index.build(stale, tree_name, processes)
+        for pattern in stale:
+            files = matches[pattern]
+            patterns[pattern] = {
+                'infos': dict((f, infos[f]) for f in files),
+                'files': [[f, infos[f]['size'], infos[f]['entries'],
+                           infos[f]['mc_events']] for f in files],
+            }
+        changed = True
+
+    if changed:
+        _save(manifest, path)
+
+    manifest['files'] = dict(
+        (row['filename'], patterns[os.path.abspath(row['filename'])]['files'])
+        for row in manifest['rows'])
+    return manifest
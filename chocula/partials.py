@@ -0,0 +1,349 @@
+'''Per-file partial results, for incremental analysis of growing datasets.
+
+For a fiducial cut, each data file gets a partial result: the number of
+generated MC events and the sorted energies of the entries passing the cut.
+The cut is evaluated on the file's events as they would be loaded (see
+``events``), and the energies are kept at that precision, so results are
+the same as from loaded data. Partials are stored per cut and reused as long
+as a file's size and modification time are unchanged, so when new files
+appear in a production only those are read. The partials of a Signal's files
+are summed before normalizing by its rates and scale factor.
+
+Energy windows are not part of the stored cut: the energy terms of a cut
+(e.g. the ROI of ``rootutils.make_roi_cut``) are split off, and the entries
+in the window are counted in the sorted energies with a binary search. A new
+ROI, e.g. refit after signal MC is added, therefore needs no new pass over
+the data. Spectra, in any binning, and the signal energy fit (see
+``fit_energy``) also come from the stored energies.
+
+Files are read once for both the file index and the partials if the
+partials are updated first, as ``loader.load`` does for incremental runs.
+
+Partials are kept in the ``partials`` directory of the chocula cache (see
+``index``), in one directory per fiducial cut and tree name, with the
+metadata in ``files.json`` and the energies of each file in a ``.npy`` file.
+'''
+
+import os
+import json
+import hashlib
+import tempfile
+import multiprocessing
+import numpy as np
+from chocula import cuts
+from chocula import index
+from chocula import prefetch
+from chocula import histogram
+from chocula import rootutils
+from chocula.events import Events
+
+partials_dir = os.path.join(index.cache_dir, 'partials')
+
+# The energy window of a cut without energy terms
+NO_WINDOW = ((-np.inf, False), (np.inf, False))
+
+
+def split_energy(cut):
+    '''Split the energy window off a cut.
+
+    :param cut: A ROOT TCut string
+    :returns: A (cut, window) tuple, with the cut without its top-level
+              energy comparisons (normalized, see cuts.terms) and the energy
+              window as ((min, inclusive), (max, inclusive)), NO_WINDOW if
+              there is none
+    '''
+    node = cuts.parse(cut)
+    if node is None:
+        return '', NO_WINDOW
+
+    (low, low_closed), (high, high_closed) = NO_WINDOW
+    rest = []
+    nodes = node[1] if node[0] == 'and' else [node]
+    for term, formatted in zip(nodes, cuts.terms(cut)):
+        if (term[0] == 'binary' and term[2] == ('column', 'energy') and
+                term[3][0] == 'number' and term[1] in ('>', '>=', '<', '<=')):
+            value, closed = term[3][1], term[1].endswith('=')
+            if term[1][0] == '>':
+                if (value, not closed) > (low, not low_closed):
+                    low, low_closed = value, closed
+            elif (value, closed) < (high, high_closed):
+                high, high_closed = value, closed
+        else:
+            rest.append(formatted)
+    return ' && '.join(rest), ((low, low_closed), (high, high_closed))
+
+
+def window_count(energy, window):
+    '''Count the entries in an energy window.
+
+    :param energy: Sorted array of energies
+    :param window: The window, as from split_energy
+    :returns: The number of entries in the window
+    '''
+    (low, low_closed), (high, high_closed) = window
+    value = energy.dtype.type
+    start = np.searchsorted(energy, value(low),
+                            'left' if low_closed else 'right')
+    stop = np.searchsorted(energy, value(high),
+                           'right' if high_closed else 'left')
+    return max(stop - start, 0)
+
+
+def in_window(energy, window):
+    '''Find the entries in an energy window.
+
+    :param energy: Array of energies
+    :param window: The window, as from split_energy
+    :returns: A boolean array
+    '''
+    (low, low_closed), (high, high_closed) = window
+    value = energy.dtype.type
+    above = (energy >= value(low)) if low_closed else (energy > value(low))
+    below = (energy <= value(high)) if high_closed else (energy < value(high))
+    return above & below
+
+
+def _dir(cut, tree_name):
+    key = hashlib.sha1('%s\n%s' % (tree_name, cut)).hexdigest()
+    return os.path.join(partials_dir, key)
+
+
+def _read(directory):
+    try:
+        with open(os.path.join(directory, 'files.json'), 'r') as f:
+            return json.load(f)['files']
+    except (IOError, OSError, ValueError, KeyError):
+        return {}
+
+
+def _write(directory, name, write):
+    '''Write a file in a directory atomically.'''
+    fd, path = tempfile.mkstemp(prefix='partials-', dir=directory)
+    with os.fdopen(fd, 'wb') as f:
+        write(f)
+    os.rename(path, os.path.join(directory, name))
+
+
+def scan(filename, cut, tree_name='data'):
+    '''Compute the partial result for a single file.
+
+    :param filename: Path to a ROOT file
+    :param cut: A ROOT TCut string
+    :param tree_name: Name of the tree in the file
+    :returns: A (partial, index metadata) tuple, with the partial a dict with
+              the file's size and mtime, the number of generated events and
+              the sorted energies of the entries passing the cut, and the
+              metadata as index.scan
+    '''
+    branches = (cuts.columns(cut) | cuts.columns(index.GENERATED_CUT) |
+                set(['energy']))
+    arrays = rootutils.read_tree(filename, tree_name, sorted(branches))
+    info = index.describe(filename, tree_name, arrays)
+    n = info['entries']
+
+    # Select as on loaded events, at their precision
+    events = Events(n)
+    events.fill(0, arrays)
+    events.finalize()
+    try:
+        energy = np.sort(events['energy'][cuts.select(cut, events, n)])
+    finally:
+        events.unlink()
+
+    partial = {
+        'size': info['size'],
+        'mtime': info['mtime'],
+        'generated': info['mc_events'],
+        'energy': energy,
+    }
+    return partial, info
+
+
+def _scan((filename, cut, tree_name)):
+    return scan(filename, cut, tree_name)
+
+
+def _is_current(info, filename):
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return False
+    return (info is not None and
+            (info['size'], info['mtime']) == (st.st_size, st.st_mtime))
+
+
+def update_files(files, cut, tree_name='data', processes=None):
+    '''Make sure the partials for a cut cover some files.
+
+    Only files without a current partial are read, in parallel processes.
+    The file index is updated from the same read.
+
+    :param files: List of paths
+    :param cut: A ROOT TCut string, without an energy window (see
+                split_energy)
+    :param tree_name: Name of the tree in the files
+    :param processes: Number of parallel processes
+    :returns: A dict of {path: partial metadata} for the files, where the
+              energies are in the file named by 'energy' (see energies)
+    '''
+    cut = ' && '.join(cuts.terms(cut))
+    files = sorted(set(files))
+    directory = _dir(cut, tree_name)
+    stored = _read(directory)
+    stale = [f for f in files if not _is_current(stored.get(f), f)]
+
+    if stale:
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+
+        print 'Reading %i new or changed files' % len(stale)
+        tasks = [(f, cut, tree_name) for f in stale]
+        if processes > 1 and len(stale) > 1:
+            pool = multiprocessing.Pool(processes)
+            results = pool.map(_scan, tasks, chunksize=1)
+            pool.close()
+        else:
+            results = [scan(f, cut, tree_name)
+                       for f in prefetch.prefetch(stale)]
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        scanned = {}
+        for filename, (partial, info) in zip(stale, results):
+            name = hashlib.sha1(filename).hexdigest() + '.npy'
+            _write(directory, name,
+                   lambda f: np.save(f, partial.pop('energy')))
+            partial['energy'] = name
+            scanned[filename] = partial
+
+        # Another process may have added files since we read the partials;
+        # partials for files that no longer exist are dropped
+        with index.locked():
+            stored = _read(directory)
+            stored.update(scanned)
+            for f in [f for f in stored if not os.path.exists(f)]:
+                try:
+                    os.remove(os.path.join(directory,
+                                           stored.pop(f)['energy']))
+                except OSError:
+                    pass
+            _write(directory, 'files.json', lambda f: json.dump(
+                {'cut': cut, 'tree': tree_name, 'files': stored}, f))
+        index.update(dict((f, info) for f, (partial, info)
+                          in zip(stale, results)))
+
+    partials = {}
+    for f in files:
+        partials[f] = dict(stored[f])
+        partials[f]['energy'] = os.path.join(directory, stored[f]['energy'])
+    return partials
+
+
+def update(signals, cut, tree_name='data', processes=None):
+    '''Make sure the partials for a cut cover all the files of some signals.
+
+    :param signals: List of Signals and Chains, with their files resolved
+    :param cut: A ROOT TCut string, without an energy window (see
+                split_energy)
+    :param tree_name: Name of the tree in the files
+    :param processes: Number of parallel processes
+    :returns: A dict of {path: partial metadata}, as update_files
+    '''
+    files = [f[0] for signal in signals
+             for leaf in signal.leaves() for f in leaf.files]
+    return update_files(files, cut, tree_name, processes)
+
+
+def energies(signal, partials, window=NO_WINDOW):
+    '''Iterate over the stored energies of a Signal's files.
+
+    :param signal: A Signal, with its files resolved
+    :param partials: A dict of {path: partial metadata}, from update
+    :param window: Only yield the energies in this window
+    :returns: A generator of arrays of energies, one per file
+    '''
+    for f in signal.files:
+        energy = np.load(partials[f[0]]['energy'])
+        if window != NO_WINDOW:
+            energy = energy[in_window(energy, window)]
+        yield energy
+
+
+def generated(signal, partials):
+    '''Get the number of generated events in a Signal's files.
+
+    :param signal: A Signal, with its files resolved
+    :param partials: A dict of {path: partial metadata}, from update
+    :returns: The number of generated events
+    '''
+    return sum(partials[f[0]]['generated'] for f in signal.files)
+
+
+def count(signals, cut, live_time=1, tree_name='data', processes=None):
+    '''Count the events that pass a cut, from per-file partials.
+
+    :param signals: List of Signals and Chains, with their files resolved
+    :param cut: A ROOT TCut string, whose energy window is applied to the
+                stored energies
+    :param live_time: Live time in years, or a list of live times
+    :param tree_name: Name of the tree in the files
+    :param processes: Number of parallel processes for new files
+    :returns: A list of (name, counts) tuples for each individual Signal, as
+              counting.count
+    '''
+    fiducial, window = split_energy(cut)
+    partials = update(signals, fiducial, tree_name, processes)
+    counts = []
+    for signal in signals:
+        for leaf in signal.leaves():
+            selected = sum(window_count(energy, window)
+                           for energy in energies(leaf, partials))
+            c = (leaf.exposure(live_time) * selected /
+                 float(generated(leaf, partials)))
+            counts.append((leaf.name, float(c) if np.ndim(c) == 0 else c))
+    return counts
+
+
+def fill_signals(signals, nbins, xmin, xmax, live_time=1, cut='',
+                 tree_name='data', processes=None):
+    '''Histogram the energy of several Signals from per-file partials.
+
+    :param signals: List of Signals
+    :param nbins: Number of energy bins
+    :param xmin: Minimum of domain
+    :param xmax: Maximum of domain
+    :param live_time: Scale factor for live time (years)
+    :param cut: A ROOT TCut string
+    :param tree_name: Name of the tree in the files
+    :param processes: Number of parallel processes for new files
+    :returns: Bin contents with shape (len(signals), nbins), as
+              histogram.fill_signals
+    '''
+    fiducial, window = split_energy(cut)
+    partials = update(signals, fiducial, tree_name, processes)
+
+    contents = np.zeros((len(signals), nbins))
+    for i, signal in enumerate(signals):
+        for energy in energies(signal, partials, window):
+            idx = histogram.bin_index(energy, nbins, xmin, xmax)
+            contents[i] += histogram.fill(idx, np.ones(len(idx)), nbins)
+        contents[i] *= signal.exposure(live_time) / generated(signal,
+                                                              partials)
+    return contents
+
+
+def fit_energy(signal, cut, tree_name='data', processes=None):
+    '''Fit the energy of a Signal with a Gaussian, from per-file partials.
+
+    :param signal: The Signal to fit
+    :param cut: A ROOT TCut string
+    :param tree_name: Name of the tree in the files
+    :param processes: Number of parallel processes for new files
+    :returns: A (mean, sigma) tuple, as rootutils.get_energy_roi
+    '''
+    fiducial, window = split_energy(cut)
+    partials = update([signal], fiducial, tree_name, processes)
+    energy = np.concatenate(list(energies(signal, partials, window)))
+    if len(energy) == 0:
+        raise ValueError('No %s events pass the cut' % signal.name)
+    return rootutils.fit_energy(energy, '__h_roifit_%s' % signal.name)
@@ -2,22 +2,27 @@
 
 import uuid
 import multiprocessing
+import numpy as np
+from chocula import shared
+from chocula import partials
+from chocula.histogram import Spectra, fill_signals, bootstrap_errors
+from chocula import rootutils
 from chocula.rootutils import COLORS
 from chocula.rootimport import ROOT
 
 class _PlotSpecification(object):
-    def __init__(self, nbins, xmin, xmax, live_time, color=1, cut=''):
+    def __init__(self, nbins, xmin, xmax, live_time, cut=''):
         self.nbins = nbins
         self.xmin = xmin
         self.xmax = xmax
         self.live_time = live_time
-        self.color = color
         self.cut = cut
 
 
-def _plot_signal((signal, spec)):
-    return signal.plot(spec.nbins, spec.xmin, spec.xmax,
-                       spec.color, spec.live_time, spec.cut)
+def _histogram_signal((signal, spec, out, index)):
+    out[index] = signal.histogram(spec.nbins, spec.xmin, spec.xmax,
+                                  spec.live_time, spec.cut)
+    return signal.selections.added
 
 
 def _make_legend():
@@ -44,83 +49,156 @@ def _make_split_canvas():
     return c, pad1, pad2
 
 
-def plot(signals, nbins, xmin, xmax, ymin, ymax, live_time=1, cut='',
-         sums=True, processes=None):
-    '''Create a plot of the energy distributions for all the signals.
+def histogram(signals, nbins, xmin, xmax, live_time=1, cut='',
+              processes=None, replicas=0, seed=None):
+    '''Histogram the energy distributions for all the signals.
+
+    The individual Signals (the leaves of any Chains) are histogrammed, in
+    parallel worker processes which write to a shared output buffer, or in a
+    single weighted bincount. Signals whose events are not loaded (see
+    loader.load) are histogrammed from per-file partial results. Chains are
+    then summed from their leaves.
 
     :param signals: List of Signals and Chains
     :param nbins: Number of energy bins
     :param xmin: Minimum energy
     :param xmax: Maximum energy
-    :param ymin: Minimum y value
-    :param ymax: Maximum y value
     :param live_time: Live time used to scale plot
     :param cut: A ROOT TCut string
-    :param sums: Show summed spectrum in plot
     :param processes: Number of parallel processes
-    :returns: A (canvas, legend, [plots]) tuple with all the histograms
+    :param replicas: Number of Poisson bootstrap replicas for the MC
+                     statistical errors, 0 for no errors
+    :param seed: Random seed for the bootstrap
+    :returns: A histogram.Spectra
     '''
-    print sums
     if processes is None:
         processes = multiprocessing.cpu_count()
 
-    specs = []
-    for i in range(len(signals)):
-        specs.append(_PlotSpecification(nbins, xmin, xmax, live_time,
-                                        color=COLORS[i], cut=cut))
-    signal_spec = zip(*(signals, specs))
+    leaves, owner = [], []
+    for i, signal in enumerate(signals):
+        for leaf in signal.leaves():
+            leaves.append(leaf)
+            owner.append(i)
+
+    loaded = [i for i, leaf in enumerate(leaves) if leaf.events is not None]
+    unloaded = [i for i, leaf in enumerate(leaves) if leaf.events is None]
 
     if processes > 1:
+        spec = _PlotSpecification(nbins, xmin, xmax, live_time, cut)
+        leaf_contents = shared.zeros((len(leaves), nbins))
+        tasks = [(leaves[i], spec, leaf_contents, i) for i in loaded]
         pool = multiprocessing.Pool(processes)
-        plots = pool.map(_plot_signal, signal_spec)
+        selections = pool.map(_histogram_signal, tasks, chunksize=1)
+        pool.close()
+        leaf_contents.unlink()
+        for task, added in zip(tasks, selections):
+            task[0].selections.update(added)
     else:
-        plots = []
-        for o in signal_spec:
-            plots.append(_plot_signal(o))
+        leaf_contents = np.zeros((len(leaves), nbins))
+        leaf_contents[loaded] = fill_signals([leaves[i] for i in loaded],
+                                             nbins, xmin, xmax, live_time, cut)
+
+    # Datasets that are not loaded come from per-file partial results
+    if unloaded:
+        leaf_contents[unloaded] = partials.fill_signals(
+            [leaves[i] for i in unloaded], nbins, xmin, xmax, live_time, cut,
+            processes=processes)
+
+    contents = np.zeros((len(signals), nbins))
+    np.add.at(contents, owner, leaf_contents)
+
+    errors = None
+    if replicas:
+        weights = [leaf.exposure(live_time) / leaf.mc_events
+                   for leaf in leaves]
+        errors = bootstrap_errors(leaf_contents, weights, owner, len(signals),
+                                  replicas, seed)
+
+    return Spectra(signals, contents, xmin, xmax, live_time, errors)
+
+
+def render(spectra, ymin=None, ymax=None, sums=True, e_units='MeV'):
+    '''Draw spectra into a ROOT canvas.
+
+    :param spectra: A histogram.Spectra
+    :param ymin: Minimum y value
+    :param ymax: Maximum y value
+    :param sums: Show summed spectrum in plot
+    :param e_units: Energy units (if not MeV)
+    :returns: A (canvas, legend, [plots]) tuple with all the histograms
+    '''
+    xmin, xmax, live_time = spectra.xmin, spectra.xmax, spectra.live_time
+
+    has_errors = spectra.errors is not None
+    errors = spectra.errors if has_errors else [None] * len(spectra.names)
+
+    plots = []
+    for i, (name, h) in enumerate(zip(spectra.names, spectra.contents)):
+        plots.append(rootutils.make_energy_hist(
+            '__energy_hist_%s' % name, h, xmin, xmax,
+            COLORS[i], live_time, e_units, errors[i]))
 
     canvas, plot_pad, legend_pad = _make_split_canvas()
     legend = _make_legend()
 
-    signal_plots = zip(*(signals, plots))
-
     # Summed spectra
-    hsum = plots[0].Clone('__hsum_%s' % uuid.uuid4().hex[-10:])
-    hsum.Reset()
+    hsum = rootutils.make_energy_hist(
+        '__hsum_%s' % uuid.uuid4().hex[-10:], spectra.total(), xmin, xmax,
+        ROOT.kBlack, live_time, e_units,
+        spectra.total_errors() if has_errors else None)
     hsum.SetLineWidth(3)
-    hsum.SetLineColor(ROOT.kBlack)
-    hsum_bkg = plots[0].Clone('__hsum_%s' % uuid.uuid4().hex[-10:])
-    hsum_bkg.Reset()
+    hsum_bkg = rootutils.make_energy_hist(
+        '__hsum_%s' % uuid.uuid4().hex[-10:], spectra.background(),
+        xmin, xmax, ROOT.kBlack, live_time, e_units,
+        spectra.background_errors() if has_errors else None)
     hsum_bkg.SetLineWidth(3)
-    hsum_bkg.SetLineColor(ROOT.kBlack)
     hsum_bkg.SetLineStyle(2)
 
     if sums:
         legend.AddEntry(hsum, 'Sum')
         legend.AddEntry(hsum_bkg, 'Sum, background')
 
-    # Build legend and sums
-    for signal, plot in signal_plots:
-        legend.AddEntry(plot, signal.title)
-        hsum.Add(plot)
-        if signal.chain != 'S':
-            hsum_bkg.Add(plot)
+    # Build legend
+    for title, plot in zip(spectra.titles, plots):
+        legend.AddEntry(plot, title)
 
     legend_pad.cd()
     legend.Draw()
 
     # Draw
     plot_pad.cd()
-    for i, (signal, plot) in enumerate(reversed(signal_plots)):
-        plot.Draw('' if i==0 else 'same')
+    option = 'e' if has_errors else ''
+    for i, plot in enumerate(reversed(plots)):
+        plot.Draw(option if i==0 else option + ' same')
         if ymin is not None and ymax is not None:
             plot.SetMinimum(ymin)
             plot.SetMaximum(ymax)
 
     if sums:
-        hsum.Draw('same')
+        hsum.Draw(option + ' same')
         plots.append(hsum)
-        hsum_bkg.Draw('same')
+        hsum_bkg.Draw(option + ' same')
         plots.append(hsum_bkg)
 
     return canvas, legend, plots
 
+
+def plot(signals, nbins, xmin, xmax, ymin, ymax, live_time=1, cut='',
+         sums=True, processes=None):
+    '''Create a plot of the energy distributions for all the signals.
+
+    :param signals: List of Signals and Chains
+    :param nbins: Number of energy bins
+    :param xmin: Minimum energy
+    :param xmax: Maximum energy
+    :param ymin: Minimum y value
+    :param ymax: Maximum y value
+    :param live_time: Live time used to scale plot
+    :param cut: A ROOT TCut string
+    :param sums: Show summed spectrum in plot
+    :param processes: Number of parallel processes
+    :returns: A (canvas, legend, [plots]) tuple with all the histograms
+    '''
+    spectra = histogram(signals, nbins, xmin, xmax, live_time, cut,
+                        processes)
+    return render(spectra, ymin, ymax, sums)
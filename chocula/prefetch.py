@@ -0,0 +1,84 @@
+'''Read-ahead of data files, to overlap I/O latency with computation.
+
+On network filesystems the time to open and start reading each file can
+dominate. While one file is being processed, a small pool of threads reads
+the next few files into the operating system's page cache, so that ROOT
+finds them there.
+
+The number of threads and the read-ahead depth (number of files ahead) can
+be set per call, or globally with ``THREADS`` and ``DEPTH`` (defaults from
+the ``CHOCULA_IO_THREADS`` and ``CHOCULA_READ_AHEAD`` environment variables).
+A depth of 0 disables read-ahead.
+'''
+
+import os
+import collections
+from multiprocessing.pool import ThreadPool
+
+THREADS = int(os.environ.get('CHOCULA_IO_THREADS', 2))
+DEPTH = int(os.environ.get('CHOCULA_READ_AHEAD', 2))
+
+# Size of reads when warming the cache
+BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def warm(filename, block_size=BLOCK_SIZE):
+    '''Read a file, discarding the data, to pull it into the page cache.
+
+    :param filename: Path to the file
+    :param block_size: Bytes per read
+    :returns: Number of bytes read
+    '''
+    nbytes = 0
+    with open(filename, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            nbytes += len(block)
+    return nbytes
+
+
+def prefetch(filenames, depth=None, threads=None):
+    '''Iterate over files, reading ahead of the consumer.
+
+    Each file is yielded once its read-ahead is finished (or failed; errors
+    are left for the consumer to hit when it opens the file). At most depth
+    files are read ahead.
+
+    :param filenames: List of file paths, in processing order
+    :param depth: Number of files to read ahead
+    :param threads: Number of reader threads
+    :returns: A generator of the file paths
+    '''
+    depth = DEPTH if depth is None else depth
+    threads = THREADS if threads is None else threads
+
+    if depth < 1 or threads < 1 or len(filenames) < 2:
+        for filename in filenames:
+            yield filename
+        return
+
+    pool = ThreadPool(threads)
+    pending = collections.deque()
+    remaining = iter(filenames)
+    try:
+        for filename in remaining:
+            pending.append((filename, pool.apply_async(warm, (filename,))))
+            if len(pending) >= depth:
+                break
+
+        while pending:
+            filename, result = pending.popleft()
+            try:
+                result.get()
+            except (IOError, OSError):
+                pass
+            for next_filename in remaining:
+                pending.append((next_filename,
+                                pool.apply_async(warm, (next_filename,))))
+                break
+            yield filename
+    finally:
+        pool.terminate()
+
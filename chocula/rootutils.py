@@ -1,8 +1,21 @@
 '''Oh, ROOT...'''
 
 import sys
+import numpy as np
 from rootimport import ROOT
 
+# Scaling from sigma to HWHM
+HHS = 2.35482 / 2
+
+# Mappings from Gaussian mean and sigma to various ROI definitions
+ROIS = {
+    'fwhm': (lambda (m, s): (m - HHS * s, m + HHS * s)),
+    'hwhm': (lambda (m, s): (m, m + HHS * s)),
+    'full': (lambda (m, s): (m - s, m + s)),
+    'upper': (lambda (m, s): (m, m + s)),
+    'm05p15': (lambda (m, s): (m - 0.5 * s, m + 1.5 * s)),
+}
+
 # A less-horrible sequential palette for ROOT
 COLORS = [  1,  2, 3,  4, 797,  7,  ROOT.kGreen+3,  ROOT.kViolet+1, 11,  6,
            12, 29, 5, 30,  34, 38, 40, 42, 45, 46,
@@ -52,6 +65,113 @@ def build_tcut(**kwargs):
     return cut
 
 
+def make_roi_cut(radius, fitter, energy=None, fit=None, veto=None):
+    '''Build the standard ROI cut: fiducial radius, fitter, and energy.
+
+    The energy window is appended last, so that the fiducial selection is
+    cached and shared by cuts with different energy windows.
+
+    :param radius: Maximum (i.e. fiducial) radius
+    :param fitter: Name of fitter whose results to require
+    :param energy: Energy ROI as a (min, max) pair, a "min:max" string, a key
+                   of ROIS, or None for no energy cut
+    :param fit: Function mapping the fiducial cut to the signal's Gaussian
+                (mean, sigma), required for ROIS types, e.g.
+                ``lambda cut: get_energy_roi(signal, cut)``
+    :param veto: Name of a coincidence tag column (see ``coincidence``) to
+                 require to be 0, or None
+    :returns: A TCut expressing the cuts
+    '''
+    roi_cut_kwargs = {
+        'evIndex': 0,
+        'radius': (0, radius),
+        fitter: True,
+    }
+    if veto is not None:
+        roi_cut_kwargs[veto] = 0
+    cut = build_tcut(**roi_cut_kwargs)
+
+    if energy is not None:
+        cut += ' && ' + build_tcut(energy=energy_window(energy, fit, cut))
+
+    return cut
+
+
+def energy_window(energy, fit=None, cut=None):
+    '''Resolve an energy ROI specification to a (min, max) pair.
+
+    :param energy: Energy ROI as a (min, max) pair, a "min:max" string, or a
+                   key of ROIS
+    :param fit: Function mapping a cut to the signal's Gaussian (mean, sigma),
+                required for ROIS types
+    :param cut: The cut passed to fit
+    :returns: The (min, max) energy window
+    '''
+    # Fit for the energy if it's not explicitly specified
+    if isinstance(energy, basestring) and ':' in energy:
+        energy = map(float, energy.split(':'))
+    elif isinstance(energy, basestring):
+        energy = ROIS[energy](fit(cut))
+    return tuple(energy)
+
+
+def read_tree(filename, tree_name='data', branches=None):
+    '''Read branches of a ROOT tree into numpy arrays.
+
+    :param filename: Filename or glob of the ROOT files
+    :param tree_name: Name of the tree (or TNtuple) to read
+    :param branches: List of branch names to read, default all
+    :returns: A dict of {branch name: float64 array}
+    '''
+    tree = ROOT.TChain(tree_name)
+    tree.Add(filename)
+    n = tree.GetEntries()
+
+    if branches is None:
+        tree.LoadTree(0)
+        branches = [b.GetName() for b in tree.GetListOfBranches()]
+
+    arrays = {}
+    tree.SetEstimate(n + 1)
+    for branch in branches:
+        if n == 0:
+            arrays[branch] = np.empty(0, dtype=np.float64)
+            continue
+        tree.Draw(branch, '', 'goff')
+        v = tree.GetV1()
+        v.SetSize(n)
+        arrays[branch] = np.frombuffer(v, dtype=np.float64, count=n).copy()
+
+    return arrays
+
+
+def make_energy_hist(name, contents, xmin, xmax, color=1, live_time=1,
+                     e_units='MeV', errors=None):
+    '''Create an energy spectrum TH1F from an array of bin contents.
+
+    :param name: ROOT object name
+    :param contents: Array of bin contents
+    :param xmin: Minimum of domain
+    :param xmax: Maximum of domain
+    :param color: ROOT color ID
+    :param live_time: Live time (years) for the axis label
+    :param e_units: Energy units (if not MeV)
+    :param errors: Array of bin errors, or None
+    :returns: The TH1F
+    '''
+    h = ROOT.TH1F(name, '', len(contents), xmin, xmax)
+    binsize = '%1.1f' % (h.GetBinWidth(1) * 1000)
+    h.SetXTitle('Energy (' + e_units + ')')
+    h.SetYTitle('Counts/' + str(live_time) + ' y/' + binsize + ' keV bin')
+    for i, c in enumerate(contents):
+        h.SetBinContent(i + 1, c)
+    if errors is not None:
+        for i, e in enumerate(errors):
+            h.SetBinError(i + 1, e)
+    set_plot_options(h, color)
+    return h
+
+
 def get_energy_roi(signal, cut):
     '''Fit the signal energy with a Gaussian.
 
@@ -59,12 +179,24 @@ def get_energy_roi(signal, cut):
     :param cut: A TCut expressing the cuts to apply
     :returns: A (mean, sigma) tuple
     '''
-    name = '__h_roifit_%s' % signal.name
-    if not hasattr(signal, 'tree'):
+    if not hasattr(signal, 'events'):
         raise Exception('Signal cannot be a chain.')
 
-    signal.tree.Draw('energy>>%s' % name, cut)
-    h = ROOT.gDirectory.Get(name)
+    energy = signal.events['energy'][signal.select(cut)]
+    return fit_energy(energy, '__h_roifit_%s' % signal.name)
+
+
+def fit_energy(energy, name='__h_roifit'):
+    '''Fit an array of energies with a Gaussian.
+
+    :param energy: Array of event energies
+    :param name: ROOT object name for the temporary histogram
+    :returns: A (mean, sigma) tuple
+    '''
+    energy = np.asarray(energy, dtype=np.float64)
+
+    h = ROOT.TH1F(name, '', 100, np.min(energy), np.max(energy))
+    h.FillN(len(energy), energy, np.ones_like(energy))
 
     h.Fit('gaus', 'q')
     mean, sigma = (h.GetFunction('gaus').GetParameter(1),
@@ -0,0 +1,180 @@
+'''Fast sensitivity estimates over grids of detector configurations.
+
+Starting from the background rate and signal efficiency of a counting
+analysis (see ``from_counts``), the median expected upper limits are computed
+for every combination of live time, fiducial mass and isotope loading at once,
+with closed-form approximations instead of toy Monte Carlo:
+
+    * ``'asimov'``: the one-sided profile likelihood limit for the Asimov
+      (background-only, median) dataset of a counting experiment, but no
+      lower than the Poisson limit without background
+    * ``'gaussian'``: the large-background approximation z * sqrt(b)
+
+The limits in counts are converted to half-life and effective Majorana mass
+limits for each isotope in ``nuclei``.
+
+Backgrounds are assumed to scale with the fiducial mass. A part of the
+background (e.g. 2vbb) may also scale with the isotope loading.
+'''
+
+import csv
+import numpy as np
+import scipy.stats
+from chocula import nuclei
+from chocula import tools
+
+# Avogadro's number
+N_A = 6.02214e23
+
+
+def poisson_floor(cl=0.9):
+    '''Exact Poisson upper limit for no observed events and no background.
+
+    The limit is -ln(1 - cl) signal counts, 2.30 at 90% CL. Asymptotic
+    profile likelihood limits fall below it for small backgrounds, so it is
+    used as their floor.
+
+    :param cl: Confidence level
+    :returns: Limit in signal counts
+    '''
+    return -np.log(1 - cl)
+
+
+def asimov_limit(background, cl=0.9, iterations=50):
+    '''Median one-sided upper limit for a counting experiment.
+
+    The Asimov dataset (observing exactly the expected background b) gives
+    the profile likelihood test statistic
+
+        q(s) = 2 (s - b ln(1 + s/b))
+
+    which is set to the chi-squared threshold for the confidence level and
+    solved for s with vectorized Newton iterations.
+
+    The asymptotic formula fails for small backgrounds (at b = 0 it gives
+    only half the threshold, 0.82 counts at 90% CL), so the limit is never
+    less than the exact Poisson limit for observing no events (see
+    poisson_floor), which takes over below b of about 2.
+
+    :param background: Expected background counts, a number or array
+    :param cl: Confidence level
+    :param iterations: Number of Newton iterations
+    :returns: Limit in signal counts, same shape as background
+    '''
+    b = np.asarray(background, dtype=np.float64)
+    threshold = scipy.stats.chi2.ppf(2 * cl - 1, 1)
+
+    # With x = 1 + s/b, solve x - ln(x) = c, starting above the root
+    with np.errstate(divide='ignore', invalid='ignore'):
+        c = 1 + threshold / (2 * b)
+        x = 2 * c + np.sqrt(2 * (c - 1))
+        for i in range(iterations):
+            x = x - (x - np.log(x) - c) / (1 - 1 / x)
+        limit = b * (x - 1)
+
+    floor = poisson_floor(cl)
+    return np.where(b > 0, np.maximum(limit, floor), floor)
+
+
+def gaussian_limit(background, cl=0.9):
+    '''Upper limit in the large-background (Gaussian) approximation.
+
+    :param background: Expected background counts, a number or array
+    :param cl: Confidence level
+    :returns: Limit in signal counts, same shape as background
+    '''
+    b = np.asarray(background, dtype=np.float64)
+    return scipy.stats.norm.ppf(cl) * np.sqrt(b)
+
+
+methods = {
+    'asimov': asimov_limit,
+    'gaussian': gaussian_limit,
+}
+
+
+def from_counts(counts, signals, live_time=1):
+    '''Get the background rate and signal efficiency from counts.
+
+    :param counts: Output of counting.count, for a single live time
+    :param signals: The list of Signals and Chains that were counted
+    :param live_time: The live time that was counted, in years
+    :returns: A (background counts per year, signal efficiency) tuple, where
+              the efficiency is the fraction of signal ('S' chain) events
+              passing the cut
+    '''
+    leaves = dict((leaf.name, leaf)
+                  for signal in signals for leaf in signal.leaves())
+    background = sum(c for name, c in counts if leaves[name].chain != 'S')
+    signal = sum(c for name, c in counts if leaves[name].chain == 'S')
+    exposure = sum(leaf.exposure(live_time) for leaf in leaves.values()
+                   if leaf.chain == 'S')
+    return background / live_time, signal / exposure
+
+
+def grid(background, efficiency, live_times, masses, loadings,
+         reference_mass=1.0, reference_loading=1.0, loading_background=0.0,
+         isotopes=None, cl=0.9, method='asimov'):
+    '''Compute median expected limits over a grid of configurations.
+
+    :param background: Background rate (counts/y) at the reference fiducial
+                       mass and loading, not scaling with loading
+    :param efficiency: Signal efficiency
+    :param live_times: List of live times in years
+    :param masses: List of fiducial masses in kg
+    :param loadings: List of isotope loadings, as a mass fraction
+    :param reference_mass: Fiducial mass (kg) the background rate is for
+    :param reference_loading: Loading the loading_background rate is for
+    :param loading_background: Background rate (counts/y) at the reference
+                               mass and loading that scales with loading
+    :param isotopes: List of isotope names, default nuclei.available_isotopes
+    :param cl: Confidence level
+    :param method: A key of methods
+    :returns: A dict of arrays with shape (live times, masses, loadings),
+              with keys live_time, mass, loading, background, counts, and
+              <isotope>_lifetime (y) and <isotope>_mass (eV) per isotope
+    '''
+    if isotopes is None:
+        isotopes = sorted(nuclei.available_isotopes)
+
+    t, m, l = np.meshgrid(np.asarray(live_times, dtype=np.float64),
+                          np.asarray(masses, dtype=np.float64),
+                          np.asarray(loadings, dtype=np.float64),
+                          indexing='ij')
+
+    rate = background + loading_background * l / reference_loading
+    b = rate * t * m / reference_mass
+    counts = methods[method](b, cl)
+
+    results = {
+        'live_time': t,
+        'mass': m,
+        'loading': l,
+        'background': b,
+        'counts': counts,
+    }
+
+    for name in isotopes:
+        isotope = getattr(nuclei, name)
+        n = m * 1000 * l / isotope.A * N_A
+        with np.errstate(divide='ignore'):
+            lifetime = tools.counts_to_lifetime(n, t, efficiency, counts)
+            results[name + '_lifetime'] = lifetime
+            results[name + '_mass'] = tools.lifetime_to_mass(isotope, lifetime)
+
+    return results
+
+
+def write_csv(results, filename):
+    '''Write grid results to a CSV file, one row per configuration.
+
+    :param results: Output of grid
+    :param filename: Output filename
+    '''
+    keys = ['live_time', 'mass', 'loading', 'background', 'counts']
+    keys += sorted(k for k in results if k not in keys)
+    with open(filename, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(['#' + keys[0]] + keys[1:])
+        for row in zip(*[results[k].ravel() for k in keys]):
+            writer.writerow(['%g' % v for v in row])
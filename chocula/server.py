@@ -0,0 +1,218 @@
+'''A resident analysis server, for interactive cut tuning.
+
+The server loads a background table once and keeps all the datasets in
+memory, answering count, histogram and ROI fit requests over HTTP with JSON
+bodies. Selections are cached between requests (see ``cuts.SelectionCache``),
+so changing only the energy window is especially fast.
+
+Requests are POSTs to ``/count``, ``/histogram`` or ``/roi``, with a JSON
+object of keyword arguments for the AnalysisServer method of the same name.
+Cuts may be given as TCut strings or as a dict of ``build_tcut`` arguments.
+``GET /signals`` describes the loaded signals.
+
+For example, from a notebook::
+
+    client = chocula.server.Client('localhost:8765')
+    client.count({'evIndex': 0, 'radius': [0, 3500], 'scintFit': True,
+                  'energy': [2.4, 2.6]}, live_time=[1, 2, 3, 4, 5])
+'''
+
+import json
+import urllib2
+import BaseHTTPServer
+import numpy as np
+from chocula import rootutils
+from chocula import counting
+from chocula import plot
+from chocula.histogram import Spectra
+
+DEFAULT_PORT = 8765
+
+
+def make_cut(cut):
+    '''Build a TCut string from a request.
+
+    :param cut: A TCut string, or a dict of build_tcut arguments. An energy
+                window, if any, is put last so the fiducial selection is
+                reused between requests.
+    :returns: A TCut string
+    '''
+    if not isinstance(cut, dict):
+        return str(cut)
+
+    kwargs = dict((str(k), v) for k, v in cut.items())
+    energy = kwargs.pop('energy', None)
+    terms = [rootutils.build_tcut(**kwargs)] if kwargs else []
+    if energy is not None:
+        terms.append(rootutils.build_tcut(energy=energy))
+    return ' && '.join(terms)
+
+
+def _to_json(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError('%r is not JSON serializable' % value)
+
+
+class AnalysisServer(object):
+    '''Answers analysis requests on a set of loaded signals.
+
+    :param signals: List of loaded Signals and Chains (see loader.load)
+    :param processes: Number of parallel processes per request
+    '''
+    def __init__(self, signals, processes=1):
+        self.signals = signals
+        self.processes = processes
+
+    def describe(self):
+        '''Describe the loaded signals.
+
+        :returns: A list of dicts with the name, title, and chain of every
+                  individual Signal
+        '''
+        return [{'name': s.name, 'title': s.title, 'chain': s.chain}
+                for signal in self.signals for s in signal.leaves()]
+
+    def count(self, cut='', live_time=1):
+        '''Count the events that pass a cut, as counting.count.
+
+        :param cut: A TCut string or dict of build_tcut arguments
+        :param live_time: Live time in years, or a list of live times
+        :returns: A list of (name, counts) pairs
+        '''
+        return counting.count(self.signals, make_cut(cut), self.processes,
+                              live_time)
+
+    def histogram(self, nbins, xmin, xmax, live_time=1, cut=''):
+        '''Histogram the energy distributions, as plot.histogram.
+
+        :param nbins: Number of energy bins
+        :param xmin: Minimum energy
+        :param xmax: Maximum energy
+        :param live_time: Live time used to scale the spectra
+        :param cut: A TCut string or dict of build_tcut arguments
+        :returns: A dict from Spectra.to_dict
+        '''
+        return plot.histogram(self.signals, nbins, xmin, xmax, live_time,
+                              make_cut(cut), self.processes).to_dict()
+
+    def roi(self, cut='', roi=None):
+        '''Fit the signal ('S' chain) energy with a Gaussian.
+
+        :param cut: A TCut string or dict of build_tcut arguments
+        :param roi: Optional key of rootutils.ROIS
+        :returns: The (mean, sigma), or the (min, max) ROI if roi is given
+        '''
+        signal = filter(lambda x: x.chain == 'S', self.signals)[0]
+        fit = rootutils.get_energy_roi(signal, make_cut(cut))
+        return fit if roi is None else rootutils.ROIS[roi](fit)
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def _respond(self, code, body):
+        body = json.dumps(body, default=_to_json)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.strip('/') == 'signals':
+            self._respond(200, self.server.analysis.describe())
+        else:
+            self._respond(404, {'error': 'Unknown request %s' % self.path})
+
+    def do_POST(self):
+        methods = ('count', 'histogram', 'roi')
+        name = self.path.strip('/')
+        if name not in methods:
+            self._respond(404, {'error': 'Unknown request %s' % self.path})
+            return
+
+        length = int(self.headers.getheader('Content-Length', 0))
+        try:
+            kwargs = json.loads(self.rfile.read(length) or '{}')
+            kwargs = dict((str(k), v) for k, v in kwargs.items())
+            result = getattr(self.server.analysis, name)(**kwargs)
+        except Exception as e:
+            self._respond(400, {'error': '%s: %s' % (type(e).__name__, e)})
+            return
+
+        self._respond(200, {'result': result})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(signals, host='localhost', port=DEFAULT_PORT, processes=1):
+    '''Serve analysis requests until interrupted.
+
+    :param signals: List of loaded Signals and Chains
+    :param host: Interface to listen on
+    :param port: TCP port
+    :param processes: Number of parallel processes per request
+    '''
+    httpd = BaseHTTPServer.HTTPServer((host, port), _Handler)
+    httpd.analysis = AnalysisServer(signals, processes)
+    print 'Serving on %s:%i' % (host, port)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+
+
+class Client(object):
+    '''Client for a running analysis server.
+
+    :param address: Server address as "host:port"
+    :param timeout: Request timeout in seconds
+    '''
+    def __init__(self, address='localhost:%i' % DEFAULT_PORT, timeout=None):
+        if ':' not in address:
+            address = '%s:%i' % (address, DEFAULT_PORT)
+        self.url = 'http://%s/' % address
+        self.timeout = timeout
+
+    def _request(self, name, **kwargs):
+        data = json.dumps(kwargs, default=_to_json)
+        request = urllib2.Request(self.url + name, data,
+                                  {'Content-Type': 'application/json'})
+        try:
+            response = urllib2.urlopen(request, timeout=self.timeout)
+        except urllib2.HTTPError as e:
+            raise RuntimeError(json.load(e).get('error', str(e)))
+        return json.load(response)['result']
+
+    def signals(self):
+        '''Describe the loaded signals, see AnalysisServer.describe.'''
+        return json.load(urllib2.urlopen(self.url + 'signals',
+                                         timeout=self.timeout))
+
+    def count(self, cut='', live_time=1):
+        '''Count events, see AnalysisServer.count.
+
+        :returns: A list of (name, counts) tuples, as counting.count
+        '''
+        counts = self._request('count', cut=cut, live_time=live_time)
+        if np.ndim(live_time) == 0:
+            return [(str(name), c) for name, c in counts]
+        return [(str(name), np.array(c)) for name, c in counts]
+
+    def histogram(self, nbins, xmin, xmax, live_time=1, cut=''):
+        '''Histogram energy distributions, see AnalysisServer.histogram.
+
+        :returns: A histogram.Spectra, which can be drawn with plot.render
+        '''
+        return Spectra.from_dict(self._request(
+            'histogram', nbins=nbins, xmin=xmin, xmax=xmax,
+            live_time=live_time, cut=cut))
+
+    def roi(self, cut='', roi=None):
+        '''Fit the signal energy, see AnalysisServer.roi.'''
+        return tuple(self._request('roi', cut=cut, roi=roi))
+
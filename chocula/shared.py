@@ -0,0 +1,170 @@
+'''Arrays in shared memory, for handing data to worker processes for free.
+
+Python 2 has no ``multiprocessing.shared_memory``, so shared arrays are numpy
+arrays backed by memory-mapped files in ``/dev/shm`` (or the directory named
+by the ``CHOCULA_SHM_DIR`` environment variable). When a SharedArray is
+pickled -- e.g. to send it to a ``multiprocessing.Pool`` worker -- only the
+file name, shape, and type are sent, and the receiving process maps the same
+pages. Writes by workers are seen by the parent, so preallocated SharedArrays
+also work as output buffers.
+
+Temporary buffers should be released with ``unlink`` (or by using the array
+as a context manager) once the workers are done with them. All files belong
+to a per-session directory which is removed when the process that created it
+exits; directories left behind by processes that crashed are removed by the
+next session.
+'''
+
+import os
+import errno
+import atexit
+import shutil
+import tempfile
+import numpy as np
+
+if os.path.isdir('/dev/shm'):
+    shm_dir = os.environ.get('CHOCULA_SHM_DIR', '/dev/shm')
+else:
+    shm_dir = os.environ.get('CHOCULA_SHM_DIR', tempfile.gettempdir())
+
+# Forked workers inherit these, so they put their arrays in the same place
+_owner = os.getpid()
+_session_dir = os.path.join(shm_dir, 'chocula-%i' % _owner)
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno != errno.ESRCH
+    return True
+
+
+def _reap():
+    '''Remove the session directories of processes that no longer exist.'''
+    for name in os.listdir(shm_dir):
+        if not name.startswith('chocula-'):
+            continue
+        try:
+            pid = int(name[len('chocula-'):])
+        except ValueError:
+            continue
+        if pid != _owner and not _is_running(pid):
+            shutil.rmtree(os.path.join(shm_dir, name), ignore_errors=True)
+
+
+def _session():
+    '''Create the session directory if needed and return its path.'''
+    if not os.path.isdir(_session_dir):
+        _reap()
+    try:
+        os.makedirs(_session_dir)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    return _session_dir
+
+
+@atexit.register
+def _cleanup():
+    if os.getpid() == _owner:
+        shutil.rmtree(_session_dir, ignore_errors=True)
+
+
+class SharedArray(np.ndarray):
+    '''A numpy array in a memory-mapped file that pickles by reference.
+
+    Slices and arithmetic results are ordinary (private) arrays; only the
+    whole array is shared by name. Used as a context manager, the array is
+    unlinked on exit.
+
+    :param shape: Array shape
+    :param dtype: Data type
+    :param filename: Attach to an existing buffer instead of creating one
+    '''
+    def __new__(cls, shape, dtype=np.float64, filename=None):
+        dtype = np.dtype(dtype)
+        shape = tuple(np.atleast_1d(shape).astype(int))
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+
+        if filename is None:
+            fd, filename = tempfile.mkstemp(prefix='array-', suffix='.shm',
+                                            dir=_session())
+            os.ftruncate(fd, max(nbytes, 1))  # Zero-filled
+            os.close(fd)
+
+        # mmap does not allow empty maps, so always map at least one byte
+        buf = np.memmap(filename, dtype=np.uint8, mode='r+',
+                        shape=(max(nbytes, 1),))
+        obj = np.ndarray.__new__(cls, shape, dtype=dtype, buffer=buf)
+        obj.filename = filename
+        return obj
+
+    def __array_finalize__(self, obj):
+        self.filename = None
+
+    def __array_wrap__(self, out, context=None):
+        return np.ndarray.__array_wrap__(self, out, context).view(np.ndarray)
+
+    def __reduce__(self):
+        if self.filename is None:
+            return np.asarray(self).__reduce__()
+        return (attach, (self.filename, self.shape, self.dtype.str))
+
+    def __reduce_ex__(self, protocol):
+        return self.__reduce__()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.unlink()
+
+    def unlink(self):
+        '''Remove the backing file, so the memory is freed with the array.
+
+        The array stays usable in the processes that have it mapped, but can
+        no longer be attached by name; it pickles by value from now on.
+        '''
+        if self.filename is None:
+            return
+        try:
+            os.unlink(self.filename)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        self.filename = None
+
+
+def attach(filename, shape, dtype):
+    '''Map an existing shared buffer.
+
+    :param filename: Backing file of the array
+    :param shape: Array shape
+    :param dtype: Data type
+    :returns: A SharedArray
+    '''
+    return SharedArray(shape, dtype, filename=filename)
+
+
+def zeros(shape, dtype=np.float64):
+    '''Allocate a zero-filled shared array, e.g. as an output buffer.
+
+    :param shape: Array shape
+    :param dtype: Data type
+    :returns: A SharedArray
+    '''
+    return SharedArray(shape, dtype)
+
+
+def share(array):
+    '''Copy an array into shared memory.
+
+    :param array: Array-like
+    :returns: A SharedArray with the same contents
+    '''
+    array = np.asarray(array)
+    shared = SharedArray(array.shape, array.dtype)
+    shared[...] = array
+    return shared
+
@@ -1,6 +1,14 @@
-import multiprocessing
-from rootimport import ROOT
+import numpy as np
 from chocula import rootutils
+from chocula import cuts
+from chocula import histogram
+from chocula import index
+from chocula import prefetch
+from chocula.events import Events
+
+# The 90% CL Poisson upper limit with no events observed
+ZERO_LIMIT = np.log(10)
+
 
 class Signal(object):
     '''A container for a signal or background.
@@ -12,52 +20,242 @@ class Signal(object):
     :param rates: List of events per year in [y1, y2, y3, y4, y5]
     :param scale: Analysis scaling factor
     :param autoload: Load the ROOT dataset automatically
+    :param files: The data files matching filename, as a list of [path,
+                  size, entries, generated events] (e.g. from a manifest),
+                  or None to look them up in the file index
     '''
+    __slots__ = ('name', 'chain', 'title', 'filename', 'rates', 'scale',
+                 'files', 'events', 'nevents', 'mc_events', 'selections')
+
     def __init__(self, name, chain, title, filename, rates, scale=1.0,
-                 autoload=False):
+                 autoload=False, files=None):
         self.name = name
         self.chain = chain
         self.title = title
         self.filename = filename
         self.rates = rates
         self.scale = scale
+        self.files = files
 
         # Set by load_dataset
-        self.tree = None
+        self.events = None
+        self.nevents = 0
         self.mc_events = 0
+        self.selections = None
 
         if autoload:
-            load_dataset()
+            self.load_dataset()
+
+    def __getstate__(self):
+        return dict((k, getattr(self, k)) for k in self.__slots__)
+
+    def __setstate__(self, state):
+        for k, v in state.items():
+            setattr(self, k, v)
 
-    def load_dataset(self, branch_name='data'):
+    def load_dataset(self, branch_name='data', precision=None):
         '''Load a ROOT data set from files.
 
+        The branches are read into compact arrays (see ``events``) in shared
+        memory, so that the Signal can be passed to worker processes without
+        copying the data. Files are read one at a time into preallocated
+        arrays, with the next files read ahead (see ``prefetch``). The numbers
+        of entries and generated events come from the file index, which is
+        checked against each file's size and modification time, so files that
+        are already known (e.g. from a manifest) are only trusted if they are
+        unchanged.
+
         :param branch_name: Name of the TNtuple branch to read
+        :param precision: Precision policy, see events.DEFAULT_POLICY
         '''
         print 'Loading dataset for', self.name
-        self.tree = ROOT.TChain(branch_name)
-        self.tree.Add(self.filename)
-        #list_name = '__mc_events_%s' % self.name
-        #self.tree.Draw('>>%s' % list_name, 'evIndex == 0 || evIndex == -1')
-        #event_list = ROOT.gDirectory.Get(list_name)
-        #self.mc_events = event_list.GetN()
+        if self.files is None:
+            paths = [self.filename]
+        else:
+            paths = [f[0] for f in self.files]
+        infos = index.build(paths, branch_name, processes=1)
+        self.files = [[f, infos[f]['size'], infos[f]['entries'],
+                       infos[f]['mc_events']] for f in sorted(infos)]
 
-    def count(self, live_time=1, cut=''):
-        '''Get the rate of the events that pass a cut.
+        entries = dict((f[0], f[2]) for f in self.files)
+        self.nevents = sum(f[2] for f in self.files)
+        self.mc_events = sum(f[3] for f in self.files)
+
+        self.events = Events(self.nevents, precision)
+        offset = 0
+        for filename in prefetch.prefetch([f[0] for f in self.files]):
+            arrays = rootutils.read_tree(filename, branch_name)
+            if len(arrays['energy']) != entries[filename]:
+                raise IOError('%s changed while loading' % filename)
+            self.events.fill(offset, arrays)
+            offset += entries[filename]
+        self.events.finalize()
+
+        if self.selections is not None:
+            self.selections.clear()
+        self.selections = cuts.SelectionCache(self.events, self.nevents)
+
+    def leaves(self):
+        '''Get the individual Signals that make up this one.
+
+        :returns: A list containing only this Signal
+        '''
+        return [self]
+
+    def select(self, cut=''):
+        '''Find the events that pass a cut.
+
+        Selections are cached, and tighter cuts are evaluated only on the
+        events that pass the looser ones already seen.
 
         :param cut: A ROOT TCut string
-        :param live_time: *int*, The live time in years
-        :returns: The rate of events per year that pass the cut
+        :returns: Array of indices of the passing events
         '''
-        assert(int(live_time) == live_time)
-        list_name = '__roi_events_%s' % self.name
-        self.tree.Draw('>>%s' % list_name, cut)
-        roi_events = ROOT.gDirectory.Get(list_name)
+        return self.selections.select(cut)
+
+    def exposure(self, live_time=1):
+        '''Get the expected number of events in a live time.
+
+        The per-year rates are integrated, interpolating linearly within a
+        year, and the last year's rate is used beyond the end of the table.
+
+        :param live_time: Live time in years, a number or array of them
+        :returns: Scaled number of events, same shape as live_time
+        '''
+        rates = np.asarray(self.rates, dtype=np.float64)
+        years = np.arange(len(rates) + 1)
+        cumulative = np.concatenate(([0.0], np.cumsum(rates)))
+
+        t = np.asarray(live_time, dtype=np.float64)
+        events = np.interp(t, years, cumulative)
+        events += np.clip(t - years[-1], 0, None) * rates[-1]
+        return events * self.scale
 
-        normalization = sum(self.rates[:int(live_time)]) * self.scale
-        counts = normalization * roi_events.GetN() / self.mc_events
+    def count(self, live_time=1, cut=''):
+        '''Get the number of events that pass a cut.
+
+        The selection is done once for any number of live times.
+
+        :param cut: A ROOT TCut string
+        :param live_time: The live time in years, or a list of live times
+        :returns: A list with one (name, counts) tuple, where counts is an
+                  array if live_time is a list
+        '''
+        roi_events = len(self.select(cut))
+        counts = self.exposure(live_time) * roi_events / self.mc_events
+        if np.ndim(counts) == 0:
+            counts = float(counts)
         return [(self.name, counts)]
 
+    def bootstrap(self, replicas=100, live_time=1, cut='', random_state=None):
+        '''Get Poisson bootstrap replicas of the number of passing events.
+
+        Each passing MC event gets a Poisson(1) weight in every replica. All
+        events of a Signal have the same normalization, so the replica count
+        (a sum of the weights) is drawn directly from Poisson(n) for n passing
+        events, in one vectorized operation.
+
+        :param replicas: Number of bootstrap replicas
+        :param live_time: The live time in years, or a list of live times
+        :param cut: A ROOT TCut string
+        :param random_state: A numpy RandomState, default the global one
+        :returns: Array of scaled counts, shape (replicas,) or (replicas,
+                  len(live_time))
+        '''
+        if random_state is None:
+            random_state = np.random
+        roi_events = random_state.poisson(len(self.select(cut)), replicas)
+        return np.multiply.outer(roi_events,
+                                 self.exposure(live_time) / self.mc_events)
+
+    def estimate(self, precision, live_time=1, cut='', zero_bound=None,
+                 chunk_size=100000, random_state=None):
+        '''Estimate the number of events that pass a cut from a sample.
+
+        Chunks of events are evaluated in random order until the relative
+        statistical error of the count reaches the precision, or the
+        (approximate) 90% CL upper limit on the count drops below
+        zero_bound, i.e. the signal is negligible. The count is normalized
+        by the generated events in the chunks read, so it is exact once all
+        chunks are read.
+
+        :param precision: Target relative error
+        :param live_time: The live time in years, or a list of live times
+        :param cut: A ROOT TCut string
+        :param zero_bound: Upper limit on the count (for the largest live
+                           time) at which to stop
+        :param chunk_size: Number of events per chunk
+        :param random_state: A numpy RandomState, default the global one
+        :returns: An (estimate, error, fraction read) tuple, where the
+                  error is the 90% CL upper limit if no events pass
+        '''
+        if random_state is None:
+            random_state = np.random
+        scale = self.exposure(live_time)
+
+        starts = np.arange(0, self.nevents, chunk_size)
+        random_state.shuffle(starts)
+
+        passed = generated = read = 0
+        for start in starts:
+            events = self.events.view(start, start + chunk_size)
+            passed += len(cuts.select(cut, events, len(events)))
+            generated += len(cuts.select(index.GENERATED_CUT, events,
+                                         len(events)))
+            read += len(events)
+
+            if generated == 0:
+                continue
+            remaining = 1 - float(read) / self.nevents
+            if passed > 0 and np.sqrt(remaining / passed) <= precision:
+                break
+
+            # Roughly the 90% CL upper limit, exact for no passing events
+            upper = passed + ZERO_LIMIT * np.sqrt(passed + 1)
+            if (zero_bound is not None and
+                    np.max(scale) * upper / generated <= zero_bound):
+                break
+
+        fraction = float(read) / self.nevents if self.nevents else 1.0
+        if passed > 0:
+            estimate = scale * passed / generated
+            error = estimate * np.sqrt((1 - fraction) / passed)
+        else:
+            estimate = scale * 0.0
+            error = scale * ZERO_LIMIT / generated if fraction < 1 else estimate
+        return estimate, error, fraction
+
+    def bin_events(self, nbins, xmin, xmax, live_time=1, cut=''):
+        '''Find the energy bin and normalized weight of passing events.
+
+        :param nbins: Number of energy bins
+        :param xmin: Minimum of domain
+        :param xmax: Maximum of domain
+        :param live_time: Live time (years) to normalize to
+        :param cut: A ROOT TCut string
+        :returns: (bin index, weight) arrays, with index -1 if out of range
+        '''
+        energy = self.events['energy'][self.select(cut)]
+        idx = histogram.bin_index(energy, nbins, xmin, xmax)
+        if not np.any(idx >= 0):
+            return idx, np.zeros(len(idx))
+
+        weight = self.exposure(live_time) / self.mc_events
+        return idx, np.repeat(weight, len(idx))
+
+    def histogram(self, nbins, xmin, xmax, live_time=1, cut=''):
+        '''Histogram the energy distribution.
+
+        :param nbins: Number of energy bins
+        :param xmin: Minimum of domain
+        :param xmax: Maximum of domain
+        :param live_time: Live time (years) to normalize to
+        :param cut: A ROOT TCut string
+        :returns: The scaled bin contents as an array
+        '''
+        idx, weights = self.bin_events(nbins, xmin, xmax, live_time, cut)
+        return histogram.fill(idx, weights, nbins)
+
     def plot(self, nbins, xmin, xmax, color=1, live_time=1, cut='',
              e_units='MeV'):
         '''Plot the energy distribution into a 1D histogram.
@@ -66,24 +264,15 @@ class Signal(object):
         :param xmin: Minimum of domain
         :param xmax: Maximum of domain
         :param color: ROOT color ID
-        :param live_time: *int* Scale factor for live time (years)
+        :param live_time: Live time (years) to normalize to
         :param cut: A ROOT TCut string
         :param e_units: Energy units (if not MeV)
         :returns: The energy spectrum as a scaled TH1F
         '''
-        assert(int(live_time) == live_time)
-        name = '__energy_hist_%s' % self.name
-        h = ROOT.TH1F(name, '', nbins, xmin, xmax)
-        binsize = '%1.1f' % (h.GetBinWidth(1) * 1000)
-        h.SetXTitle('Energy (' + e_units + ')')
-        h.SetYTitle('Counts/' + str(live_time) + ' y/' + binsize + ' keV bin')
-        self.tree.Draw('energy>>%s' % name, cut)
-        rootutils.set_plot_options(h, color)
-        if h.Integral() > 0:
-            pass_cut = h.Integral() / self.mc_events
-            normalization = sum(self.rates[:int(live_time)]) * self.scale
-            h.Scale(normalization * live_time * pass_cut / h.Integral())
-        return h
+        h = self.histogram(nbins, xmin, xmax, live_time, cut)
+        return rootutils.make_energy_hist('__energy_hist_%s' % self.name, h,
+                                          xmin, xmax, color, live_time,
+                                          e_units)
 
 
 class Chain(object):
@@ -92,12 +281,21 @@ class Chain(object):
     :param name: A string identifier
     :param title: A ROOT LaTeX title
     '''
+    __slots__ = ('name', 'title', 'chain', 'signals')
+
     def __init__(self, name, title):
         self.name = name
         self.title = title
         self.chain = None
         self.signals = []
 
+    def __getstate__(self):
+        return dict((k, getattr(self, k)) for k in self.__slots__)
+
+    def __setstate__(self, state):
+        for k, v in state.items():
+            setattr(self, k, v)
+
     def add_signal(self, signal):
         '''Add a signal to the background chain.
 
@@ -105,10 +303,21 @@ class Chain(object):
         '''
         self.signals.append(signal)
 
+    def leaves(self):
+        '''Get the individual Signals that make up the chain.
+
+        :returns: A list of Signals, in order
+        '''
+        leaves = []
+        for signal in self.signals:
+            leaves.extend(signal.leaves())
+        return leaves
+
     def count(self, live_time=1, cut=''):
         '''Get the rate of the events that pass a cut.
 
         :param cut: A ROOT TCut string
+        :param live_time: The live time in years, or a list of live times
         :returns: A list of (name, counts) tuples for all signals in the chain
         '''
         counts = []
@@ -116,6 +325,32 @@ class Chain(object):
             counts.extend(signal.count(live_time=live_time, cut=cut))
         return counts
 
+    def bootstrap(self, replicas=100, live_time=1, cut='', random_state=None):
+        '''Get Poisson bootstrap replicas of the count for an entire chain.
+
+        :param replicas: Number of bootstrap replicas
+        :param live_time: The live time in years, or a list of live times
+        :param cut: A ROOT TCut string
+        :param random_state: A numpy RandomState, default the global one
+        :returns: Array of summed counts, shape (replicas,) or (replicas,
+                  len(live_time))
+        '''
+        return sum(signal.bootstrap(replicas, live_time, cut, random_state)
+                   for signal in self.signals)
+
+    def histogram(self, nbins, xmin, xmax, live_time=1, cut=''):
+        '''Histogram the energy distribution for an entire chain.
+
+        :param nbins: Number of energy bins
+        :param xmin: Minimum of domain
+        :param xmax: Maximum of domain
+        :param live_time: Scale factor for live time (years)
+        :param cut: A ROOT TCut string
+        :returns: The summed, scaled bin contents as an array
+        '''
+        return histogram.fill_signals(self.leaves(), nbins, xmin, xmax,
+                                      live_time, cut).sum(axis=0)
+
     def plot(self, nbins, xmin, xmax, color=1, live_time=1, cut='',
              e_units='MeV'):
         '''Plot the energy distribution for an entire chain into a single 1D
@@ -130,19 +365,7 @@ class Chain(object):
         :param e_units: Energy units (if not MeV)
         :returns: The energy spectrum as a scaled TH1F
         '''
-        name = '__energy_hist_%s' % self.name
-        hsum = ROOT.TH1F(name, '', nbins, xmin, xmax)
-        binsize = '%1.1f' % (hsum.GetBinWidth(1) * 1000)
-        hsum.SetXTitle('Energy (' + e_units + ')')
-        hsum.SetYTitle('Counts/' + str(live_time) + ' y/' +
-                       binsize + ' keV bin')
-
-        for signal in self.signals:
-            h = signal.plot(nbins, xmin, xmax, live_time=live_time,
-                            cut=cut, e_units=e_units)
-            hsum.Add(h)
-
-        rootutils.set_plot_options(hsum, color)
-        return hsum
-        
-
+        h = self.histogram(nbins, xmin, xmax, live_time, cut)
+        return rootutils.make_energy_hist('__energy_hist_%s' % self.name, h,
+                                          xmin, xmax, color, live_time,
+                                          e_units)
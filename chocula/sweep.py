@@ -0,0 +1,271 @@
+'''Parameter sweeps over many analysis configurations.
+
+A sweep counts events in the ROI for a grid of configurations, each with a
+background table, fiducial radius, fitter, energy ROI and live time. Every
+distinct dataset (data filename glob) is loaded only once, and shared in
+memory by all the tables that use it, even if they differ in rates or scale
+factors. The configurations are then evaluated in parallel processes.
+
+Grids are YAML or CSV files. In YAML, a grid is a list of configurations, or
+a dict where lists of values are expanded into all their combinations::
+
+    table: [baseline.csv, clean.csv]
+    radius: [3000, 3500, 4000]
+    energy: m05p15
+
+In CSV, the first row names the columns. Missing fields take the defaults of
+``bin/chocula`` (see DEFAULTS), and each configuration may have a name.
+
+Optionally, each configuration's spectra and background pie chart are
+plotted with matplotlib (see ``headless``): the workers fill the spectra, and
+the plots are then rendered in parallel with ``headless.render_many``.
+'''
+
+import os
+import csv
+import itertools
+import multiprocessing
+import numpy as np
+from chocula import loader
+from chocula import counting
+from chocula import histogram
+from chocula import headless
+from chocula import rootutils
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+DEFAULTS = {
+    'radius': 3500.0,
+    'fitter': 'scintFit',
+    'energy': 'm05p15',
+    'live_time': 1.0,
+}
+
+# Default plot binning, as bins, min and max energy
+BINNING = (250, 0.0, 5.0)
+
+# Columns of the results table
+COLUMNS = ['config', 'table', 'radius', 'fitter', 'energy', 'live_time',
+           'energy_min', 'energy_max', 'name', 'title', 'count']
+
+
+def expand(grid):
+    '''Expand a grid into a list of configurations.
+
+    :param grid: A list of configuration dicts, or a dict of values where
+                 lists are expanded into all combinations
+    :returns: A list of configuration dicts, with defaults filled in
+    '''
+    if isinstance(grid, dict):
+        keys = sorted(grid)
+        values = [v if isinstance(v, list) else [v]
+                  for v in (grid[k] for k in keys)]
+        grid = [dict(zip(keys, v)) for v in itertools.product(*values)]
+
+    configs = []
+    for i, config in enumerate(grid):
+        c = dict(DEFAULTS)
+        c.update(config)
+        if 'table' not in c:
+            raise ValueError('Configuration %i has no table' % i)
+        c['radius'] = float(c['radius'])
+        c['live_time'] = float(c['live_time'])
+        c.setdefault('name', str(i))
+        configs.append(c)
+
+    return configs
+
+
+def load_grid(filename):
+    '''Load a grid of configurations from a YAML or CSV file.
+
+    :param filename: Path to a .yaml/.yml or .csv file
+    :returns: A list of configuration dicts
+    '''
+    if filename.endswith('.yaml') or filename.endswith('.yml'):
+        if yaml is None:
+            raise ImportError('PyYAML is required to read YAML grids')
+        with open(filename, 'r') as f:
+            grid = yaml.safe_load(f)
+    else:
+        with open(filename, 'r') as f:
+            lines = filter(lambda row: row.strip() and row[0] != '#', f)
+            grid = [dict((k.strip(), v.strip())
+                         for k, v in row.items() if v and v.strip())
+                    for row in csv.DictReader(lines)]
+
+    return expand(grid)
+
+
+def load_tables(tables, processes=None):
+    '''Load background tables, reading each distinct dataset only once.
+
+    Signals in different tables with the same filename share the loaded
+    events (and the selection cache).
+
+    :param tables: List of background table filenames
+    :param processes: Number of parallel processes for loading
+    :returns: A dict of {table: list of Signals and Chains}
+    '''
+    tables = sorted(set(tables))
+    imported = dict((table, loader.import_table(table, processes))
+                    for table in tables)
+
+    unique = {}
+    for table in tables:
+        for signal in imported[table]:
+            unique.setdefault(signal.filename, signal)
+
+    loaded = loader.load(unique.values(), processes)
+    datasets = dict((leaf.filename, leaf)
+                    for signal in loaded for leaf in signal.leaves())
+
+    for table in tables:
+        for signal in imported[table]:
+            dataset = datasets[signal.filename]
+            signal.files = dataset.files
+            signal.events = dataset.events
+            signal.nevents = dataset.nevents
+            signal.mc_events = dataset.mc_events
+            signal.selections = dataset.selections
+
+    return dict((table, loader.group_chains(imported[table]))
+                for table in tables)
+
+
+def plot_job(config, signals, counts, filename, binning=BINNING):
+    '''Fill the spectra and background shares for one configuration's plot.
+
+    :param config: A configuration dict
+    :param signals: The loaded Signals and Chains of its table
+    :param counts: The ROI counts, as from counting.count
+    :param filename: Output filename; the extension sets the format
+    :param binning: The (bins, min, max) energy binning
+    :returns: A dict of keyword arguments for headless.render
+    '''
+    nbins, xmin, xmax = binning
+    cut = rootutils.make_roi_cut(config['radius'], config['fitter'])
+
+    leaves, owner = [], []
+    for i, signal in enumerate(signals):
+        for leaf in signal.leaves():
+            leaves.append(leaf)
+            owner.append(i)
+    contents = np.zeros((len(signals), nbins))
+    np.add.at(contents, owner, histogram.fill_signals(
+        leaves, nbins, xmin, xmax, config['live_time'], cut))
+    spectra = histogram.Spectra(signals, contents, xmin, xmax,
+                                config['live_time'])
+
+    shares = dict((leaf.title, c) for leaf, (name, c) in zip(leaves, counts)
+                  if leaf.chain != 'S')
+    return {'spectra': spectra.to_dict(), 'filename': filename,
+            'counts': shares}
+
+
+def evaluate(config, signals, plots=None, binning=BINNING):
+    '''Count events in the ROI for one configuration.
+
+    :param config: A configuration dict
+    :param signals: The loaded Signals and Chains of its table
+    :param plots: Directory to plot the configuration into, or None
+    :param binning: The (bins, min, max) energy binning for plots
+    :returns: A (rows, plot) tuple, with a list of result dicts, one per
+              Signal, with keys COLUMNS, and the plot_job, or None
+    '''
+    signal_signal = filter(lambda x: x.chain == 'S', signals)[0]
+    fit = lambda cut: rootutils.get_energy_roi(signal_signal, cut)
+
+    fiducial_cut = rootutils.make_roi_cut(config['radius'], config['fitter'])
+    window = rootutils.energy_window(config['energy'], fit, fiducial_cut)
+    cut = rootutils.make_roi_cut(config['radius'], config['fitter'], window)
+
+    titles = dict((s.name, s.title)
+                  for signal in signals for s in signal.leaves())
+
+    counts = counting.count(signals, cut, 1, config['live_time'])
+    job = None
+    if plots is not None:
+        job = plot_job(config, signals, counts,
+                       os.path.join(plots, '%s.pdf' % config['name']),
+                       binning)
+
+    rows = []
+    for name, count in counts:
+        rows.append({
+            'config': config['name'],
+            'table': config['table'],
+            'radius': config['radius'],
+            'fitter': config['fitter'],
+            'energy': config['energy'],
+            'live_time': config['live_time'],
+            'energy_min': window[0],
+            'energy_max': window[1],
+            'name': name,
+            'title': titles[name],
+            'count': count,
+        })
+
+    return rows, job
+
+
+def _evaluate((config, signals, plots, binning)):
+    rows, job = evaluate(config, signals, plots, binning)
+    return rows, job, [leaf.selections.added
+                       for signal in signals for leaf in signal.leaves()]
+
+
+def run(configs, processes=None, plots=None, binning=BINNING):
+    '''Evaluate a list of configurations.
+
+    :param configs: A list of configuration dicts (see expand)
+    :param processes: Number of parallel processes
+    :param plots: Directory to plot each configuration into (as
+                  <name>.pdf), or None for no plots
+    :param binning: The (bins, min, max) energy binning for plots
+    :returns: A list of result dicts, as evaluate, for all configurations
+    '''
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    if plots is not None and not os.path.isdir(plots):
+        os.makedirs(plots)
+
+    tables = load_tables([c['table'] for c in configs], processes)
+    tasks = [(config, tables[config['table']], plots, binning)
+             for config in configs]
+
+    if processes > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(processes)
+        results = pool.map(_evaluate, tasks, chunksize=1)
+        pool.close()
+    else:
+        results = map(_evaluate, tasks)
+
+    # Keep the workers' selections, shared by the tables using each dataset
+    for task, (rows, job, added) in zip(tasks, results):
+        leaves = [leaf for signal in task[1] for leaf in signal.leaves()]
+        for leaf, selections in zip(leaves, added):
+            leaf.selections.update(selections)
+
+    if plots is not None:
+        headless.render_many([job for rows, job, added in results],
+                             processes)
+
+    return [row for rows, job, added in results for row in rows]
+
+
+def write_csv(rows, filename):
+    '''Write sweep results to one CSV table.
+
+    :param rows: Result dicts from run
+    :param filename: Output filename
+    '''
+    with open(filename, 'w') as f:
+        f.write('#' + ','.join(COLUMNS) + '\n')
+        writer = csv.writer(f)
+        for row in rows:
+            writer.writerow([row[k] for k in COLUMNS])
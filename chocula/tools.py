@@ -1,6 +1,7 @@
 '''Tools to make counting easier.'''
 
 import math
+import numpy as np
 
 m_e = 511e3  # electron mass in eV
 
@@ -8,10 +9,10 @@ def lifetime_to_mass(isotope, lifetime):
     '''Convert a lifetime limit to a mass limit.
 
     :param isotope: Isotope object with nuclear parameters
-    :param lifetime: Lifetime limit in years
+    :param lifetime: Lifetime limit in years, a number or array
     :returns: Mass limit in eV
     '''
-    return m_e / math.sqrt(lifetime * isotope.G * isotope.M**2)
+    return m_e / np.sqrt(lifetime * isotope.G * isotope.M**2)
 
 
 def mass_to_lifetime(isotope, mass):
@@ -13,6 +13,11 @@ setup(
     author_email='mastbaum@hep.upenn.edu',
     scripts=['bin/chocula'],
     packages=find_packages(),
-    package_data={'chocula.data': ['*.csv']}
+    package_data={'chocula.data': ['*.csv']},
+    install_requires=['numpy', 'scipy'],
+    extras_require={
+        'yaml': ['PyYAML'],
+        'plots': ['matplotlib'],
+    }
 )
 
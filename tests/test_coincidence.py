@@ -0,0 +1,45 @@
+import unittest
+import numpy as np
+from chocula import coincidence
+
+
+class TestCoincidence(unittest.TestCase):
+    def test_find_pairs(self):
+        time = np.array([0.0, 5, 10, 100, 103, 200])
+        p, d = coincidence.find_pairs(time, np.arange(6), np.arange(6),
+                                      (1, 6))
+        self.assertEqual(sorted(zip(p.tolist(), d.tolist())),
+                         [(0, 1), (1, 2), (3, 4)])
+
+    def test_candidates_and_blocks(self):
+        time = np.array([0.0, 1, 2, 3, 4])
+        # Unsorted delayed candidates, small blocks
+        p, d = coincidence.find_pairs(time, [0, 2], [4, 3, 1], (0, 2),
+                                      block_size=1)
+        self.assertEqual(sorted(zip(p.tolist(), d.tolist())),
+                         [(0, 1), (2, 3), (2, 4)])
+
+    def test_distance(self):
+        time = np.array([0.0, 1, 2])
+        position = (np.array([0.0, 10, 1000]), np.zeros(3), np.zeros(3))
+        p, d = coincidence.find_pairs(time, [0], [1, 2], (0, 5), 100,
+                                      position)
+        self.assertEqual((p.tolist(), d.tolist()), ([0], [1]))
+
+    def test_no_pairs(self):
+        p, d = coincidence.find_pairs([0.0, 100], [0], [1], (1, 2))
+        self.assertEqual((len(p), len(d)), (0, 0))
+
+    def test_tag(self):
+        events = {
+            'time': np.array([0.0, 1, 50, 51]),
+            'energy': np.array([3.0, 1.0, 3.0, 3.0]),
+        }
+        tags = coincidence.tag(events, 4, (0.5, 2), prompt='energy > 2',
+                               delayed='energy < 2')
+        self.assertEqual(tags.tolist(), [coincidence.PROMPT,
+                                         coincidence.DELAYED, 0, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+import numpy as np
+from chocula import cuts
+from chocula import shared
+
+
+def events():
+    return {
+        'energy': np.array([1.0, 2.5, 3.0, 2.6, 0.5]),
+        'evIndex': np.array([0, 0, 1, -1, 0]),
+        'posx': np.array([0.0, 3000, 0, 100, 0]),
+        'posy': np.zeros(5),
+        'posz': np.zeros(5),
+    }
+
+
+class TestParse(unittest.TestCase):
+    def test_select(self):
+        ev = events()
+        self.assertEqual(cuts.select('energy > 2 && evIndex == 0', ev, 5)
+                         .tolist(), [1])
+        self.assertEqual(cuts.select('energy < 1 || evIndex != 0', ev, 5)
+                         .tolist(), [2, 3, 4])
+        self.assertEqual(cuts.select('!(energy > 2)', ev, 5).tolist(),
+                         [0, 4])
+        self.assertEqual(cuts.select('2 * energy - 1 >= 4', ev, 5).tolist(),
+                         [1, 2, 3])
+        self.assertEqual(cuts.select('', ev, 5).tolist(), range(5))
+
+    def test_precedence(self):
+        ev = events()
+        self.assertEqual(
+            cuts.select('energy > 2 || energy < 1 && evIndex == 1', ev, 5)
+            .tolist(), [1, 2, 3])
+
+    def test_radius(self):
+        ev = events()
+        cut = 'sqrt(posx*posx + posy*posy + posz*posz) < 2000'
+        self.assertEqual(cuts.select(cut, ev, 5).tolist(), [0, 2, 3, 4])
+
+        # The squared radius is used if available
+        ev['r2'] = np.square(ev['posx'])
+        self.assertEqual(cuts.select(cut, ev, 5).tolist(), [0, 2, 3, 4])
+
+    def test_errors(self):
+        self.assertRaises(ValueError, cuts.parse, 'energy >')
+        self.assertRaises(ValueError, cuts.parse, 'foo(energy) > 1')
+
+    def test_columns(self):
+        self.assertEqual(cuts.columns('sqrt(posx*posx) < 3 && !scintFit'),
+                         set(['posx', 'scintFit']))
+        self.assertEqual(cuts.columns(''), set())
+
+    def test_terms(self):
+        self.assertEqual(cuts.terms('(energy>2.0) && evIndex==0'),
+                         cuts.terms('energy > 2 &&  (evIndex == 0)'))
+        self.assertEqual(len(cuts.terms('a > 1 && (b > 1 || c > 1)')), 2)
+        self.assertEqual(cuts.terms(''), [])
+
+
+class TestSelectionCache(unittest.TestCase):
+    def setUp(self):
+        self.events = events()
+        self.cache = cuts.SelectionCache(self.events, 5)
+
+    def test_select(self):
+        for cut in ('energy > 2', 'energy > 2 && evIndex == 0',
+                    'evIndex == 0 && energy > 2', ''):
+            self.assertEqual(self.cache.select(cut).tolist(),
+                             cuts.select(cut, self.events, 5).tolist())
+
+    def test_refines_cached_selection(self):
+        self.cache.select('energy > 2')
+        parent = frozenset(cuts.terms('energy > 2'))
+        self.cache.selections[parent] = shared.share([1, 2])
+        self.assertEqual(self.cache.select('energy > 2 && evIndex == 0')
+                         .tolist(), [1])
+
+    def test_eviction_unlinks(self):
+        self.cache.max_entries = 1
+        first = self.cache.select('energy > 2')
+        filename = first.filename
+        self.cache.select('evIndex == 0')
+        self.assertEqual(len(self.cache.selections), 1)
+        self.assertIsNone(first.filename)
+        self.assertFalse(shared.os.path.exists(filename))
+
+        # The evicted array stays usable
+        self.assertEqual(first.tolist(), [1, 2, 3])
+
+    def test_clear(self):
+        indices = self.cache.select('energy > 2')
+        self.cache.clear()
+        self.assertEqual(len(self.cache.selections), 0)
+        self.assertIsNone(indices.filename)
+
+    def test_copies_own_nothing(self):
+        import pickle
+        self.cache.select('energy > 2')
+        copy = pickle.loads(pickle.dumps(self.cache, 2))
+        self.assertEqual(copy.owned, set())
+        copy.clear()
+        self.assertEqual(self.cache.select('energy > 2').tolist(), [1, 2, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+try:
+    from chocula import distributed
+    from chocula import signals
+except ImportError:
+    distributed = None
+
+
+def read_tree(filename, tree_name='data', branches=None):
+    '''Stand-in for rootutils.read_tree, reading .npz files.'''
+    arrays = np.load(filename)
+    return dict((b, arrays[b]) for b in branches)
+
+
+@unittest.skipIf(distributed is None, 'ROOT is not available')
+class TestTaskQueue(unittest.TestCase):
+    def setUp(self):
+        self.queue = distributed.TaskQueue([{'id': 0}, {'id': 1}], lease=0.05,
+                                           max_attempts=2)
+
+    def test_done(self):
+        self.assertEqual(self.queue.get('a')['id'], 0)
+        self.assertEqual(self.queue.get('b')['id'], 1)
+        self.assertIsNone(self.queue.get('c'))
+        self.queue.put('a', 0, 'x')
+        self.queue.put('b', 1, 'y')
+        self.assertTrue(self.queue.finished())
+        self.assertEqual(self.queue.get('c'), 'done')
+        self.assertEqual(self.queue.results, {0: 'x', 1: 'y'})
+
+    def test_lease_expiry(self):
+        self.queue.get('a')
+        time.sleep(0.1)
+        self.assertFalse(self.queue.heartbeat('b', 0))
+        self.assertEqual(self.queue.get('b')['id'], 0)
+        self.assertFalse(self.queue.heartbeat('a', 0))
+        self.assertTrue(self.queue.heartbeat('b', 0))
+
+        # A late result from the first worker still counts
+        self.queue.put('a', 0, 'x')
+        self.assertEqual(self.queue.results, {0: 'x'})
+
+    def test_heartbeat(self):
+        self.queue.get('a')
+        for i in range(4):
+            time.sleep(0.02)
+            self.assertTrue(self.queue.heartbeat('a', 0))
+        self.assertEqual(self.queue.get('b')['id'], 1)
+
+    def test_failures(self):
+        self.queue.get('a')
+        self.queue.fail('a', 0, 'oops')
+        self.assertEqual(self.queue.get('b')['id'], 0)
+        self.queue.fail('b', 0, 'oops again')
+        self.assertTrue(self.queue.finished())
+        self.assertIn('oops again', self.queue.error)
+        self.assertEqual(self.queue.get('c'), 'done')
+
+    def test_release(self):
+        self.queue.get('a')
+        self.queue.release('a')
+        self.assertEqual(self.queue.get('b')['id'], 0)
+
+
+@unittest.skipIf(distributed is None, 'ROOT is not available')
+class TestRun(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.read_tree = distributed.rootutils.read_tree
+        distributed.rootutils.read_tree = read_tree
+
+    def tearDown(self):
+        distributed.rootutils.read_tree = self.read_tree
+        shutil.rmtree(self.tmp)
+
+    def write(self, name, energy):
+        filename = os.path.join(self.tmp, name + '.npz')
+        with open(filename, 'wb') as f:
+            np.savez(f, energy=np.asarray(energy, dtype=np.float64),
+                     evIndex=np.zeros(len(energy)))
+        return filename
+
+    def test_local_workers(self):
+        signal = signals.Signal('a', 'S', 'A', None, [10.0],
+                                files=[[self.write('a0', [1, 2, 3]), 0, 3, 3],
+                                       [self.write('a1', [2.5, 4]), 0, 2, 2]])
+        counts, spectra = distributed.run([signal], 'energy > 1.5', port=0,
+                                          binning=(4, 0, 4),
+                                          local_workers=2)
+        self.assertAlmostEqual(counts[0][1], 10.0 * 4 / 5)
+        np.testing.assert_allclose(spectra.contents[0],
+                                   [0, 0, 4, 2])
+
+    def test_rejects_other_methods(self):
+        queue = distributed.TaskQueue([])
+        coordinator = distributed.Coordinator(queue, 'key', ('localhost', 0))
+        try:
+            conn = distributed.Client(('localhost', coordinator.port),
+                                      authkey='key')
+            conn.send(('release', 'w'))
+            self.assertRaises(EOFError, conn.recv)
+            conn.close()
+        finally:
+            coordinator.close()
+
+    def test_requires_authkey(self):
+        self.assertRaises(ValueError, distributed.Coordinator,
+                          distributed.TaskQueue([]), None, ('localhost', 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
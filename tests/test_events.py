@@ -0,0 +1,88 @@
+import os
+import unittest
+import numpy as np
+from chocula import cuts
+from chocula.events import Events, FULL_PRECISION
+
+
+def a(values):
+    '''Branch values, as read by rootutils.read_tree.'''
+    return np.array(values, dtype=np.float64)
+
+
+class TestEvents(unittest.TestCase):
+    def test_types(self):
+        events = Events(4)
+        events.fill(0, {'energy': a([1.5, 2.5]), 'evIndex': a([0, 1]),
+                        'scintFit': a([1, 0]), 'other': a([0.5, 2])})
+        events.fill(2, {'energy': a([3.5, 4.5]), 'evIndex': a([-1, 0]),
+                        'scintFit': a([1, 1]), 'other': a([1, 1])})
+        self.assertEqual(events['energy'].dtype, np.float32)
+        self.assertEqual(events['evIndex'].dtype, np.int8)
+        self.assertEqual(events['other'].dtype, np.float32)
+        self.assertIn('scintFit', events.flag_bits)
+        self.assertEqual(events['scintFit'].tolist(),
+                         [True, False, True, True])
+        self.assertEqual(events['evIndex'].tolist(), [0, 1, -1, 0])
+
+    def test_promotion(self):
+        events = Events(4)
+        events.fill(0, {'scintFit': a([1, 0]), 'evIndex': a([0, 1])})
+        events.fill(2, {'scintFit': a([2, 1]), 'evIndex': a([0.5, 0])})
+        self.assertNotIn('scintFit', events.flag_bits)
+        self.assertEqual(events['scintFit'].tolist(), [1, 0, 2, 1])
+        self.assertEqual(events['evIndex'].dtype, np.float32)
+        self.assertEqual(events['evIndex'].tolist(), [0, 1, 0.5, 0])
+
+    def test_policy(self):
+        events = Events(2, {'*': 'float64'})
+        events.fill(0, {'energy': a([1.25, 2.5]), 'scintFit': a([1, 0])})
+        self.assertEqual(events['energy'].dtype, np.float64)
+        self.assertEqual(events['scintFit'].dtype, np.float64)
+
+    def test_radius(self):
+        events = Events(2)
+        events.fill(0, {'posx': a([3, 0]), 'posy': a([4, 0]),
+                        'posz': a([0, 1])})
+        events.finalize()
+        np.testing.assert_allclose(events['r2'], [25, 1])
+        cut = 'sqrt(posx*posx + posy*posy + posz*posz) < 2'
+        self.assertEqual(cuts.select(cut, events, 2).tolist(), [1])
+
+    def test_view_and_columns(self):
+        events = Events(3)
+        events.fill(0, {'energy': a([1, 2, 3]), 'scintFit': a([0, 1, 1])})
+        view = events.view(1, 5)
+        self.assertEqual(len(view), 2)
+        self.assertEqual(view['energy'].tolist(), [2, 3])
+        self.assertEqual(view['scintFit'].tolist(), [True, True])
+
+        events.add_column('tag', np.array([0, 1, 0], dtype=np.int8))
+        self.assertEqual(cuts.select('tag == 0', events, 3).tolist(), [0, 2])
+        self.assertRaises(ValueError, events.add_column, 'tag', [0])
+
+    def test_replaced_columns_unlinked(self):
+        events = Events(2)
+        events.fill(0, {'evIndex': a([0, 1])})
+        old = events['evIndex']
+        filename = old.filename
+        events.fill(0, {'evIndex': a([0.5, 1])})
+        self.assertEqual(events['evIndex'].dtype, np.float32)
+        self.assertIsNone(old.filename)
+        self.assertFalse(os.path.exists(filename))
+
+        events.add_column('tag', np.zeros(2))
+        tag = events['tag']
+        events.add_column('tag', np.ones(2))
+        self.assertIsNone(tag.filename)
+        self.assertEqual(events['tag'].tolist(), [1, 1])
+
+    def test_full_precision(self):
+        events = Events(2, FULL_PRECISION)
+        events.fill(0, {'energy': a([1.1, 2.2]), 'scintFit': a([1, 0])})
+        self.assertEqual(events['energy'].tolist(), [1.1, 2.2])
+        self.assertEqual(events.flag_bits, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+import numpy as np
+import scipy.optimize
+import scipy.stats
+from chocula import fitting
+from chocula import sensitivity
+from chocula.histogram import Spectra
+
+
+def spectra(rows, chains):
+    '''Spectra of templates, with names n0, n1, ...'''
+    sp = Spectra([], np.array(rows, dtype=np.float64), 0, len(rows[0]))
+    sp.names = ['n%i' % i for i in range(len(rows))]
+    sp.titles = sp.names
+    sp.chains = chains
+    return sp
+
+
+class TestTemplateFit(unittest.TestCase):
+    def setUp(self):
+        x = np.arange(20) + 0.5
+        self.signal = 30 * np.exp(-0.5 * np.square((x - 10) / 1.5))
+        self.flat = np.full(20, 20.0)
+        self.falling = 100 * np.exp(-x / 5)
+        self.fit = fitting.TemplateFit(spectra(
+            [self.signal, self.flat, self.falling], ['S', 'U', 'Th']))
+
+    def test_gradient(self):
+        data = self.fit.asimov(0.5)[self.fit.keep]
+        for mu in ([1, 1, 1], [0.3, 1.2, 0.8], [2, 0.1, 1.5]):
+            error = scipy.optimize.check_grad(self.fit.nll, self.fit.gradient,
+                                              np.array(mu, dtype=float),
+                                              data)
+            self.assertLess(error, 1e-4)
+
+    def test_fit_asimov(self):
+        for signal in (0.0, 1.0, 2.5):
+            mu, nll = self.fit.fit(self.fit.asimov(signal))
+            np.testing.assert_allclose(mu, [signal, 1, 1], atol=1e-3)
+
+    def test_fixed(self):
+        mu, nll = self.fit.fit(self.fit.asimov(1.0), {0: 2.0})
+        self.assertEqual(mu[0], 2.0)
+        self.assertGreater(nll, self.fit.fit(self.fit.asimov(1.0))[1])
+
+    def test_profile(self):
+        q = self.fit.profile(self.fit.asimov(1.0), [0, 0.5, 1, 1.5, 3])
+        self.assertAlmostEqual(q[2], 0, 4)
+        self.assertTrue(np.all(q >= -1e-6))
+        self.assertTrue(q[0] > q[1] > q[2] and q[2] < q[3] < q[4])
+
+    def test_upper_limit(self):
+        limit = self.fit.upper_limit(self.fit.asimov(0.0))
+
+        # At the limit, -2 log likelihood ratio crosses the threshold
+        value = limit / self.signal.sum()
+        q = self.fit.profile(self.fit.asimov(0.0), [value])[0]
+        self.assertAlmostEqual(q, scipy.stats.chi2.ppf(0.8, 1), 3)
+
+    def test_upper_limit_floor(self):
+        # Without background, the limit is the Poisson limit for 0 events
+        fit = fitting.TemplateFit(spectra([self.signal, self.flat],
+                                          ['S', 'U']))
+        data = fit.asimov(0.0, np.array([0.0, 0.0]))
+        self.assertAlmostEqual(fit.upper_limit(data),
+                               sensitivity.poisson_floor(), 6)
+        self.assertAlmostEqual(fit.upper_limit(data, 0.95), -np.log(0.05), 6)
+
+    def test_signal_rows_tied(self):
+        half = 0.5 * self.signal
+        fit = fitting.TemplateFit(spectra([half, self.flat, half],
+                                          ['S', 'U', 'S']))
+        self.assertEqual(fit.names, ['n0', 'n1'])
+        np.testing.assert_allclose(fit.asimov(1.0),
+                                   self.signal + self.flat)
+        self.assertAlmostEqual(
+            fit.upper_limit(fit.asimov(0.0)),
+            fitting.TemplateFit(spectra([self.signal, self.flat],
+                                        ['S', 'U'])).upper_limit(
+                fit.asimov(0.0)), 6)
+
+    def test_no_signal(self):
+        fit = fitting.TemplateFit(spectra([self.flat], ['U']))
+        self.assertRaises(ValueError, fit.upper_limit, self.flat)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+import numpy as np
+from chocula.events import Events
+
+try:
+    from chocula import cuts
+    from chocula import plot
+    from chocula import fused
+    from chocula import counting
+    from chocula import rootutils
+    from chocula.signals import Signal, Chain
+except ImportError:
+    fused = None
+
+
+def loaded(name, chain, seed, n=5000):
+    '''A Signal with random events in memory.'''
+    r = np.random.RandomState(seed)
+    energy = r.uniform(0, 5, n)
+    # Events on the edge of a window, after rounding as in build_tcut
+    energy[:50] = 2.0000002
+    signal = Signal(name, chain, name, name + '.root', [1, 2, 3, 4, 5])
+    signal.events = Events(n)
+    signal.events.fill(0, {
+        'energy': energy,
+        'posx': r.uniform(-6000, 6000, n),
+        'posy': r.uniform(-6000, 6000, n),
+        'posz': r.uniform(-6000, 6000, n),
+        'evIndex': r.choice([-1.0, 0.0, 1.0], n),
+        'scintFit': r.choice([0.0, 1.0], n, p=[0.1, 0.9]),
+    })
+    signal.events.finalize()
+    signal.nevents = n
+    signal.selections = cuts.SelectionCache(signal.events, n)
+    signal.mc_events = len(signal.select('evIndex <= 0'))
+    return signal
+
+
+@unittest.skipIf(fused is None, 'ROOT is not available')
+class TestFused(unittest.TestCase):
+    def setUp(self):
+        chain = Chain('U', 'U Chain')
+        chain.add_signal(loaded('bi', 'U', 2))
+        chain.add_signal(loaded('pb', 'U', 3))
+        self.signals = [loaded('sig', 'S', 1), chain, loaded('c', '', 4)]
+
+    def check(self, energy, processes):
+        cut = rootutils.make_roi_cut(3500, 'scintFit')
+        window, counts, spectra = fused.analyze(
+            self.signals, cut, energy, 50, 0, 5, [1, 3], 2, processes)
+
+        roi_cut = rootutils.make_roi_cut(3500, 'scintFit', window)
+        expected = counting.count(self.signals, roi_cut, 1, [1, 3])
+        self.assertEqual([name for name, c in counts],
+                         [name for name, c in expected])
+        for c, e in zip(counts, expected):
+            np.testing.assert_array_equal(c[1], e[1])
+
+        histogram = plot.histogram(self.signals, 50, 0, 5, 2, cut,
+                                   processes=1)
+        self.assertEqual(spectra.names, histogram.names)
+        np.testing.assert_allclose(spectra.contents, histogram.contents)
+
+    def test_matches_count_and_histogram(self):
+        self.check((2.1234567, 2.7654321), 1)
+        self.check('2.0000004:3', 1)
+
+    def test_parallel(self):
+        self.check((2.0000004, 3), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
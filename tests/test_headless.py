@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from chocula import headless
+
+
+def spectra(errors=False):
+    '''Spectra of a signal and two backgrounds, as from Spectra.to_dict.'''
+    x = np.linspace(0.05, 4.95, 50)
+    contents = [10 * np.exp(-0.5 * np.square((x - 2.5) / 0.1)),
+                100 * np.exp(-x), np.full(50, 5.0)]
+    return {
+        'names': ['sig', 'U', 'Th'],
+        'titles': ['0#nu#beta#beta', '^{214}Bi', 'Th Chain'],
+        'chains': ['S', 'U', 'Th'],
+        'contents': np.array(contents).tolist(),
+        'xmin': 0.0,
+        'xmax': 5.0,
+        'live_time': 1,
+        'errors': np.sqrt(contents).tolist() if errors else None,
+    }
+
+
+class TestHeadless(unittest.TestCase):
+    def test_mathtext(self):
+        self.assertEqual(headless.mathtext('^{214}Bi + ^{214}Po'),
+                         '$^{214}$Bi + $^{214}$Po')
+        self.assertEqual(headless.mathtext('0#nu#beta#beta'),
+                         '0$\\nu\\beta\\beta$')
+
+    def test_pie_shares(self):
+        shares = headless.pie_shares({'a': 1, 'b': 5, 'c': 3, 'd': 2}, 3)
+        self.assertEqual(shares, [('b', 5), ('c', 3), ('', 3)])
+
+
+@unittest.skipIf(headless.matplotlib is None, 'matplotlib is not available')
+class TestRender(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def check(self, filename, magic):
+        self.assertTrue(os.path.getsize(filename) > 0)
+        with open(filename, 'rb') as f:
+            self.assertEqual(f.read(len(magic)), magic)
+
+    def test_render(self):
+        png = os.path.join(self.tmp, 'spectra.png')
+        self.assertEqual(headless.render(spectra(), png), png)
+        self.check(png, '\x89PNG')
+
+        pdf = os.path.join(self.tmp, 'spectra.pdf')
+        headless.render(spectra(errors=True), pdf, 1e-3, 1e3,
+                        counts={'^{214}Bi': 3.0, 'Th Chain': 1.0},
+                        stack=True)
+        self.check(pdf, '%PDF')
+
+    def test_render_pie(self):
+        filename = os.path.join(self.tmp, 'pie.png')
+        headless.render_pie({'^{214}Bi': 3.0, 'Th Chain': 1.0}, filename)
+        self.check(filename, '\x89PNG')
+
+    def test_render_many(self):
+        jobs = [{'spectra': spectra(),
+                 'filename': os.path.join(self.tmp, '%i.png' % i)}
+                for i in range(3)]
+        filenames = headless.render_many(jobs, 2)
+        self.assertEqual(filenames, [job['filename'] for job in jobs])
+        for filename in filenames:
+            self.check(filename, '\x89PNG')
+
+
+if __name__ == '__main__':
+    unittest.main()
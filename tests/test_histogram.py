@@ -0,0 +1,22 @@
+import unittest
+import numpy as np
+from chocula import histogram
+
+
+class TestHistogram(unittest.TestCase):
+    def test_bin_index(self):
+        idx = histogram.bin_index([-1, 0, 0.49, 0.5, 4.99, 5, 7], 10, 0, 5)
+        self.assertEqual(idx.tolist(), [-1, 0, 0, 1, 9, -1, -1])
+
+    def test_fill(self):
+        idx = np.array([0, 1, 1, -1, 2])
+        w = np.array([1.0, 2.0, 3.0, 100.0, 0.5])
+        np.testing.assert_allclose(histogram.fill(idx, w, 4), [1, 5, 0.5, 0])
+
+        rows = np.array([0, 1, 0, 0, 1])
+        np.testing.assert_allclose(histogram.fill(idx, w, 3, rows, 2),
+                                   [[1, 3, 0], [0, 2, 0.5]])
+
+
+if __name__ == '__main__':
+    unittest.main()
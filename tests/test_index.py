@@ -0,0 +1,89 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+import numpy as np
+
+try:
+    from chocula import index
+except ImportError:
+    index = None
+
+
+def read_tree(filename, tree_name='data', branches=None):
+    '''Stand-in for rootutils.read_tree, reading .npz files.'''
+    arrays = np.load(filename)
+    return dict((b, arrays[b]) for b in branches)
+
+
+def _update(i):
+    index.update({'/data/%i.root' % i: {'entries': i}})
+
+
+@unittest.skipIf(index is None, 'ROOT is not available')
+class TestIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.saved = (index.cache_dir, index.index_path, index.lock_path,
+                      index.rootutils.read_tree)
+        index.cache_dir = os.path.join(self.tmp, 'cache')
+        index.index_path = os.path.join(index.cache_dir, 'index.json')
+        index.lock_path = os.path.join(index.cache_dir, 'index.lock')
+        index.rootutils.read_tree = read_tree
+        index._index, index._index_mtime = {}, None
+
+    def tearDown(self):
+        (index.cache_dir, index.index_path, index.lock_path,
+         index.rootutils.read_tree) = self.saved
+        index._index, index._index_mtime = {}, None
+        shutil.rmtree(self.tmp)
+
+    def write(self, name, evindex):
+        filename = os.path.join(self.tmp, name + '.root')
+        with open(filename, 'wb') as f:
+            np.savez(f, evIndex=np.asarray(evindex, dtype=np.float64),
+                     energy=np.arange(len(evindex), dtype=np.float64))
+        return filename
+
+    def test_build(self):
+        a = self.write('a', [0, 1, -1, 0])
+        b = self.write('b', [0])
+        infos = index.build([os.path.join(self.tmp, '*.root')], processes=1)
+        self.assertEqual(sorted(infos), [a, b])
+        self.assertEqual(infos[a]['entries'], 4)
+        self.assertEqual(infos[a]['mc_events'], 3)
+        self.assertEqual((infos[a]['energy_min'], infos[a]['energy_max']),
+                         (0, 3))
+        self.assertEqual(infos[b]['mc_events'], 1)
+
+        # Stored, and reused without reading the files
+        index.rootutils.read_tree = None
+        self.assertEqual(index.build([a, b], processes=1), infos)
+        index._index, index._index_mtime = {}, None
+        self.assertEqual(index.load_index(), infos)
+
+    def test_is_current(self):
+        a = self.write('a', [0, 1])
+        info = index.build([a], processes=1)[a]
+        self.assertTrue(index.is_current(info, a))
+        self.assertFalse(index.is_current(info, a, 'other'))
+        self.assertFalse(index.is_current(None, a))
+
+        # Rewritten files are scanned again
+        time.sleep(0.01)
+        self.write('a', [0, 0, 0])
+        self.assertFalse(index.is_current(info, a))
+        self.assertEqual(index.build([a], processes=1)[a]['mc_events'], 3)
+
+    def test_concurrent_updates(self):
+        pool = multiprocessing.Pool(4)
+        pool.map(_update, range(40), chunksize=1)
+        pool.close()
+        pool.join()
+        self.assertEqual(len(index.load_index(force=True)), 40)
+
+
+if __name__ == '__main__':
+    unittest.main()
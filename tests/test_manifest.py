@@ -0,0 +1,105 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+try:
+    from chocula import index
+    from chocula import manifest
+except ImportError:
+    manifest = None
+
+reads = []
+
+
+def read_tree(filename, tree_name='data', branches=None):
+    '''Stand-in for rootutils.read_tree, reading .npz files.'''
+    reads.append(filename)
+    arrays = np.load(filename)
+    return dict((b, arrays[b]) for b in branches or arrays.files)
+
+
+@unittest.skipIf(manifest is None, 'ROOT is not available')
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.saved = (index.cache_dir, index.index_path, index.lock_path,
+                      index.rootutils.read_tree)
+        index.cache_dir = os.path.join(self.tmp, 'cache')
+        index.index_path = os.path.join(index.cache_dir, 'index.json')
+        index.lock_path = os.path.join(index.cache_dir, 'index.lock')
+        index.rootutils.read_tree = read_tree
+        index._index, index._index_mtime = {}, None
+        del reads[:]
+
+        self.table = os.path.join(self.tmp, 'table.csv')
+        self.write_table(1)
+
+    def tearDown(self):
+        (index.cache_dir, index.index_path, index.lock_path,
+         index.rootutils.read_tree) = self.saved
+        index._index, index._index_mtime = {}, None
+        shutil.rmtree(self.tmp)
+
+    def write_table(self, scale):
+        with open(self.table, 'w') as f:
+            f.write('# chain,name,title,filename,scale,rates\n')
+            f.write('S,sig,Signal,%s,%s,10,10,10,10,10\n' %
+                    (os.path.join(self.tmp, 'sig*.root'), scale))
+
+    def write(self, name, n):
+        filename = os.path.join(self.tmp, name + '.root')
+        with open(filename, 'wb') as f:
+            np.savez(f, energy=np.ones(n), evIndex=np.zeros(n))
+        return filename
+
+    def files(self):
+        return manifest.load(self.table, processes=1)['files'].values()[0]
+
+    def test_load(self):
+        a = self.write('sig1', 10)
+        m = manifest.load(self.table, processes=1)
+        self.assertEqual(m['rows'][0]['name'], 'sig')
+        self.assertEqual(m['rows'][0]['rates'], [10] * 5)
+        self.assertEqual(m['files'].values()[0],
+                         [[a, os.stat(a).st_size, 10, 10]])
+        self.assertTrue(os.path.exists(manifest.sidecar(self.table)))
+
+        # Reused without reading the data
+        del reads[:]
+        self.assertEqual(manifest.load(self.table, processes=1), m)
+        self.assertEqual(reads, [])
+
+    def test_invalidation(self):
+        a = self.write('sig1', 10)
+        self.files()
+
+        # A file rewritten in place is read again
+        time.sleep(0.01)
+        self.write('sig1', 20)
+        del reads[:]
+        self.assertEqual([f[2] for f in self.files()], [20])
+        self.assertEqual(reads, [a])
+
+        # New files matching the glob are found, and only they are read
+        b = self.write('sig2', 5)
+        del reads[:]
+        self.assertEqual([(f[0], f[2]) for f in self.files()],
+                         [(a, 20), (b, 5)])
+        self.assertEqual(reads, [b])
+
+        # Removed files are dropped
+        os.remove(a)
+        self.assertEqual([f[0] for f in self.files()], [b])
+
+        # An edited table is parsed again
+        time.sleep(0.01)
+        self.write_table(0.5)
+        m = manifest.load(self.table, processes=1)
+        self.assertEqual(m['rows'][0]['scale'], 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
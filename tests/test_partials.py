@@ -0,0 +1,123 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+try:
+    from chocula import index
+    from chocula import loader
+    from chocula import counting
+    from chocula import partials
+    from chocula.signals import Signal
+except ImportError:
+    partials = None
+
+reads = []
+
+
+def read_tree(filename, tree_name='data', branches=None):
+    '''Stand-in for rootutils.read_tree, reading .npz files.'''
+    reads.append(filename)
+    arrays = np.load(filename)
+    return dict((b, arrays[b]) for b in branches or arrays.files)
+
+
+@unittest.skipIf(partials is None, 'ROOT is not available')
+class TestPartials(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.saved = (index.cache_dir, index.index_path, index.lock_path,
+                      partials.partials_dir, partials.rootutils.read_tree)
+        index.cache_dir = os.path.join(self.tmp, 'cache')
+        index.index_path = os.path.join(index.cache_dir, 'index.json')
+        index.lock_path = os.path.join(index.cache_dir, 'index.lock')
+        partials.partials_dir = os.path.join(index.cache_dir, 'partials')
+        partials.rootutils.read_tree = read_tree
+        index._index, index._index_mtime = {}, None
+        del reads[:]
+
+    def tearDown(self):
+        (index.cache_dir, index.index_path, index.lock_path,
+         partials.partials_dir, partials.rootutils.read_tree) = self.saved
+        index._index, index._index_mtime = {}, None
+        shutil.rmtree(self.tmp)
+
+    def write(self, name, seed, n=2000):
+        r = np.random.RandomState(seed)
+        filename = os.path.join(self.tmp, name + '.root')
+        with open(filename, 'wb') as f:
+            np.savez(f, energy=r.uniform(0, 15, n),
+                     evIndex=r.choice([-1.0, 0.0, 1.0], n),
+                     scintFit=r.choice([0.0, 1.0], n, p=[0.1, 0.9]))
+        return filename
+
+    def signals(self):
+        return [Signal('a', '', 'A', os.path.join(self.tmp, 'a*.root'),
+                       [1, 2, 3, 4, 5]),
+                Signal('b', '', 'B', os.path.join(self.tmp, 'b*.root'),
+                       [2, 2, 2, 2, 2], 0.5)]
+
+    def test_split_energy(self):
+        cut, window = partials.split_energy(
+            'evIndex == 0 && energy > 2.2 && energy < 2.8 && energy >= 2')
+        self.assertEqual(cut, '(evIndex == 0.0)')
+        self.assertEqual(window, ((2.2, False), (2.8, False)))
+        # With equal bounds, the exclusive one is tighter
+        self.assertEqual(partials.split_energy(
+            'energy <= 3 && energy < 3 && energy >= 1')[1],
+            ((1.0, True), (3.0, False)))
+        self.assertEqual(partials.split_energy('energy*2 > 1'),
+                         ('((energy * 2.0) > 1.0)', partials.NO_WINDOW))
+
+    def test_window_count(self):
+        energy = np.array([2.3, 2.5, 2.5, 2.8, 12], dtype=np.float32)
+        window = lambda a, b, c, d: ((a, b), (c, d))
+        self.assertEqual(
+            partials.window_count(energy, window(2.3, False, 2.8, False)), 2)
+        self.assertEqual(
+            partials.window_count(energy, window(2.3, True, 2.8, True)), 4)
+        self.assertEqual(partials.window_count(energy, partials.NO_WINDOW), 5)
+        self.assertEqual(
+            partials.window_count(energy, window(10, False, np.inf, False)),
+            1)
+        self.assertEqual(
+            partials.window_count(energy, window(3, False, 2, False)), 0)
+
+    def test_incremental_matches_loaded(self):
+        for name, seed in [('a1', 1), ('a2', 2), ('b1', 3)]:
+            self.write(name, seed)
+        fiducial = 'evIndex >= 0 && scintFit'
+        incremental = loader.load(self.signals(), 1, incremental=True,
+                                  cut=fiducial)
+        # Files are read once, for both the index and the partials
+        self.assertEqual(len(reads), 3)
+
+        loaded = loader.load(self.signals(), 1)
+        del reads[:]
+        for window in ['', ' && energy > 2.123456 && energy < 2.765432',
+                       ' && energy >= 9.5 && energy <= 14']:
+            cut = fiducial + window
+            for a, b in zip(counting.count(loaded, cut, 1, [1, 3]),
+                            counting.count(incremental, cut, 1, [1, 3])):
+                self.assertEqual(a[0], b[0])
+                np.testing.assert_array_equal(a[1], b[1])
+
+        # Any binning, including energies above 10 MeV
+        cut = fiducial + ' && energy < 12'
+        for leaf in loaded:
+            expected = np.histogram(
+                leaf.events['energy'][leaf.select(cut)], 37, (0.3, 14.1))[0]
+            np.testing.assert_allclose(
+                partials.fill_signals([leaf], 37, 0.3, 14.1, 1, cut)[0],
+                expected * leaf.exposure(1) / leaf.mc_events)
+        self.assertEqual(reads, [])
+
+        # Only new files are read
+        a3 = self.write('a3', 4)
+        loader.load(self.signals(), 1, incremental=True, cut=fiducial)
+        self.assertEqual(reads, [a3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from chocula import prefetch
+
+
+class TestPrefetch(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.filenames = []
+        for i in range(6):
+            filename = os.path.join(self.tmp, '%i.dat' % i)
+            with open(filename, 'wb') as f:
+                f.write('x' * (i + 1))
+            self.filenames.append(filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_order(self):
+        for depth in (0, 1, 3, 10):
+            self.assertEqual(list(prefetch.prefetch(self.filenames, depth)),
+                             self.filenames)
+
+    def test_missing_file(self):
+        filenames = self.filenames[:2] + ['/nonexistent'] + self.filenames[2:]
+        self.assertEqual(list(prefetch.prefetch(filenames, 2)), filenames)
+
+    def test_warm(self):
+        self.assertEqual(prefetch.warm(self.filenames[2], block_size=2), 3)
+
+    def test_depth(self):
+        warmed = []
+        warm = prefetch.warm
+        prefetch.warm = lambda filename: warmed.append(filename)
+        try:
+            files = prefetch.prefetch(self.filenames, depth=2, threads=2)
+            self.assertEqual(next(files), self.filenames[0])
+            time.sleep(0.1)
+            # The file being used and the next two
+            self.assertEqual(sorted(warmed), self.filenames[:3])
+            files.close()
+        finally:
+            prefetch.warm = warm
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+import unittest
+import numpy as np
+import scipy.stats
+from chocula import sensitivity
+
+
+class TestLimits(unittest.TestCase):
+    def test_no_background(self):
+        # Poisson limit for observing no events
+        self.assertAlmostEqual(sensitivity.asimov_limit(0.0), 2.302585, 5)
+        self.assertAlmostEqual(sensitivity.asimov_limit(0.0, 0.95), 2.995732,
+                               5)
+        np.testing.assert_allclose(sensitivity.asimov_limit([0, 0.1, 1]),
+                                   2.302585, 1e-6)
+
+    def test_asimov(self):
+        b = np.array([2.0, 10.0, 100.0])
+        s = sensitivity.asimov_limit(b)
+        np.testing.assert_allclose(s, [2.396519, 4.617597, 13.368721], 1e-6)
+
+        # The limits solve q(s) = 2 (s - b ln(1 + s/b)) = threshold
+        q = 2 * (s - b * np.log(1 + s / b))
+        np.testing.assert_allclose(q, scipy.stats.chi2.ppf(0.8, 1), 1e-9)
+
+    def test_gaussian(self):
+        np.testing.assert_allclose(sensitivity.gaussian_limit([0, 100]),
+                                   [0, 12.815516], 1e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
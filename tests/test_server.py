@@ -0,0 +1,89 @@
+import json
+import unittest
+import numpy as np
+from chocula.events import Events
+
+try:
+    from chocula import cuts
+    from chocula import server
+    from chocula.signals import Signal, Chain
+except ImportError:
+    server = None
+
+
+def loaded(name, chain, seed, n=5000):
+    '''A Signal with random events in memory.'''
+    r = np.random.RandomState(seed)
+    signal = Signal(name, chain, name.title(), name + '.root',
+                    [1, 2, 3, 4, 5])
+    signal.events = Events(n)
+    signal.events.fill(0, {
+        'energy': r.uniform(0, 5, n),
+        'posx': r.uniform(-6000, 6000, n),
+        'posy': r.uniform(-6000, 6000, n),
+        'posz': r.uniform(-6000, 6000, n),
+        'evIndex': r.choice([-1.0, 0.0, 1.0], n),
+        'scintFit': r.choice([0.0, 1.0], n, p=[0.1, 0.9]),
+    })
+    signal.events.finalize()
+    signal.nevents = n
+    signal.selections = cuts.SelectionCache(signal.events, n)
+    signal.mc_events = n
+    return signal
+
+
+@unittest.skipIf(server is None, 'ROOT is not available')
+class TestAnalysisServer(unittest.TestCase):
+    def setUp(self):
+        chain = Chain('U', 'U Chain')
+        chain.add_signal(loaded('bi', 'U', 2))
+        chain.add_signal(loaded('pb', 'U', 3))
+        self.signals = [loaded('sig', 'S', 1), chain]
+        self.analysis = server.AnalysisServer(self.signals)
+        self.cut = {'evIndex': 0, 'radius': [0, 3500], 'scintFit': True,
+                    'energy': [2.4, 2.6]}
+
+    def test_make_cut(self):
+        self.assertEqual(server.make_cut('energy > 1'), 'energy > 1')
+        cut = server.make_cut(self.cut)
+        # The energy window goes last, to reuse the fiducial selection
+        self.assertTrue(cut.endswith('energy > 2.400000 && energy < 2.600000'))
+        self.assertEqual(cuts.columns(cut), set(['evIndex', 'posx', 'posy',
+                                                 'posz', 'scintFit',
+                                                 'energy']))
+
+    def test_describe(self):
+        self.assertEqual(self.analysis.describe(), [
+            {'name': 'sig', 'title': 'Sig', 'chain': 'S'},
+            {'name': 'bi', 'title': 'Bi', 'chain': 'U'},
+            {'name': 'pb', 'title': 'Pb', 'chain': 'U'},
+        ])
+
+    def test_count(self):
+        counts = self.analysis.count(self.cut, [1, 2])
+        self.assertEqual([name for name, c in counts], ['sig', 'bi', 'pb'])
+        cut = server.make_cut(self.cut)
+        for (name, c), leaf in zip(counts, [self.signals[0]] +
+                                   self.signals[1].leaves()):
+            np.testing.assert_array_equal(c, leaf.count([1, 2], cut)[0][1])
+        # Results are sent as JSON
+        json.dumps(counts, default=server._to_json)
+
+    def test_histogram(self):
+        cut = dict(self.cut)
+        del cut['energy']
+        spectra = self.analysis.histogram(50, 0, 5, 2, cut)
+        self.assertEqual(spectra['names'], ['sig', 'U'])
+        self.assertEqual((spectra['xmin'], spectra['xmax']), (0, 5))
+
+        expected = np.zeros((2, 50))
+        for i, signal in enumerate(self.signals):
+            for leaf in signal.leaves():
+                expected[i] += leaf.histogram(50, 0, 5, 2,
+                                              server.make_cut(cut))
+        np.testing.assert_allclose(spectra['contents'], expected)
+        json.dumps(spectra)
+
+
+if __name__ == '__main__':
+    unittest.main()
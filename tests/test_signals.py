@@ -0,0 +1,133 @@
+import unittest
+import numpy as np
+from chocula.events import Events
+
+try:
+    from chocula import cuts
+    from chocula import counting
+    from chocula.signals import Signal, Chain
+except ImportError:
+    Signal = None
+
+
+def loaded(name, arrays, rates=(1, 2, 3, 4, 5), scale=1.0):
+    '''A Signal with events in memory.'''
+    n = len(arrays['energy'])
+    signal = Signal(name, '', name, name + '.root', list(rates), scale)
+    signal.events = Events(n)
+    signal.events.fill(0, arrays)
+    signal.events.finalize()
+    signal.nevents = n
+    signal.selections = cuts.SelectionCache(signal.events, n)
+    signal.mc_events = len(signal.select('evIndex <= 0'))
+    return signal
+
+
+@unittest.skipIf(Signal is None, 'ROOT is not available')
+class TestSignal(unittest.TestCase):
+    def setUp(self):
+        self.signal = loaded('a', {
+            'energy': np.arange(10, dtype=np.float64),
+            'evIndex': np.array([0, 1, 0, 0, -1, 0, 1, 0, 0, 0], dtype=float),
+        }, scale=2.0)
+
+    def test_exposure(self):
+        self.assertEqual(self.signal.exposure(1), 2)
+        # Interpolated within a year, with the last rate beyond the table
+        np.testing.assert_allclose(self.signal.exposure([0, 0.5, 2.5, 7]),
+                                   [0, 1, 9, 50])
+
+    def test_count(self):
+        # 8 generated events, 5 passing
+        self.assertEqual(self.signal.mc_events, 8)
+        self.assertEqual(self.signal.count(1, 'energy > 4.5'),
+                         [('a', 2 * 5 / 8.0)])
+
+        name, counts = self.signal.count([1, 2.5, 7], 'energy > 4.5')[0]
+        np.testing.assert_allclose(counts, np.array([2, 9, 50]) * 5 / 8.0)
+        self.assertEqual(self.signal.count(3, 'energy > 100'), [('a', 0.0)])
+
+    def test_chain_count(self):
+        chain = Chain('U', 'U Chain')
+        chain.add_signal(self.signal)
+        chain.add_signal(loaded('b', {
+            'energy': np.array([1.0, 6, 7]),
+            'evIndex': np.zeros(3),
+        }, rates=(3, 3, 3, 3, 3)))
+        self.assertEqual([s.name for s in chain.leaves()], ['a', 'b'])
+        counts = chain.count([1, 2], 'energy > 4.5')
+        self.assertEqual([name for name, c in counts], ['a', 'b'])
+        np.testing.assert_allclose(counts[1][1], [3 * 2 / 3.0, 6 * 2 / 3.0])
+
+    def test_bootstrap(self):
+        # 400 of 1000 generated events pass, so the replica counts are
+        # Poisson(400), scaled by exposure / generated
+        many = loaded('many', {
+            'energy': np.repeat([1.0, 2.0], [400, 600]),
+            'evIndex': np.zeros(1000),
+        })
+        replicas = many.bootstrap(4000, [1, 2], 'energy < 1.5',
+                                  np.random.RandomState(1))
+        self.assertEqual(replicas.shape, (4000, 2))
+        np.testing.assert_allclose(replicas.mean(axis=0),
+                                   [0.4, 1.2], rtol=0.01)
+        np.testing.assert_allclose(replicas.std(axis=0),
+                                   np.array([1, 3]) * 20 / 1000.0, rtol=0.05)
+
+        # Chains add the variances of their leaves
+        chain = Chain('U', 'U Chain')
+        chain.add_signal(many)
+        chain.add_signal(loaded('more', {
+            'energy': np.repeat([1.0, 2.0], [900, 100]),
+            'evIndex': np.zeros(1000),
+        }))
+        results = counting.bootstrap([chain], 'energy < 1.5', 4000, 1,
+                                     seed=1, processes=1)
+        self.assertEqual([r[0] for r in results], ['many', 'more', 'U'])
+        name, nominal, std = results[-1]
+        self.assertAlmostEqual(nominal, 1.3)
+        self.assertAlmostEqual(std, np.sqrt(1300) / 1000.0, delta=0.002)
+        self.assertEqual(results, counting.bootstrap(
+            [chain], 'energy < 1.5', 4000, 1, seed=1, processes=1))
+
+
+    def test_estimate(self):
+        r = np.random.RandomState(1)
+        n = 100000
+        signal = loaded('big', {
+            'energy': r.uniform(0, 10, n),
+            'evIndex': np.zeros(n),
+        })
+        exact = signal.count(1, 'energy < 0.5')[0][1]
+
+        # Stops at the precision, with errors that cover the exact count
+        covered = 0
+        for seed in range(100):
+            estimate, error, fraction = signal.estimate(
+                0.1, 1, 'energy < 0.5', chunk_size=1000,
+                random_state=np.random.RandomState(seed))
+            self.assertLess(fraction, 0.5)
+            self.assertLessEqual(error / estimate, 0.1)
+            covered += abs(estimate - exact) < 2 * error
+        self.assertGreaterEqual(covered, 85)
+
+        # Exact once all the events are read
+        self.assertEqual(signal.estimate(0, 1, 'energy < 0.5',
+                                         chunk_size=1000),
+                         (exact, 0, 1.0))
+
+        # Negligible counts stop at the zero bound, with an upper limit
+        estimate, error, fraction = signal.estimate(
+            0.1, 1, 'energy > 20', zero_bound=1e-3, chunk_size=1000)
+        self.assertEqual(estimate, 0)
+        self.assertLess(fraction, 1)
+        self.assertLessEqual(error, 1e-3)
+
+        results = counting.estimate([signal], 'energy < 0.5', 0.1,
+                                    chunk_size=1000, seed=1, processes=1)
+        self.assertEqual([r[0] for r in results], ['big'])
+        self.assertAlmostEqual(results[0][1], exact, delta=3 * results[0][2])
+
+
+if __name__ == '__main__':
+    unittest.main()
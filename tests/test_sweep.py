@@ -0,0 +1,134 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+try:
+    from chocula import cuts
+    from chocula import index
+    from chocula import sweep
+    from chocula import rootutils
+except ImportError:
+    sweep = None
+
+
+def read_tree(filename, tree_name='data', branches=None):
+    '''Stand-in for rootutils.read_tree, reading .npz files.'''
+    arrays = np.load(filename)
+    return dict((b, arrays[b]) for b in branches or arrays.files)
+
+
+@unittest.skipIf(sweep is None, 'ROOT is not available')
+class TestSweep(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.saved = (index.cache_dir, index.index_path, index.lock_path,
+                      rootutils.read_tree)
+        index.cache_dir = os.path.join(self.tmp, 'cache')
+        index.index_path = os.path.join(index.cache_dir, 'index.json')
+        index.lock_path = os.path.join(index.cache_dir, 'index.lock')
+        rootutils.read_tree = read_tree
+        index._index, index._index_mtime = {}, None
+
+        for name, seed, mean in [('sig', 1, 2.5), ('bkg', 2, 2.0)]:
+            r = np.random.RandomState(seed)
+            n = 3000
+            with open(os.path.join(self.tmp, name + '.root'), 'wb') as f:
+                np.savez(f, energy=r.normal(mean, 0.5, n),
+                         posx=r.uniform(-6000, 6000, n),
+                         posy=r.uniform(-6000, 6000, n),
+                         posz=r.uniform(-6000, 6000, n),
+                         evIndex=r.choice([-1.0, 0.0, 1.0], n),
+                         scintFit=r.choice([0.0, 1.0], n, p=[0.1, 0.9]))
+        self.tables = []
+        for name, rate in [('a', 10), ('b', 20)]:
+            table = os.path.join(self.tmp, name + '.csv')
+            with open(table, 'w') as f:
+                f.write('S,sig,Signal,%s,1,%s\n' % (
+                    os.path.join(self.tmp, 'sig.root'),
+                    ','.join([str(rate)] * 5)))
+                f.write('U,bkg,Bkg,%s,0.5,5,5,5,5,5\n' %
+                        os.path.join(self.tmp, 'bkg.root'))
+            self.tables.append(table)
+
+    def tearDown(self):
+        (index.cache_dir, index.index_path, index.lock_path,
+         rootutils.read_tree) = self.saved
+        index._index, index._index_mtime = {}, None
+        shutil.rmtree(self.tmp)
+
+    def test_expand(self):
+        configs = sweep.expand({'table': ['a.csv', 'b.csv'],
+                                'radius': [3000, 3500], 'energy': '2:3'})
+        self.assertEqual(len(configs), 4)
+        self.assertEqual(sorted((c['table'], c['radius']) for c in configs),
+                         [('a.csv', 3000), ('a.csv', 3500),
+                          ('b.csv', 3000), ('b.csv', 3500)])
+        self.assertEqual([c['name'] for c in configs], ['0', '1', '2', '3'])
+        self.assertEqual(configs[0]['fitter'], 'scintFit')
+        self.assertEqual(configs[0]['live_time'], 1.0)
+
+        configs = sweep.expand([{'table': 'a.csv', 'radius': '4000',
+                                 'name': 'wide'}])
+        self.assertEqual((configs[0]['name'], configs[0]['radius']),
+                         ('wide', 4000.0))
+        self.assertRaises(ValueError, sweep.expand, [{'radius': 3000}])
+
+    def test_load_grid(self):
+        grid = os.path.join(self.tmp, 'grid.csv')
+        with open(grid, 'w') as f:
+            f.write('name,table,radius,energy\n# comment\n')
+            f.write('x,a.csv,3000,2:3\ny,b.csv,,\n')
+        configs = sweep.load_grid(grid)
+        self.assertEqual([(c['name'], c['table'], c['radius'], c['energy'])
+                          for c in configs],
+                         [('x', 'a.csv', 3000.0, '2:3'),
+                          ('y', 'b.csv', 3500.0, 'm05p15')])
+
+        if sweep.yaml is not None:
+            grid = os.path.join(self.tmp, 'grid.yaml')
+            with open(grid, 'w') as f:
+                f.write('table: a.csv\nradius: [3000, 3500]\n')
+            self.assertEqual([c['radius'] for c in sweep.load_grid(grid)],
+                             [3000.0, 3500.0])
+
+    def test_evaluate(self):
+        tables = sweep.load_tables(self.tables, 1)
+        config = sweep.expand([{'table': self.tables[0], 'energy': '2:3',
+                                'live_time': 2}])[0]
+        rows, job = sweep.evaluate(config, tables[self.tables[0]])
+        self.assertEqual(job, None)
+        self.assertEqual([row['name'] for row in rows], ['sig', 'bkg'])
+        self.assertEqual((rows[0]['energy_min'], rows[0]['energy_max']),
+                         (2, 3))
+
+        cut = rootutils.make_roi_cut(3500, 'scintFit', (2, 3))
+        leaves = [leaf for signal in tables[self.tables[0]]
+                  for leaf in signal.leaves()]
+        for row, leaf in zip(rows, leaves):
+            self.assertEqual(row['count'], leaf.count(2, cut)[0][1])
+
+    def test_run_keeps_selections(self):
+        tables = sweep.load_tables(self.tables, 1)
+        load_tables = sweep.load_tables
+        sweep.load_tables = lambda names, processes: tables
+        try:
+            configs = sweep.expand({'table': self.tables, 'energy': '2:3',
+                                    'radius': [3000, 3500]})
+            rows = sweep.run(configs, 2)
+        finally:
+            sweep.load_tables = load_tables
+        self.assertEqual(len(rows), 8)
+
+        # The workers' selections are merged into the shared caches
+        for radius in (3000, 3500):
+            key = frozenset(cuts.terms(
+                rootutils.make_roi_cut(radius, 'scintFit', (2, 3))))
+            for signal in tables[self.tables[1]]:
+                for leaf in signal.leaves():
+                    self.assertIn(key, leaf.selections.selections)
+
+
+if __name__ == '__main__':
+    unittest.main()
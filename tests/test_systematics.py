@@ -0,0 +1,75 @@
+import unittest
+import numpy as np
+from chocula import systematics
+from chocula.events import Events
+
+try:
+    from chocula import cuts
+    from chocula import counting
+    from chocula import rootutils
+    from chocula.signals import Signal
+except ImportError:
+    counting = None
+
+
+def loaded(name, seed, n=20000):
+    '''A Signal with random events in memory.'''
+    r = np.random.RandomState(seed)
+    energy = r.uniform(1, 4, n)
+    # Events on the edges of windows, after rounding as in build_tcut
+    energy[:100] = 2.0000002
+    signal = Signal(name, '', name, name + '.root', [1, 2, 3, 4, 5])
+    signal.events = Events(n)
+    signal.events.fill(0, {
+        'energy': energy,
+        'posx': r.uniform(-6000, 6000, n),
+        'posy': r.uniform(-6000, 6000, n),
+        'posz': r.uniform(-6000, 6000, n),
+        'evIndex': r.choice([-1.0, 0.0, 1.0], n),
+        'scintFit': r.choice([0.0, 1.0], n, p=[0.1, 0.9]),
+    })
+    signal.events.finalize()
+    signal.nevents = n
+    signal.selections = cuts.SelectionCache(signal.events, n)
+    signal.mc_events = n // 2
+    return signal
+
+
+@unittest.skipIf(counting is None, 'ROOT is not available')
+class TestSystematics(unittest.TestCase):
+    def setUp(self):
+        self.signals = [loaded('a', 1), loaded('b', 2)]
+        self.variations = [systematics.Variation('nominal'),
+                           systematics.Variation('scale', 1.02),
+                           systematics.Variation('smear', resolution=0.05),
+                           systematics.Variation('radius', radius_shift=50)]
+        self.base = rootutils.build_tcut(evIndex=0, scintFit=True)
+
+    def test_nominal_matches_count(self):
+        for window in [(2.0, 3.0), (2.0000004, 3.0),
+                       (2.1234567, 2.7654321)]:
+            varied = systematics.count(self.signals, self.variations,
+                                       self.base, window, 3500, 2, seed=1,
+                                       processes=1)
+            counts = counting.count(
+                self.signals, rootutils.make_roi_cut(3500, 'scintFit',
+                                                     window), 1, 2)
+            for (name, c), (nominal_name, nominal) in zip(varied, counts):
+                self.assertEqual(name, nominal_name)
+                self.assertEqual(c[0], nominal)
+
+    def test_variations(self):
+        varied = dict(systematics.count(self.signals, self.variations,
+                                        self.base, (2.0, 3.0), 3500,
+                                        seed=1, processes=1))
+        # A larger radius shift moves events out of the fiducial volume
+        self.assertLess(varied['a'][3], varied['a'][0])
+        # Reproducible with a seed
+        again = dict(systematics.count(self.signals, self.variations,
+                                       self.base, (2.0, 3.0), 3500,
+                                       seed=1, processes=1))
+        np.testing.assert_array_equal(varied['a'], again['a'])
+
+
+if __name__ == '__main__':
+    unittest.main()